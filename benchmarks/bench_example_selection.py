@@ -0,0 +1,141 @@
+# benchmarks/bench_example_selection.py
+#
+# Jämför den fasta exempelblocket (de 21 första raderna) med relevansrankade exempel
+# från ExampleIndex: promptstorlek per anrop och lokal tid för att välja exempel.
+# Med --live skickas också ett urval riktiga anrop med båda varianterna för att mäta
+# latens.
+#
+#   python benchmarks/bench_example_selection.py \
+#       --input uploads/Centra_Export_Scripts_-_ties.csv --language sv
+
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from example_index import ExampleIndex  # noqa: E402
+
+FIXED_EXAMPLE_COUNT = 21
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def build_prompt(texts, language, examples):
+    payload = json.dumps(
+        [{"id": i, "text": text} for i, text in enumerate(texts)], ensure_ascii=False
+    )
+    return (
+        f"Here are examples of how display names have been translated to "
+        f"{language}:\n{examples}\n\n"
+        f"Translate each of the following display names to {language} "
+        f"according to the examples above:\n"
+        f"{payload}"
+    )
+
+
+def live_latency(prompts, language):
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    latencies = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        client.chat.completions.create(
+            model="gpt-4o-mini-2024-07-18",
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"You are a translator. Translate display names to "
+                               f"{language}."
+                },
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2
+        )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--examples', default='translation_examples.csv')
+    parser.add_argument('--input', default='uploads/Centra_Export_Scripts_-_ties.csv')
+    parser.add_argument('--language', default='sv',
+                        help='language code of the examples column')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--max-batch-examples', type=int, default=12)
+    parser.add_argument('--live', type=int, default=0, metavar='N',
+                        help='send N real requests per variant')
+    args = parser.parse_args()
+
+    target_column = f'Display name - {args.language}'
+    pairs = [
+        (row['Display Name'], row[target_column])
+        for row in read_rows(args.examples)
+        if row.get('Display Name') and row.get(target_column)
+    ]
+    texts = [
+        row['Display Name'] for row in read_rows(args.input) if row.get('Display Name')
+    ]
+    batches = [
+        texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)
+    ]
+
+    start = time.perf_counter()
+    index = ExampleIndex(pairs)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    fixed_examples = index.format(range(min(FIXED_EXAMPLE_COUNT, len(pairs))))
+    fixed_prompts = [
+        build_prompt(batch, args.language, fixed_examples) for batch in batches
+    ]
+
+    ranked_prompts = []
+    select_times = []
+    for batch in batches:
+        start = time.perf_counter()
+        examples = index.select(batch, args.top_k, args.max_batch_examples)
+        select_times.append((time.perf_counter() - start) * 1000)
+        ranked_prompts.append(build_prompt(batch, args.language, examples))
+
+    fixed_sizes = [len(prompt) for prompt in fixed_prompts]
+    ranked_sizes = [len(prompt) for prompt in ranked_prompts]
+    report = {
+        "rows": len(texts),
+        "requests": len(batches),
+        "examples_in_pool": len(pairs),
+        "index_build_ms": round(build_ms, 3),
+        "fixed": {
+            "mean_prompt_chars": round(statistics.mean(fixed_sizes), 1),
+            "approx_prompt_tokens_total": sum(fixed_sizes) // 4,
+        },
+        "ranked": {
+            "mean_prompt_chars": round(statistics.mean(ranked_sizes), 1),
+            "approx_prompt_tokens_total": sum(ranked_sizes) // 4,
+            "mean_select_ms": round(statistics.mean(select_times), 4),
+            "max_select_ms": round(max(select_times), 4),
+        },
+        "prompt_size_reduction": round(1 - sum(ranked_sizes) / sum(fixed_sizes), 3),
+    }
+
+    if args.live:
+        for name, prompts in (("fixed", fixed_prompts), ("ranked", ranked_prompts)):
+            latencies = live_latency(prompts[:args.live], args.language)
+            report[name]["mean_latency_s"] = round(statistics.mean(latencies), 3)
+            p95 = sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+            report[name]["p95_latency_s"] = round(p95, 3)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
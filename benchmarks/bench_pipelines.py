@@ -0,0 +1,309 @@
+# benchmarks/bench_pipelines.py
+#
+# Kör båda pipelinerna från början till slut mot mock_openai.py och mäter rader/s,
+# toppminne, antal anrop och tokens per rad. Varje scenario körs i en egen process
+# med tomt översättningsminne, så siffrorna går att jämföra mellan versioner.
+#
+#   python benchmarks/bench_pipelines.py --scale 20 --output bench.json
+#   python benchmarks/bench_pipelines.py --scale 20 --compare bench.json
+#
+# --compare avslutar med kod 1 om någon mätning blivit sämre än --tolerance.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = {
+    "display_names": {
+        "kind": "translate_display_names",
+        "input": "uploads/Centra_Export_Scripts_-_ties.csv",
+        "text_column": "Display Name",
+        "params": {
+            "examples_file": "examples.csv",
+            "selected_languages": ["Swedish", "German", "Norwegian"],
+        },
+    },
+    "display_names_streaming": {
+        "kind": "translate_display_names",
+        "input": "uploads/Centra_Export_Scripts_-_ties.csv",
+        "text_column": "Display Name",
+        "params": {
+            "examples_file": "examples.csv",
+            "selected_languages": ["Swedish", "German", "Norwegian"],
+            "streaming": True,
+            "chunk_size": 500,
+        },
+    },
+    "descriptions": {
+        "kind": "rewrite_descriptions_two_steps",
+        "input": "uploads/Product_descriptions_-_Blad1.csv",
+        "text_column": "Description",
+        "params": {
+            "system_prompt_1": "Shorten the text.",
+            "user_prompt_1": "Keep the measurements.",
+            "system_prompt_2": "Polish the language.",
+            "user_prompt_2": "Use a friendly tone.",
+        },
+    },
+}
+
+# Högre är bättre för rows_per_second, lägre för resten
+COMPARED = {
+    "rows_per_second": 1,
+    "peak_rss_mb": -1,
+    "requests_per_row": -1,
+    "tokens_per_row": -1,
+}
+
+
+def prepare_input(source, folder, text_column, scale):
+    # Skalar upp filen med unika texter (annars svarar översättningsminnet för
+    # kopiorna)
+    import pandas as pd
+
+    frame = pd.read_csv(os.path.join(ROOT, source), dtype=str, keep_default_na=False)
+    copies = []
+    for copy in range(scale):
+        part = frame.copy()
+        if copy:
+            text = part[text_column]
+            part[text_column] = text.where(text == '', text + f" #{copy}")
+            if 'SKU' in part:
+                part['SKU'] = part['SKU'] + f"-{copy}"
+        copies.append(part)
+    frame = pd.concat(copies, ignore_index=True)
+    frame.to_csv(os.path.join(folder, 'input.csv'), index=False)
+    shutil.copy(
+        os.path.join(ROOT, 'translation_examples.csv'),
+        os.path.join(folder, 'examples.csv')
+    )
+    return len(frame)
+
+
+def run_scenario(name, base_url, scale, max_workers, queue):
+    # Körs i en egen process: miljön måste sättas innan pipelinerna importeras
+    folder = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ['OPENAI_API_KEY'] = 'mock'
+    os.environ['TRANSLATION_MEMORY_PATH'] = os.path.join(
+        folder, 'translation_memory.sqlite3'
+    )
+    os.chdir(ROOT)
+    # Pipelinernas loggning går till stdout, som här är reserverad för rapporten
+    sys.stdout = sys.stderr
+    try:
+        scenario = SCENARIOS[name]
+        rows = prepare_input(
+            scenario["input"], folder, scenario["text_column"], scale
+        )
+
+        import metrics
+        from jobs import pipeline
+
+        params = dict(
+            scenario["params"],
+            upload_folder=folder, input_file='input.csv', delta=False
+        )
+        if max_workers:
+            params['max_workers'] = max_workers
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        job_metrics = metrics.JobMetrics()
+        token = metrics.current_job.set(job_metrics)
+        events = {"errors": 0, "complete": False}
+        start = time.perf_counter()
+        try:
+            for message in pipeline(scenario["kind"])(**params):
+                event = json.loads(message)
+                if event.get("error"):
+                    events["errors"] += 1
+                if event.get("complete"):
+                    events["complete"] = True
+        finally:
+            metrics.current_job.reset(token)
+        seconds = time.perf_counter() - start
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        summary = job_metrics.summary()
+        queue.put({
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / seconds, 2) if seconds else None,
+            # ru_maxrss är i kB på Linux
+            "peak_rss_mb": round(peak_rss / 1024, 1),
+            "import_rss_mb": round(baseline_rss / 1024, 1),
+            "complete": events["complete"],
+            "error_events": events["errors"],
+            "latency_p50": summary["latency_p50"],
+            "latency_p95": summary["latency_p95"],
+            "retries": summary["retries"],
+            "csv_read_seconds": summary["csv_read_seconds"],
+            "csv_write_seconds": summary["csv_write_seconds"],
+            "sleep_seconds": summary["sleep_seconds"],
+        })
+    except Exception as e:
+        queue.put({"error": str(e)})
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def start_mock(args):
+    command = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_openai.py'),
+        '--port', '0',
+        '--latency', args.latency, '--token-latency', str(args.token_latency),
+        '--rate-limit-rate', str(args.rate_limit_rate),
+        '--error-rate', str(args.error_rate),
+        '--rpm', str(args.rpm), '--tpm', str(args.tpm), '--seed', str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    base_url = json.loads(process.stdout.readline())["listening"]
+    return process, base_url
+
+
+def mock_request(base_url, path, method='GET'):
+    root = base_url.rsplit('/v1', 1)[0]
+    data = b'{}' if method == 'POST' else None
+    request = urllib.request.Request(root + path, data=data, method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    # Jämför mot en tidigare rapport; returnerar lista med försämringar
+    regressions = []
+    previous = {result["scenario"]: result for result in baseline.get("results", [])}
+    for result in report["results"]:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        for field, direction in COMPARED.items():
+            old, new = before.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction < -tolerance:
+                regressions.append({
+                    "scenario": result["scenario"], "metric": field,
+                    "before": old, "after": new, "change": round(change, 3),
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end throughput benchmark against a mock OpenAI server"
+    )
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default all)')
+    parser.add_argument('--scale', type=int, default=10,
+                        help='repeat each input file this many times')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs per scenario; the best run is reported')
+    parser.add_argument('--max-workers', type=int, default=0,
+                        help='override the pipelines\' concurrency')
+    parser.add_argument('--latency', default='lognormal:0.3,0.4')
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=int, default=0)
+    parser.add_argument('--tpm', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output',
+                        help='write the JSON report to this file')
+    parser.add_argument('--compare',
+                        help='earlier JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative change before a regression')
+    args = parser.parse_args()
+
+    mock, base_url = start_mock(args)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for name in args.scenario or sorted(SCENARIOS):
+            best = None
+            for _ in range(args.repeat):
+                mock_request(base_url, '/reset', 'POST')
+                queue = context.Queue()
+                process = context.Process(
+                    target=run_scenario,
+                    args=(name, base_url, args.scale, args.max_workers, queue)
+                )
+                process.start()
+                result = queue.get()
+                process.join()
+                stats = mock_request(base_url, '/stats')
+                if "error" in result:
+                    result = {"error": result["error"]}
+                else:
+                    tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+                    result.update({
+                        "requests": stats["requests"],
+                        "requests_per_row": round(
+                            stats["requests"] / result["rows"], 4
+                        ),
+                        "rate_limited": stats["rate_limited"],
+                        "server_errors": stats["errors"],
+                        "max_in_flight": stats["max_in_flight"],
+                        "prompt_tokens": stats["prompt_tokens"],
+                        "completion_tokens": stats["completion_tokens"],
+                        "tokens_per_row": round(tokens / result["rows"], 2),
+                    })
+                speed = result.get("rows_per_second") or 0
+                if best is None or speed > (best.get("rows_per_second") or 0):
+                    best = result
+            results.append(dict(best, scenario=name))
+            print(f"{name}: {json.dumps(best)}", file=sys.stderr)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'compare')
+        },
+        "results": results,
+    }
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
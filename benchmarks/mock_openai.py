@@ -0,0 +1,348 @@
+# benchmarks/mock_openai.py
+#
+# Lokal OpenAI-kompatibel server för benchmarks: /v1/chat/completions (även stream=True)
+# svarar i samma format som pipelinerna förväntar sig, med inställbar latens, 429:or,
+# serverfel och tokenräkning. GET /stats ger räknarna, POST /reset nollställer dem.
+#
+#   python benchmarks/mock_openai.py --port 8099 --latency lognormal:0.4,0.5 \
+#       --rate-limit-rate 0.02
+#   OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=mock python main.py
+
+import argparse
+import contextlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BATCH_PATTERN = re.compile(r'according to the examples above:\n(\[.*?\])\n\n', re.S)
+SINGLE_PATTERN = re.compile(r"Original display name: '(.*)'\. Translate", re.S)
+WINDOW_SECONDS = 60.0
+
+
+def parse_latency(spec, rng):
+    # "fixed:0.3", "uniform:0.1,0.8" eller "lognormal:<median>,<sigma>" (sekunder),
+    # dragna ur rng
+    kind, _, values = spec.partition(':')
+    numbers = [float(value) for value in values.split(',') if value]
+    if kind == 'fixed':
+        return lambda: numbers[0]
+    if kind == 'uniform':
+        return lambda: rng.uniform(numbers[0], numbers[1])
+    if kind == 'lognormal':
+        return lambda: rng.lognormvariate(math.log(numbers[0]), numbers[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def count_tokens(text):
+    # Samma grova uppskattning som request_scheduler: ungefär fyra tecken per token
+    return max(1, len(text) // 4)
+
+
+def fake_reply(messages):
+    # Svar i det format respektive prompt ber om, så att pipelinernas parsning går
+    # igenom
+    prompt = messages[-1]["content"] if messages else ""
+    if 'Original text:\n' in prompt:
+        original = prompt.split('Original text:\n', 1)[1].split('\n\nRewrite', 1)[0]
+        return f"Rewritten: {original.strip()}"
+    match = BATCH_PATTERN.search(prompt)
+    if match:
+        items = json.loads(match.group(1))
+        if 'language codes: ' in prompt:
+            codes = prompt.rsplit('language codes: ', 1)[1].strip().rstrip('.')
+            return json.dumps({"items": [
+                {
+                    "id": item["id"],
+                    "translations": {
+                        code: f"[{code}] {item['text']}" for code in codes.split(', ')
+                    }
+                }
+                for item in items
+            ]}, ensure_ascii=False)
+        return json.dumps([
+            {"id": item["id"], "translation": f"~{item['text']}"} for item in items
+        ], ensure_ascii=False)
+    match = SINGLE_PATTERN.search(prompt)
+    if match:
+        return f"~{match.group(1)}"
+    return prompt[:200]
+
+
+class MockState:
+    def __init__(self, latency='lognormal:0.3,0.4', token_latency=0.0,
+                 rate_limit_rate=0.0, error_rate=0.0, rpm=0, tpm=0, seed=None):
+        self.token_latency = token_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        # Alla slumpdragningar (latens, 429:or, fel) kommer från samma seedade generator
+        self.random = random.Random(seed)
+        self.latency = parse_latency(latency, self.random)
+        self.lock = threading.Lock()
+        self.window = deque()  # (tidpunkt, tokens) för anrop inom den senaste minuten
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stats = {
+                "requests": 0,
+                "ok": 0,
+                "streamed": 0,
+                "rate_limited": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "in_flight": 0,
+                "max_in_flight": 0,
+                "models": {},
+            }
+            self.window.clear()
+
+    def next_latency(self):
+        with self.lock:
+            return self.latency()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(
+                self.stats, models=dict(self.stats["models"]),
+                seconds=round(time.time() - self.started, 3)
+            )
+
+    def admit(self, prompt_tokens):
+        # Avgör om anropet ska få 429, 500 eller gå igenom; returnerar (status,
+        # kvarvarande kvot)
+        now = time.monotonic()
+        with self.lock:
+            self.stats["requests"] += 1
+            while self.window and self.window[0][0] < now - WINDOW_SECONDS:
+                self.window.popleft()
+            used_requests = len(self.window)
+            used_tokens = sum(tokens for _, tokens in self.window)
+            over_limit = (
+                (self.rpm and used_requests >= self.rpm)
+                or (self.tpm and used_tokens + prompt_tokens > self.tpm)
+            )
+            if over_limit or self.random.random() < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                reset = 1.0
+                if over_limit and self.window:
+                    reset = self.window[0][0] + WINDOW_SECONDS - now
+                return 429, used_requests, used_tokens, reset
+            if self.random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 500, used_requests, used_tokens, 0.0
+            self.window.append((now, prompt_tokens))
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(
+                self.stats["max_in_flight"], self.stats["in_flight"]
+            )
+            return 200, used_requests + 1, used_tokens + prompt_tokens, 0.0
+
+    def finish(self, model, prompt_tokens, completion_tokens, streamed):
+        with self.lock:
+            self.stats["in_flight"] -= 1
+            self.stats["ok"] += 1
+            self.stats["streamed"] += int(streamed)
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+            per_model = self.stats["models"].setdefault(
+                model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            per_model["requests"] += 1
+            per_model["prompt_tokens"] += prompt_tokens
+            per_model["completion_tokens"] += completion_tokens
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, _format, *_args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.state.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') == '/reset':
+            self.state.reset()
+            self._send_json(200, {"reset": True})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        model = body.get("model", "mock")
+        messages = body.get("messages", [])
+        prompt_tokens = sum(
+            count_tokens(message.get("content") or "") for message in messages
+        )
+        status, used_requests, used_tokens, reset = self.state.admit(prompt_tokens)
+        headers = self._limit_headers(used_requests, used_tokens, reset)
+        if status == 429:
+            headers['retry-after'] = f"{max(reset, 0.05):.2f}"
+            self._send_json(429, {"error": {
+                "message": "Rate limit reached (mock)",
+                "type": "requests",
+                "code": "rate_limit_exceeded"
+            }}, headers)
+            return
+        if status == 500:
+            self._send_json(500, {"error": {
+                "message": "Internal server error (mock)",
+                "type": "server_error"
+            }}, headers)
+            return
+
+        streamed = bool(body.get("stream"))
+        completion_tokens = 0
+        try:
+            text = fake_reply(messages)
+            completion_tokens = count_tokens(text)
+            time.sleep(self.state.next_latency())
+            if streamed:
+                self._stream(model, text, prompt_tokens, completion_tokens, headers)
+            else:
+                time.sleep(self.state.token_latency * completion_tokens)
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    },
+                }, headers)
+        finally:
+            self.state.finish(model, prompt_tokens, completion_tokens, streamed)
+
+    def _limit_headers(self, used_requests, used_tokens, reset):
+        headers = {}
+        if self.state.rpm:
+            headers['x-ratelimit-limit-requests'] = str(self.state.rpm)
+            remaining = max(self.state.rpm - used_requests, 0)
+            headers['x-ratelimit-remaining-requests'] = str(remaining)
+            headers['x-ratelimit-reset-requests'] = f"{reset:.2f}s"
+        if self.state.tpm:
+            headers['x-ratelimit-limit-tokens'] = str(self.state.tpm)
+            remaining = max(self.state.tpm - used_tokens, 0)
+            headers['x-ratelimit-remaining-tokens'] = str(remaining)
+            headers['x-ratelimit-reset-tokens'] = f"{reset:.2f}s"
+        return headers
+
+    def _stream(self, model, text, prompt_tokens, completion_tokens, headers):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        # Texten skickas i delar om ungefär fyra tokens, med token-latensen mellan
+        # delarna
+        step = 16
+        for start in range(0, len(text), step):
+            part = text[start:start + step]
+            time.sleep(self.state.token_latency * count_tokens(part))
+            self._chunk(completion_id, model, [
+                {"index": 0, "delta": {"content": part}, "finish_reason": None}
+            ])
+        self._chunk(completion_id, model, [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}
+        ])
+        self._chunk(completion_id, model, [], {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _chunk(self, completion_id, model, choices, usage=None):
+        event = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": usage
+        }
+        data = json.dumps(event, ensure_ascii=False)
+        self._write_chunk(f"data: {data}\n\n".encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(host='127.0.0.1', port=0, **settings):
+    handler = type('Handler', (MockHandler,), {"state": MockState(**settings)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible mock server for benchmarks"
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default='lognormal:0.3,0.4',
+                        help='fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        help='extra seconds per completion token')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='share of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests answered with 500')
+    parser.add_argument('--rpm', type=int, default=0,
+                        help='requests per minute before 429 (0 = unlimited)')
+    parser.add_argument('--tpm', type=int, default=0,
+                        help='prompt tokens per minute before 429 (0 = unlimited)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, latency=args.latency, token_latency=args.token_latency,
+        rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+        rpm=args.rpm, tpm=args.tpm, seed=args.seed
+    )
+    # Första raden är maskinläsbar så att benchmarken kan läsa porten när --port 0
+    # används
+    url = f"http://{args.host}:{server.server_address[1]}/v1"
+    print(json.dumps({"listening": url}), flush=True)
+    with contextlib.suppress(KeyboardInterrupt):
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# delta.py
+
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+from csv_stream import iter_chunks, needs_work, read_csv
+
+SNAPSHOT_FOLDER = 'catalogs'
+MAX_SNAPSHOTS = int(os.getenv('DELTA_MAX_SNAPSHOTS', '50'))
+# Andel av radernas SKU/Product ID som måste finnas i en tidigare utfil för att den
+# ska räknas som samma katalog
+MIN_OVERLAP = float(os.getenv('DELTA_MIN_OVERLAP', '0.5'))
+DELTA_MODE = os.getenv('DELTA_MODE', '1') != '0'
+ID_COLUMNS = ('SKU', 'Product ID')
+
+
+def _id_column(columns):
+    for column in ID_COLUMNS:
+        if column in columns:
+            return column
+    return None
+
+
+def row_keys(frame, source_column):
+    # SKU (eller Product ID) + hash av källtexten; ändrad text ger en ny nyckel.
+    # Tab som avgränsare: pandas tappar '\x00' vid strängsammanfogning.
+    id_column = _id_column(frame.columns)
+    if id_column:
+        ids = frame[id_column].astype(str)
+    else:
+        ids = pd.Series('', index=frame.index)
+    digests = frame[source_column].fillna('').astype(str).map(
+        lambda text: hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
+    )
+    return ids + '\t' + digests
+
+
+def _key_hashes(keys):
+    # 64-bitars hash per radnyckel: räcker för att sålla bort rader som inte behövs,
+    # själva matchningen görs sedan på hela nyckeln
+    return pd.util.hash_pandas_object(keys, index=False)
+
+
+class PreviousResults:
+    def __init__(self, path, previous_df, source_column, result_columns):
+        self.path = path
+        self.source_column = source_column
+        keys = row_keys(previous_df, source_column)
+        self.columns = {}
+        for column in result_columns:
+            if column in previous_df.columns:
+                values = previous_df[column].where(~needs_work(previous_df[column]))
+                series = pd.Series(values.values, index=keys.values).dropna()
+                self.columns[column] = series[~series.index.duplicated(keep='last')]
+
+    def _matches(self, frame):
+        # (kolumn, mask, värden) för tomma celler i rader vars nyckel är oförändrad
+        if not self.columns:
+            return
+        keys = row_keys(frame, self.source_column)
+        for column, previous in self.columns.items():
+            if column not in frame.columns:
+                continue
+            mapped = keys.map(previous)
+            fill = needs_work(frame[column]) & mapped.notna()
+            if fill.any():
+                yield column, fill, mapped
+
+    def apply(self, frame):
+        # Fyller i frame direkt; returnerar antal återanvända rader
+        reused = pd.Series(False, index=frame.index)
+        for column, fill, mapped in self._matches(frame):
+            frame.loc[fill, column] = mapped[fill]
+            reused |= fill
+        return int(reused.sum())
+
+    def cells(self, frame):
+        # Samma matchning men som {(radindex, kolumn): text}, för pipelines som
+        # bestämmer själva
+        return {
+            (index, column): value
+            for column, fill, mapped in self._matches(frame)
+            for index, value in mapped[fill].items()
+        }
+
+
+def _snapshots(upload_folder, kind):
+    pattern = os.path.join(upload_folder, SNAPSHOT_FOLDER, f"{kind}-*.csv")
+    return sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+
+
+def load_previous_results(upload_folder, kind, input_csv, source_column,
+                          result_columns):
+    # Letar upp den senaste utfilen för samma katalog, matchad på överlapp i
+    # SKU/Product ID
+    snapshots = _snapshots(upload_folder, kind)
+    if not snapshots:
+        return None
+
+    input_ids = read_csv(
+        input_csv, dtype=str, usecols=lambda column: column in ID_COLUMNS
+    )
+    id_column = _id_column(input_ids.columns)
+    if id_column is None:
+        return None
+    ids = set(input_ids[id_column].dropna())
+    if not ids:
+        return None
+
+    best_path, best_overlap = None, 0.0
+    for path in snapshots:
+        try:
+            previous_ids = read_csv(
+                path, dtype=str, usecols=lambda column: column == id_column
+            )
+        except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError):
+            continue
+        if id_column not in previous_ids.columns:
+            continue
+        overlap = len(ids & set(previous_ids[id_column].dropna())) / len(ids)
+        if overlap > best_overlap:
+            best_path, best_overlap = path, overlap
+
+    if best_path is None or best_overlap < MIN_OVERLAP:
+        return None
+
+    logging.info(
+        f"Delta mode: using {best_path} "
+        f"({best_overlap:.0%} of rows share {id_column})"
+    )
+
+    # Bara en hash per nyckel i indata hålls i minnet, och utfilen läses i chunkar
+    # där bara rader vars nyckel finns i indata och de kolumner som behövs sparas.
+    # Samma dtype som pipelinerna läser indata med, så att nycklarna blir lika.
+    input_columns = (*ID_COLUMNS, source_column)
+    wanted = pd.Index(pd.concat([
+        _key_hashes(row_keys(chunk, source_column))
+        for chunk in iter_chunks(
+            input_csv, dtype={'SKU': str},
+            usecols=lambda column: column in input_columns
+        )
+    ]).unique())
+    previous_columns = (id_column, source_column, *result_columns)
+    parts = []
+    for chunk in iter_chunks(
+        best_path, dtype=str, usecols=lambda column: column in previous_columns
+    ):
+        if source_column not in chunk.columns:
+            logging.warning(f"Delta mode: {best_path} has no {source_column} column")
+            return None
+        keep = _key_hashes(row_keys(chunk, source_column)).isin(wanted)
+        parts.append(chunk[keep.values])
+    if not parts:
+        return None
+    previous_df = pd.concat(parts, ignore_index=True)
+    return PreviousResults(best_path, previous_df, source_column, result_columns)
+
+
+def save_snapshot(upload_folder, kind, output_path):
+    folder = os.path.join(upload_folder, SNAPSHOT_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    snapshot = os.path.join(folder, f"{kind}-{stamp}-{uuid.uuid4().hex[:8]}.csv")
+    shutil.copyfile(output_path, snapshot)
+
+    for stale in _snapshots(upload_folder, kind)[MAX_SNAPSHOTS:]:
+        os.remove(stale)
+    return snapshot
@@ -0,0 +1,102 @@
+# example_index.py
+
+import hashlib
+import math
+import re
+from collections import Counter
+
+NGRAM_SIZES = (2, 3, 4)
+# En batch får ett exempel till per så här många rader, utöver k
+ROWS_PER_EXTRA_EXAMPLE = 10
+
+
+def _ngrams(text):
+    text = " " + re.sub(r"\s+", " ", str(text).lower()).strip() + " "
+    grams = Counter()
+    for size in NGRAM_SIZES:
+        for i in range(len(text) - size + 1):
+            grams[text[i:i + size]] += 1
+    return grams
+
+
+class ExampleIndex:
+    # TF-IDF över tecken-n-gram i 'Display Name', byggs en gång per exempelfil och språk
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.fingerprint = hashlib.sha256(
+            "\n".join(f"{source}\t{target}" for source, target in pairs).encode("utf-8")
+        ).hexdigest()
+
+        doc_grams = [_ngrams(source) for source, _ in pairs]
+        doc_freq = Counter()
+        for grams in doc_grams:
+            doc_freq.update(grams.keys())
+        total = len(pairs)
+        self.idf = {
+            gram: math.log((1 + total) / (1 + freq)) + 1
+            for gram, freq in doc_freq.items()
+        }
+
+        # Inverterat index: n-gram -> [(exempel, normaliserad vikt)]
+        self.postings = {}
+        for position, grams in enumerate(doc_grams):
+            weights = {gram: count * self.idf[gram] for gram, count in grams.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                self.postings.setdefault(gram, []).append((position, weight / norm))
+
+    @classmethod
+    def from_dataframe(cls, examples_df, target_column):
+        examples = examples_df[['Display Name', target_column]].dropna()
+        sources = examples['Display Name'].astype(str)
+        targets = examples[target_column].astype(str)
+        return cls(list(zip(sources, targets, strict=True)))
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def scores(self, query):
+        grams = _ngrams(query)
+        weights = {
+            gram: count * self.idf[gram]
+            for gram, count in grams.items() if gram in self.idf
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        scores = Counter()
+        for gram, weight in weights.items():
+            for position, doc_weight in self.postings[gram]:
+                scores[position] += weight / norm * doc_weight
+        return scores
+
+    def top_k(self, queries, k, max_examples=None):
+        # Varje fråga bidrar med sina k bästa exempel; unionen sorteras efter bästa
+        # poäng.
+        # Taket växer långsamt med batchen (k för en rad) men aldrig över max_examples.
+        best = {}
+        for query in queries:
+            if not isinstance(query, str) or not query.strip():
+                continue
+            for position, score in self.scores(query).most_common(k):
+                if score > best.get(position, 0.0):
+                    best[position] = score
+        ranked = sorted(best, key=lambda position: (-best[position], position))
+        if max_examples is not None:
+            cap = k + len(queries) // ROWS_PER_EXTRA_EXAMPLE
+            ranked = ranked[:min(max_examples, cap)]
+
+        # Fyll på med de första exemplen om frågorna saknar gemensamma n-gram med filen
+        for position in range(len(self.pairs)):
+            if len(ranked) >= min(k, len(self.pairs)):
+                break
+            if position not in best:
+                ranked.append(position)
+        return ranked
+
+    def format(self, positions):
+        return "\n".join(
+            f"Original: {source} -> Translated: {target}"
+            for source, target in (self.pairs[position] for position in positions)
+        )
+
+    def select(self, queries, k, max_examples=None):
+        return self.format(self.top_k(queries, k, max_examples))
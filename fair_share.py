@@ -0,0 +1,86 @@
+# fair_share.py
+
+import contextvars
+import json
+import os
+from threading import Lock
+
+# Högre prioritet går alltid först; inom samma prioritet delas kvoten efter vikt
+PRIORITIES = {'low': 0, 'normal': 1, 'high': 2}
+DEFAULT_PRIORITY = 'normal'
+# Högst så många samtidiga anrop per användare och modell (0 = ingen gräns)
+USER_MAX_IN_FLIGHT = int(os.getenv('FAIR_SHARE_USER_MAX_IN_FLIGHT', '0'))
+# Per användare, t.ex. {"anna": {"weight": 2, "max_in_flight": 16}}
+USER_SETTINGS = json.loads(os.getenv('FAIR_SHARE_USERS', '{}'))
+
+
+class Share:
+    # Ett jobbs andel av den delade API-kvoten. finish är jobbets virtuella tid per
+    # modell: den ökar med förbrukade tokens delat med vikten, och det väntande
+    # anropet med lägst virtuell tid får nästa lediga plats (start-time fair
+    # queueing).
+    def __init__(self, job_id=None, user=None, weight=1.0, priority=DEFAULT_PRIORITY,
+                 max_in_flight=0):
+        self.job_id = job_id
+        self.user = user
+        self.weight = max(float(weight), 0.01)
+        self.priority = priority
+        self.rank = PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY])
+        self.max_in_flight = max_in_flight
+        self.finish = {}
+        self.requests = 0
+        self.tokens = 0
+
+    def snapshot(self):
+        return {
+            "job_id": self.job_id,
+            "user": self.user,
+            "weight": self.weight,
+            "priority": self.priority,
+            "requests": self.requests,
+            "tokens": self.tokens,
+        }
+
+
+# Anrop utanför jobb (t.ex. benchmarks) delar en gemensam andel
+DEFAULT_SHARE = Share()
+current_share = contextvars.ContextVar('current_share', default=None)
+
+_active = {}
+_active_lock = Lock()
+
+
+def share_for_job(job_id, user=None, priority=DEFAULT_PRIORITY):
+    settings = USER_SETTINGS.get(user or '', {})
+    return Share(
+        job_id,
+        user,
+        weight=settings.get('weight', 1.0),
+        priority=priority if priority in PRIORITIES else DEFAULT_PRIORITY,
+        max_in_flight=int(settings.get('max_in_flight', USER_MAX_IN_FLIGHT)),
+    )
+
+
+def current():
+    return current_share.get() or DEFAULT_SHARE
+
+
+def register(share):
+    with _active_lock:
+        _active[share.job_id] = share
+
+
+def unregister(share):
+    with _active_lock:
+        _active.pop(share.job_id, None)
+
+
+def active_shares():
+    with _active_lock:
+        return [share.snapshot() for share in _active.values()]
+
+
+def get_share(job_id):
+    with _active_lock:
+        share = _active.get(job_id)
+    return share.snapshot() if share is not None else None
@@ -0,0 +1,124 @@
+# glossary.py
+
+import csv
+import logging
+import os
+import re
+from threading import Lock
+
+GLOSSARY_FILE = os.getenv('TRANSLATION_GLOSSARY_PATH', 'translation_dictionary.csv')
+
+# Ord som består av siffror/skiljetecken översätts inte utan förs över som de är
+PASSTHROUGH_TOKEN = re.compile(r"^[\d.,/%x×+\-]+$", re.IGNORECASE)
+TOKEN = re.compile(r"\S+")
+
+_glossaries = {}
+_glossary_lock = Lock()
+
+
+class Glossary:
+    # Ord-trie över glossarfraser. Ett namn översätts lokalt bara om en enda fras
+    # täcker det, eventuellt med siffer-/måttord runt om. Namn som kräver flera fraser
+    # skickas till modellen: fraserna översatta var för sig i engelsk ordning blir
+    # sällan grammatiska.
+    def __init__(self, entries, extra_entries=()):
+        self.root = {}
+        self.size = 0
+        # Glossarfilens egna termer (utan jobbets exempelpar) används också av
+        # valideringen
+        self.terms = tuple(
+            (source.strip(), target.strip())
+            for source, target in entries if target.strip()
+        )
+        for source, target in list(entries) + list(extra_entries):
+            words = source.lower().split()
+            if not words or not target.strip():
+                continue
+            node = self.root
+            for word in words:
+                node = node.setdefault(word, {})
+            node[None] = target.strip()
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def translate(self, text):
+        if not isinstance(text, str) or not text.strip() or not self.size:
+            return None
+
+        words = TOKEN.findall(text)
+        lowered = [word.lower() for word in words]
+        parts = []
+        phrases = 0
+        position = 0
+        while position < len(words):
+            node = self.root
+            match_end, match = None, None
+            for end in range(position, len(words)):
+                node = node.get(lowered[end])
+                if node is None:
+                    break
+                if None in node:
+                    match_end, match = end + 1, node[None]
+
+            if match is not None:
+                phrases += 1
+                if phrases > 1:
+                    return None
+                parts.append(match)
+                position = match_end
+            elif PASSTHROUGH_TOKEN.match(words[position]):
+                parts.append(words[position])
+                position += 1
+            else:
+                return None
+
+        if not phrases:
+            return None
+        translated = " ".join(parts)
+        if words[0][:1].isupper():
+            translated = translated[:1].upper() + translated[1:]
+        return translated
+
+
+def _read_glossary_file(path):
+    # {språkkod: [(original, översättning)]}
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return entries
+        codes = [code.strip() for code in header[1:]]
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            # Rader kan sakna tomma celler i slutet; de språken hoppas över
+            for code, value in zip(codes, row[1:], strict=False):
+                if value.strip():
+                    entries.setdefault(code, []).append((row[0].strip(), value))
+    return entries
+
+
+def get_glossary(lang_code, extra_entries=(), path=GLOSSARY_FILE):
+    # Kompileras en gång per fil, filversion och språk; extra_entries (t.ex.
+    # exempelparen för jobbet) läggs till som hela fraser.
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    extra_entries = tuple(extra_entries)
+    key = (path, mtime, lang_code, hash(extra_entries))
+    with _glossary_lock:
+        glossary = _glossaries.get(key)
+        if glossary is None:
+            entries = _read_glossary_file(path).get(lang_code, [])
+            glossary = Glossary(entries, extra_entries)
+            # Behåll bara senaste versionen per fil och språk
+            for stale in [k for k in _glossaries if k[0] == path and k[2] == lang_code]:
+                del _glossaries[stale]
+            _glossaries[key] = glossary
+            logging.info(
+                f"Compiled glossary for {lang_code} with {len(glossary)} phrases"
+            )
+        return glossary
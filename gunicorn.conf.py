@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+#
+# Produktionsläge:
+#   poetry install --extras production
+#   gunicorn -c gunicorn.conf.py 'main:create_app()'
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# gevent: varje öppen SSE-ström är en greenlet i stället för en tråd, så hundratals
+# progress-strömmar kan vara öppna samtidigt. Väntan i JobRunner.stream och API-anropen
+# (httpx) blir kooperativa när gunicorn monkey-patchar standardbiblioteket.
+worker_class = 'gevent'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+
+# En process: jobben körs i serverprocessen och avbrutna jobb återupptas vid start,
+# vilket bara en ägare får göra. Skala med worker_connections, inte workers.
+workers = 1
+
+# Strömmar kan vara öppna länge; gevent-workern skickar sina heartbeats själv
+timeout = 120
+graceful_timeout = 30
+keepalive = 75
+
+accesslog = '-'
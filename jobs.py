@@ -0,0 +1,373 @@
+# jobs.py
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+
+import fair_share
+import metrics
+import sharding
+
+JOB_STORE_FILE = os.getenv('JOB_STORE_PATH', 'jobs.sqlite3')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+KEEPALIVE_SECONDS = 15
+# Ett jobb vars process inte förnyat leasen på så här länge tas över av en annan
+# process
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))
+
+FINISHED_STATUSES = ('completed', 'failed', 'interrupted')
+
+
+def pipeline(kind):
+    # Importeras först när ett jobb körs, precis som i routes i main.py
+    if kind == 'rewrite_descriptions_two_steps':
+        from translate_descriptions import rewrite_descriptions_two_steps_function
+        return rewrite_descriptions_two_steps_function
+    if kind == 'translate_display_names':
+        from translate_display_names import translate_display_names_function
+        return translate_display_names_function
+    raise ValueError(f"Unknown job kind: {kind}")
+
+
+class JobStore:
+    def __init__(self, path=JOB_STORE_FILE):
+        self.path = path
+        self.lock = Lock()
+        # Väcker SSE-lyssnare i samma process direkt när ett nytt event sparats
+        self.changed = Condition(self.lock)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    user TEXT,
+                    priority TEXT NOT NULL DEFAULT 'normal',
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+            # Databaser från före prioriteringen saknar kolumnen
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+            if 'priority' not in columns:
+                self.conn.execute(
+                    "ALTER TABLE jobs "
+                    "ADD COLUMN priority TEXT NOT NULL DEFAULT 'normal'"
+                )
+            if 'owner' not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+            self.conn.commit()
+
+    def create(self, kind, params, user=None, priority=fair_share.DEFAULT_PRIORITY,
+               owner=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, params, user, priority, status, "
+                "created_at, updated_at, owner, lease_expires) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (
+                    job_id, kind, json.dumps(params), user, priority, now, now, owner,
+                    now + JOB_LEASE_SECONDS
+                )
+            )
+            self.conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, kind, params, user, priority, status, created_at, "
+                "updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "kind": row[1], "params": json.loads(row[2]), "user": row[3],
+            "priority": row[4], "status": row[5], "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def set_status(self, job_id, status):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (status, time.time(), job_id)
+            )
+            self.conn.commit()
+            self.changed.notify_all()
+
+    def append_event(self, job_id, data):
+        with self.lock:
+            seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)",
+                (job_id, seq, data)
+            )
+            self.conn.commit()
+            self.changed.notify_all()
+        return seq
+
+    def events_after(self, job_id, seq):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? "
+                "ORDER BY seq",
+                (job_id, seq)
+            ).fetchall()
+
+    def wait_for_change(self, timeout):
+        with self.changed:
+            self.changed.wait(timeout)
+
+    def unfinished(self):
+        # Ej avslutade jobb utan levande ägare: processen som körde dem har startats om
+        # eller dött
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, params, user, priority FROM jobs "
+                "WHERE status IN ('queued', 'running') "
+                "AND (owner IS NULL OR lease_expires < ?) ORDER BY created_at",
+                (time.time(),)
+            ).fetchall()
+        return [
+            (job_id, kind, json.loads(params), user, priority)
+            for job_id, kind, params, user, priority in rows
+        ]
+
+    def claim(self, job_id, owner):
+        # Atomiskt: när flera processer delar databasen får bara en av dem jobbet
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET owner = ?, lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running') "
+                "AND (owner IS NULL OR lease_expires < ?)",
+                (owner, now + JOB_LEASE_SECONDS, now, job_id, now)
+            )
+            self.conn.commit()
+        return cursor.rowcount == 1
+
+    def input_files(self):
+        # Uppladdade filer (relativt upload_folder) som ej avslutade jobb läser; de får
+        # inte rensas ur uppladdningsförrådet hur länge jobbet än tar
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT params FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        files = set()
+        for (params,) in rows:
+            params = json.loads(params)
+            for key in ('input_file', 'examples_file'):
+                if params.get(key):
+                    files.add(params[key])
+        return files
+
+    def renew(self, job_ids, owner):
+        expires = time.time() + JOB_LEASE_SECONDS
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ?",
+                [(expires, job_id, owner) for job_id in job_ids]
+            )
+            self.conn.commit()
+
+
+class JobRunner:
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='job'
+        )
+        # Senaste deltexten per jobb: {job_id: (löpnummer, data)}. Sparas inte i
+        # databasen, en lyssnare som missar en bit får bara nästa, mer kompletta text.
+        self.partials = {}
+        # Den här processens jobb (köade och pågående); deras leaser förnyas av maintain
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.active = set()
+        self.active_lock = Lock()
+
+    def submit(self, kind, params, user=None, priority=fair_share.DEFAULT_PRIORITY):
+        # Okänd typ ska ge fel direkt vid uppladdning, inte i arbetstråden
+        pipeline(kind)
+        job_id = self.store.create(kind, params, user, priority, self.owner)
+        self._start(job_id, kind, params, user, priority)
+        logging.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def _start(self, job_id, kind, params, user, priority):
+        with self.active_lock:
+            self.active.add(job_id)
+        self.executor.submit(self._run, job_id, kind, params, user, priority)
+
+    def resume_unfinished(self):
+        # Pipelinerna läser tillbaka sina resultatjournaler, så ett återupptaget jobb
+        # fortsätter där det var och betalar inte för samma anrop igen. Varje jobb tas
+        # atomiskt, så med flera processer körs det bara av en av dem.
+        for job_id, kind, params, user, priority in self.store.unfinished():
+            if not self.store.claim(job_id, self.owner):
+                continue
+            input_csv = os.path.join(
+                params.get('upload_folder', ''), params.get('input_file', '')
+            )
+            if not os.path.exists(input_csv):
+                # Indatat finns inte längre kvar: jobbet kan inte återupptas
+                logging.warning(
+                    f"Cannot resume {kind} job {job_id}: {input_csv} is missing"
+                )
+                self.store.set_status(job_id, 'interrupted')
+                continue
+            logging.info(f"Resuming {kind} job {job_id} after restart")
+            self.store.set_status(job_id, 'queued')
+            self._start(job_id, kind, params, user, priority)
+
+    def maintain(self):
+        # Bakgrundstråd: förnyar leasen för processens jobb och tar över jobb vars
+        # process dött
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                with self.active_lock:
+                    active = list(self.active)
+                self.store.renew(active, self.owner)
+                self.resume_unfinished()
+            except Exception as e:
+                logging.error(f"Job lease maintenance failed: {str(e)}")
+
+    def _run(self, job_id, kind, params, user=None,
+             priority=fair_share.DEFAULT_PRIORITY):
+        self.store.set_status(job_id, 'running')
+        # Allt som mäts medan pipelinen körs (även i dess arbetstrådar) räknas till
+        # jobbet
+        job_metrics = metrics.JobMetrics()
+        token = metrics.current_job.set(job_metrics)
+        # Jobbets andel av API-kvoten följer med till arbetstrådarna på samma sätt
+        share = fair_share.share_for_job(job_id, user, priority)
+        fair_share.register(share)
+        share_token = fair_share.current_share.set(share)
+        completed = False
+        summary_sent = False
+        try:
+            # Stora jobb delas upp i shards som körs i en processpool (och av andra
+            # värdar)
+            if sharding.should_shard(kind, params):
+                messages = sharding.run_sharded(kind, params)
+            else:
+                messages = pipeline(kind)(**params)
+            for message in messages:
+                message = message.strip()
+                event = json.loads(message)
+                if "partial" in event:
+                    self._publish_partial(job_id, message)
+                    continue
+                if event.get("complete"):
+                    completed = True
+                    # Klienten stänger strömmen vid complete, så sammanfattningen
+                    # skickas före
+                    self.store.append_event(
+                        job_id, json.dumps({"summary": job_metrics.summary()})
+                    )
+                    summary_sent = True
+                self.store.append_event(job_id, message)
+        except Exception as e:
+            error_msg = f"Fatal error in job {job_id}: {str(e)}"
+            logging.error(error_msg)
+            self.store.append_event(job_id, json.dumps({"error": error_msg}))
+        finally:
+            metrics.current_job.reset(token)
+            fair_share.current_share.reset(share_token)
+            fair_share.unregister(share)
+            self.partials.pop(job_id, None)
+
+        status = 'completed' if completed else 'failed'
+        summary = job_metrics.summary()
+        if not summary_sent:
+            self.store.append_event(job_id, json.dumps({"summary": summary}))
+        metrics.inc('translator_jobs_total', kind=kind, status=status)
+        self.store.set_status(job_id, status)
+        with self.active_lock:
+            self.active.discard(job_id)
+        logging.info(f"Job {job_id} finished: {json.dumps(summary)}")
+
+    def _publish_partial(self, job_id, message):
+        with self.store.changed:
+            serial = self.partials.get(job_id, (0, None))[0] + 1
+            self.partials[job_id] = (serial, message)
+            self.store.changed.notify_all()
+
+    def stream(self, job_id, last_event_id=0):
+        # SSE-ström för ett jobb. Kan kopplas på och av hur många gånger som helst;
+        # Last-Event-ID gör att en återanslutning fortsätter där den slutade.
+        last_seq = last_event_id
+        last_partial = 0
+        last_sent = time.monotonic()
+        while True:
+            for seq, data in self.store.events_after(job_id, last_seq):
+                last_seq = seq
+                last_sent = time.monotonic()
+                yield f"id: {seq}\ndata: {data}\n\n"
+
+            # Deltext skickas utan id så att Last-Event-ID bara pekar på sparade events
+            serial, data = self.partials.get(job_id, (0, None))
+            if serial > last_partial:
+                last_partial = serial
+                last_sent = time.monotonic()
+                yield f"data: {data}\n\n"
+
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                if not self.store.events_after(job_id, last_seq):
+                    # Sista meddelandet talar om för klienten att sluta återansluta
+                    final = {"job_status": job["status"] if job else "missing"}
+                    if final["job_status"] == 'interrupted':
+                        final["error"] = (
+                            "Job was interrupted by a server restart and its input "
+                            "is no longer available"
+                        )
+                    yield f"data: {json.dumps(final)}\n\n"
+                    return
+                continue
+
+            if time.monotonic() - last_sent > KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            # Timeout gör att även events från andra processer (som delar databasen)
+            # plockas upp
+            self.store.wait_for_change(timeout=1.0)
+
+
+_runner = None
+_runner_lock = Lock()
+
+
+def get_job_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(JobStore())
+            _runner.resume_unfinished()
+            Thread(target=_runner.maintain, name='job-leases', daemon=True).start()
+        return _runner
@@ -0,0 +1,117 @@
+# journal.py
+
+import contextlib
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+
+import metrics
+
+JOURNAL_FOLDER = 'journals'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def journal_path(upload_folder, kind, *parts):
+    # Samma indata (innehåll, exempel, promptar) ger samma journal, så en omstartad
+    # körning hittar resultaten från förra försöket
+    joined = "\x00".join(str(part) for part in parts)
+    key = hashlib.sha256(joined.encode('utf-8')).hexdigest()[:32]
+    folder = os.path.join(upload_folder, JOURNAL_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{kind}-{key}.jsonl")
+
+
+class ResultJournal:
+    # Append-only JSONL: en rad per färdig cell
+    # {"row": index, "column": namn, "value": text}
+    # Används som kontexthanterare runt körningen: filen hålls öppen för tillägg
+    # tills körningen är klar
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def replay(self):
+        values = {}
+        if not os.path.exists(self.path):
+            return values
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    values[(record["row"], record["column"])] = record["value"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # Sista raden kan vara halvskriven om processen dog mitt i en
+                    # skrivning
+                    logging.warning(f"Skipping unreadable journal line in {self.path}")
+        return values
+
+    def __enter__(self):
+        # Avsluta en halvskriven rad från en krasch så att nästa post hamnar på egen
+        # rad
+        needs_newline = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if needs_newline:
+            self.file.write("\n")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, row, column, value):
+        record = {"row": int(row), "column": column, "value": value}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _cell(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return value
+
+
+def write_outputs(input_df, outputs):
+    # Skriver flera CSV-filer i ett enda pass över raderna.
+    # outputs: [(sökväg, [kolumner])]
+    columns = []
+    for _, output_columns in outputs:
+        for column in output_columns:
+            if column not in columns:
+                columns.append(column)
+    positions = {column: i for i, column in enumerate(columns)}
+
+    with metrics.timed('translator_csv_seconds_total', op='write'), \
+            contextlib.ExitStack() as stack:
+        writers = []
+        for path, output_columns in outputs:
+            f = stack.enter_context(open(path, 'w', newline='', encoding='utf-8'))
+            writer = csv.writer(f)
+            writer.writerow(output_columns)
+            writers.append((writer, [positions[column] for column in output_columns]))
+
+        for row in input_df[columns].itertuples(index=False, name=None):
+            for writer, indexes in writers:
+                writer.writerow([_cell(row[i]) for i in indexes])
@@ -1,43 +1,117 @@
 import json
 import os
+import time
 from threading import Lock
-from functools import lru_cache
 
 CONFIG_FILE = 'language_config.json'
 config_lock = Lock()
 
-@lru_cache(maxsize=None)
-def load_language_config():
+# Så ofta (sekunder) kontrolleras filen; ändringar från andra processer syns inom den
+# tiden
+CHECK_INTERVAL = float(os.getenv('LANGUAGE_CONFIG_CHECK_SECONDS', '1'))
+
+DISPLAY_NAME_COLUMN = 'Display name - {code}'
+QUALITY_COLUMN = 'Quality - {code}'
+
+
+class LanguageIndex:
+    # En version av konfigurationen med uppslag åt båda hållen och kolumnnamn,
+    # beräknade en gång. version är filens (mtime, storlek, inod): save skriver en ny
+    # fil och byter namn på den, så varje sparning ger en ny version även inom samma
+    # mtime-upplösning.
+    def __init__(self, mapping, version):
+        self.version = version
+        self.by_code = dict(mapping)
+        self.by_name = {name: code for code, name in self.by_code.items()}
+        self.columns = {}
+
+    def column(self, language_name, template=DISPLAY_NAME_COLUMN):
+        names = self.columns.get(template)
+        if names is None:
+            names = {
+                name: template.format(code=code) for name, code in self.by_name.items()
+            }
+            self.columns[template] = names
+        column = names.get(language_name)
+        # Språk som inte finns i konfigurationen får samma kolumn som tidigare (kod
+        # None)
+        return column if column is not None else template.format(code=None)
+
+    def languages_in(self, columns):
+        # Språken vars kod står efter ' - ' i kolumnrubrikerna, i kolumnordning
+        return [
+            self.by_code[column.split(' - ')[1]]
+            for column in columns
+            if ' - ' in column and column.split(' - ')[1] in self.by_code
+        ]
+
+
+_index = LanguageIndex({}, None)
+# Senaste kontroll av filen (time.monotonic), None innan första inläsningen
+_checked_at = None
+
+
+def _file_version():
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def get_language_index():
+    # Billigt i det vanliga fallet: en tidsjämförelse, och högst en stat per
+    # CHECK_INTERVAL. Filen läses bara om när versionen har ändrats (t.ex. sparad av
+    # en annan worker).
+    global _index, _checked_at
+    if _checked_at is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _index
     with config_lock:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        return {}  # Return an empty dictionary if no config file exists
+        if _checked_at is None or time.monotonic() - _checked_at >= CHECK_INTERVAL:
+            version = _file_version()
+            if _checked_at is None or version != _index.version:
+                mapping = {}
+                if version is not None:
+                    with open(CONFIG_FILE, 'r') as f:
+                        mapping = json.load(f)
+                _index = LanguageIndex(mapping, version)
+            _checked_at = time.monotonic()
+        return _index
+
+
+def load_language_config():
+    return dict(get_language_index().by_code)
 
 def get_language_mapping():
-    return load_language_config()
+    return get_language_index().by_code
 
 def get_reverse_mapping():
-    return {v: k for k, v in get_language_mapping().items()}
+    return get_language_index().by_name
 
 def get_available_languages(df):
-    language_mapping = get_language_mapping()
-    available_langs = [language_mapping[col.split(' - ')[1]] 
-                       for col in df.columns 
-                       if ' - ' in col and col.split(' - ')[1] in language_mapping]
+    available_langs = get_language_index().languages_in(df.columns)
     print(f"Available languages found: {available_langs}")
     return available_langs
 
 def get_language_code(language_name):
-    return get_reverse_mapping().get(language_name)
+    return get_language_index().by_name.get(language_name)
+
+def get_language_column(language_name, template=DISPLAY_NAME_COLUMN):
+    return get_language_index().column(language_name, template)
 
 def save_language_config(new_config):
+    global _index, _checked_at
     with config_lock:
         try:
-            with open(CONFIG_FILE, 'w') as f:
+            # Ny fil som byter plats med den gamla: andra processer läser aldrig en
+            # halvskriven fil
+            temp_file = f"{CONFIG_FILE}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as f:
                 json.dump(new_config, f, indent=2)
-            load_language_config.cache_clear()
+            os.replace(temp_file, CONFIG_FILE)
+            _index = LanguageIndex(new_config, _file_version())
+            _checked_at = time.monotonic()
             print(f"Language config saved successfully: {new_config}")
         except Exception as e:
             print(f"Error saving language config: {str(e)}")
-            raise Exception(f"Failed to save language config: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to save language config: {str(e)}") from e
@@ -1,26 +1,47 @@
 # main.py
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, send_file, Response
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-import os
-import pandas as pd
-from flask_wtf.csrf import CSRFProtect
 import json
-from language_config import load_language_config, save_language_config
-from functools import wraps
+import os
 from datetime import timedelta
-import sys
+from functools import wraps
+
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    session,
+    url_for,
+)
+from flask_wtf.csrf import CSRFProtect
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import fair_share
+import metrics
+from csv_stream import read_header
+from jobs import get_job_runner
+from language_config import (
+    get_language_index,
+    load_language_config,
+    save_language_config,
+)
+from upload_store import store_upload
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-app.secret_key = os.urandom(24)
+# Sätt SECRET_KEY i produktion så att sessioner överlever omstarter
+app.secret_key = os.getenv('SECRET_KEY') or os.urandom(24)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=4)
 app.config['SESSION_PERMANENT'] = True
 csrf = CSRFProtect(app)
 
 ALLOWED_EXTENSIONS = {'csv'}
+# Om satt måste Prometheus skicka "Authorization: Bearer <token>" till /metrics
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 
 users = {
     "admin": generate_password_hash("@admin!123@")
@@ -88,11 +109,41 @@ def upload_file():
     if not allowed_file(input_file.filename):
         return jsonify({'error': 'Only CSV files are allowed'}), 400
 
-    input_filename = secure_filename(input_file.filename)
-    input_file.save(os.path.join(app.config['UPLOAD_FOLDER'], input_filename))
+    # Lagras under innehållets hash; samma fil två gånger sparas och tolkas bara en gång
+    input_filename = _store_upload(input_file)
 
     session['input_file'] = input_filename
 
+    action = request.form.get('action')
+    if action == 'translate_titles':
+        examples_file = request.files.get('examples_file')
+        if not examples_file or examples_file.filename == '' \
+                or not allowed_file(examples_file.filename):
+            return jsonify({'error': 'Examples file must be uploaded'}), 400
+        examples_filename = _store_upload(examples_file)
+
+        # Formuläret skickar både kryssrutorna och en JSON-lista med samma namn
+        languages = request.form.getlist('languages')
+        try:
+            if languages and languages[-1].startswith('['):
+                selected_languages = json.loads(languages[-1])
+            else:
+                selected_languages = languages
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid language selection'}), 400
+        if not selected_languages:
+            return jsonify({'error': 'Select at least one language'}), 400
+
+        job_id = get_job_runner().submit('translate_display_names', {
+            'upload_folder': app.config['UPLOAD_FOLDER'],
+            'input_file': input_filename,
+            'examples_file': examples_filename,
+            'selected_languages': selected_languages,
+        }, user=session.get('user'), priority=_priority())
+        return jsonify({
+            'job_id': job_id, 'redirect': url_for('job_events', job_id=job_id)
+        })
+
     # Hämta promptar
     system_prompt_1 = request.form.get('system_prompt_1', '').strip()
     user_prompt_1   = request.form.get('user_prompt_1', '').strip()
@@ -103,39 +154,100 @@ def upload_file():
     session['user_prompt_1']   = user_prompt_1
     session['system_prompt_2'] = system_prompt_2
     session['user_prompt_2']   = user_prompt_2
+    session['priority']        = _priority()
 
-    action = request.form.get('action')
     if action == 'rewrite_descriptions_two_steps':
-        return jsonify({'redirect': url_for('rewrite_descriptions_two_steps')})
+        job_id = _submit_rewrite_job(input_filename)
+        return jsonify({
+            'job_id': job_id, 'redirect': url_for('job_events', job_id=job_id)
+        })
     else:
         return jsonify({'error': 'Invalid action'}), 400
 
+def _store_upload(file):
+    # Indata till jobb som inte är klara får inte rensas ur förrådet, hur länge de än
+    # körs
+    pinned = get_job_runner().store.input_files()
+    return store_upload(file, app.config['UPLOAD_FOLDER'], pinned)
+
+def _priority():
+    priority = request.form.get('priority', fair_share.DEFAULT_PRIORITY)
+    if priority in fair_share.PRIORITIES:
+        return priority
+    return fair_share.DEFAULT_PRIORITY
+
+def _submit_rewrite_job(input_file):
+    priority = session.get('priority', fair_share.DEFAULT_PRIORITY)
+    job_id = get_job_runner().submit('rewrite_descriptions_two_steps', {
+        'upload_folder': app.config['UPLOAD_FOLDER'],
+        'input_file': input_file,
+        'system_prompt_1': session.get('system_prompt_1', ''),
+        'user_prompt_1': session.get('user_prompt_1', ''),
+        'system_prompt_2': session.get('system_prompt_2', ''),
+        'user_prompt_2': session.get('user_prompt_2', ''),
+    }, user=session.get('user'), priority=priority)
+    session['rewrite_job_id'] = job_id
+    return job_id
+
+def _event_stream(job_id):
+    # Jobbet körs i bakgrunden; strömmen kopplar bara på dess events
+    last_event_id = request.headers.get('Last-Event-ID') \
+        or request.args.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        last_event_id = 0
+    return Response(
+        get_job_runner().stream(job_id, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/rewrite_descriptions_two_steps')
 @login_required
 def rewrite_descriptions_two_steps():
-    from translate_descriptions import rewrite_descriptions_two_steps_function
-
-    input_file = session.get('input_file')
-    if not input_file:
-        return jsonify({'error': 'File is missing'}), 400
-
-    system_prompt_1 = session.get('system_prompt_1', '')
-    user_prompt_1   = session.get('user_prompt_1', '')
-    system_prompt_2 = session.get('system_prompt_2', '')
-    user_prompt_2   = session.get('user_prompt_2', '')
-
-    def generate():
-        for message in rewrite_descriptions_two_steps_function(
-            app.config['UPLOAD_FOLDER'],
-            input_file,
-            system_prompt_1,
-            user_prompt_1,
-            system_prompt_2,
-            user_prompt_2
-        ):
-            yield f"data: {message}\n\n"
-
-    return Response(generate(), mimetype='text/event-stream')
+    job_id = request.args.get('job_id') or session.get('rewrite_job_id')
+    if not job_id:
+        input_file = session.get('input_file')
+        if not input_file:
+            return jsonify({'error': 'File is missing'}), 400
+        job_id = _submit_rewrite_job(input_file)
+    return _event_stream(job_id)
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    status = {
+        key: job[key]
+        for key in ('id', 'kind', 'priority', 'status', 'created_at', 'updated_at')
+    }
+    # Förbrukad andel av API-kvoten medan jobbet körs
+    status['share'] = fair_share.get_share(job_id)
+    return jsonify(status)
+
+@app.route('/jobs')
+@login_required
+def running_jobs():
+    # Alla jobb som just nu delar på API-kvoten, med vikt, prioritet och förbrukning
+    return jsonify({'jobs': fair_share.active_shares()})
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    if get_job_runner().store.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return _event_stream(job_id)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Ingen inloggning: skrapas av Prometheus, skyddas i stället med METRICS_TOKEN
+    authorization = request.headers.get('Authorization')
+    if METRICS_TOKEN and authorization != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/download/<filename>')
 @login_required
@@ -155,24 +267,14 @@ def upload_examples():
     if file.filename == '':
         return jsonify({'error': 'Ingen fil vald'}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
         try:
-            df = pd.read_csv(file_path)
-            language_mapping = load_language_config()
-            available_langs = []
-            for col in df.columns:
-                if ' - ' in col:
-                    code = col.split(' - ')[1]
-                    if code in language_mapping:
-                        available_langs.append(language_mapping[code])
+            # Filen sparas i förrådet så att samma exempelfil i /upload inte lagras
+            # igen, och bara rubrikraden läses för att hitta språken
+            stored = _store_upload(file)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], stored)
+            available_langs = get_language_index().languages_in(read_header(file_path))
         except Exception as e:
             return jsonify({'error': f'Fel vid bearbetning av fil: {str(e)}'}), 500
-        finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
 
         return jsonify({'available_languages': available_langs})
     return jsonify({'error': 'Filuppladdning misslyckades'}), 500
@@ -199,12 +301,20 @@ def instructions():
     return render_template('instructions.html')
 
 @app.errorhandler(404)
-def page_not_found(e):
+def page_not_found(_error):
     return render_template('404.html'), 404
 
 @app.errorhandler(500)
-def internal_server_error(e):
+def internal_server_error(_error):
     return render_template('500.html'), 500
 
+def create_app():
+    # Används av produktionsservern: gunicorn -c gunicorn.conf.py 'main:create_app()'
+    # Jobbkön startas direkt så att avbrutna jobb återupptas utan att vänta på en
+    # request
+    get_job_runner()
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Utvecklingsserver med en tråd per ström; använd create_app() ovan i produktion
+    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
@@ -0,0 +1,206 @@
+# metrics.py
+
+import contextvars
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+
+# Hinkar (sekunder) för API-latens i /metrics
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    'translator_api_requests_total': ('counter', 'Chat completion requests sent'),
+    'translator_api_request_duration_seconds': ('histogram', 'Chat completion latency'),
+    'translator_api_tokens_total': ('counter', 'Tokens reported by the API'),
+    'translator_api_retries_total': ('counter', 'Retried API requests'),
+    'translator_api_rate_limited_total': ('counter', 'Requests answered with 429'),
+    'translator_csv_seconds_total': (
+        'counter', 'Time spent reading and writing CSV files'
+    ),
+    'translator_sleep_seconds_total': (
+        'counter', 'Time spent waiting on backoff and rate limits'
+    ),
+    'translator_rows_processed_total': (
+        'counter', 'Input rows finished by the pipelines'
+    ),
+    'translator_jobs_total': ('counter', 'Finished background jobs'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    # Processens samlade mätvärden sedan start
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, amount, labels):
+        with self.lock:
+            self.counters[_key(name, labels)] += amount
+
+    def observe(self, name, value, labels):
+        with self.lock:
+            key = _key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = {
+                    "buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0
+                }
+            histogram = self.histograms[key]
+            position = bisect_left(LATENCY_BUCKETS, value)
+            if position < len(LATENCY_BUCKETS):
+                histogram["buckets"][position] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        # Prometheus textformat (version 0.0.4)
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: dict(value, buckets=list(value["buckets"]))
+                for key, value in self.histograms.items()
+            }
+
+        lines = []
+        for name, (kind, description) in HELP.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                buckets = zip(LATENCY_BUCKETS, histogram["buckets"], strict=True)
+                for bound, count in buckets:
+                    cumulative += count
+                    bucket_labels = _labels(labels + (('le', f'{bound:g}'),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _labels(labels + (('le', '+Inf'),))
+                lines.append(f"{name}_bucket{bucket_labels} {histogram['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:g}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class JobMetrics:
+    # Samma mätvärden men bara för ett jobb; ger sammanfattningen som skickas över SSE
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.totals = defaultdict(float)
+        self.latencies = []
+
+    def inc(self, name, amount, labels):
+        with self.lock:
+            self.totals[name] += amount
+            for label, value in labels.items():
+                if label != 'model':
+                    self.totals[f"{name}:{value}"] += amount
+
+    def observe(self, value):
+        with self.lock:
+            self.latencies.append(value)
+
+    def summary(self):
+        with self.lock:
+            totals = dict(self.totals)
+            latencies = sorted(self.latencies)
+        seconds = time.monotonic() - self.started
+        rows = int(totals.get('translator_rows_processed_total', 0))
+        return {
+            "rows": rows,
+            "seconds": round(seconds, 2),
+            "rows_per_second": round(rows / seconds, 2) if seconds > 0 else None,
+            "api_requests": int(totals.get('translator_api_requests_total', 0)),
+            "latency_p50": _percentile(latencies, 0.50),
+            "latency_p95": _percentile(latencies, 0.95),
+            "prompt_tokens": int(totals.get('translator_api_tokens_total:prompt', 0)),
+            "completion_tokens": int(
+                totals.get('translator_api_tokens_total:completion', 0)
+            ),
+            "retries": int(totals.get('translator_api_retries_total', 0)),
+            "rate_limited": int(totals.get('translator_api_rate_limited_total', 0)),
+            "csv_read_seconds": round(
+                totals.get('translator_csv_seconds_total:read', 0.0), 3
+            ),
+            "csv_write_seconds": round(
+                totals.get('translator_csv_seconds_total:write', 0.0), 3
+            ),
+            "sleep_seconds": round(
+                totals.get('translator_sleep_seconds_total', 0.0), 2
+            ),
+        }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+
+registry = Registry()
+# Jobbet som koden körs för just nu; följer med till arbetstrådar via
+# ContextThreadPoolExecutor
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, labels)
+    job = current_job.get()
+    if job is not None:
+        job.inc(name, amount, labels)
+
+
+def observe_latency(seconds, **labels):
+    registry.observe('translator_api_request_duration_seconds', seconds, labels)
+    inc('translator_api_requests_total', **labels)
+    job = current_job.get()
+    if job is not None:
+        job.observe(seconds)
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        inc(name, time.monotonic() - start, **labels)
+
+
+def record_retry(retry_state):
+    # before_sleep-callback för tenacity: räknar omförsöket och väntetiden före det
+    inc('translator_api_retries_total', reason='error')
+    if retry_state.next_action is not None:
+        inc('translator_sleep_seconds_total', retry_state.next_action.sleep,
+            reason='retry_backoff')
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    # Kör varje uppgift i en kopia av anroparens context, så att mätvärden från
+    # arbetstrådarna hamnar på rätt jobb
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def render():
+    return registry.render()
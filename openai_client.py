@@ -0,0 +1,43 @@
+# openai_client.py
+
+import os
+from threading import Lock
+
+import httpx
+from openai import OpenAI
+
+# Poolen ska rymma alla samtidiga anrop från båda pipelinerna (även strömmande svar,
+# som håller sin anslutning tills texten är färdig)
+POOL_MAX_CONNECTIONS = int(os.getenv('OPENAI_POOL_MAX_CONNECTIONS', '128'))
+POOL_MAX_KEEPALIVE = int(os.getenv('OPENAI_POOL_MAX_KEEPALIVE', '64'))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60'))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT', '120'))
+CONNECT_TIMEOUT_SECONDS = 10.0
+
+_client = None
+_client_lock = Lock()
+
+
+def get_openai_client():
+    # En delad klient för hela processen: anslutningar återanvänds mellan anrop,
+    # jobb och pipelines i stället för att varje modul har en egen pool
+    global _client
+    with _client_lock:
+        if _client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=httpx.Timeout(
+                    REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS
+                ),
+            )
+            # 429:or hanteras av request_scheduler, så klientens egna omförsök stängs
+            # av
+            _client = OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'), max_retries=0,
+                http_client=http_client
+            )
+        return _client
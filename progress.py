@@ -0,0 +1,57 @@
+# progress.py
+
+import json
+import os
+import time
+
+# Progress för ett språk (eller för beskrivningarna) skickas högst så här ofta ...
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL_SECONDS', '0.5'))
+# ... om den inte har ökat med minst så här många procentenheter sedan förra ticket
+PROGRESS_STEP = int(os.getenv('PROGRESS_STEP_PERCENT', '5'))
+
+
+class ProgressTicker:
+    # Slår ihop progress till tick per språk och skickar bara de fält som ändrats sedan
+    # förra ticket för samma språk. Fel och complete-events går inte genom tickern utan
+    # skickas direkt av pipelinerna.
+    def __init__(self, interval=PROGRESS_INTERVAL, step=PROGRESS_STEP):
+        self.interval = interval
+        self.step = step
+        self.sent = {}     # språk -> (tidpunkt, senast skickade fält)
+        self.pending = {}  # språk -> fält som ännu inte skickats
+
+    def tick(self, fields, language=None):
+        # Ger ett SSE-meddelande om det är dags för ett tick, annars None
+        sent_at, sent = self.sent.get(language, (None, {}))
+        recent = sent_at is not None and time.monotonic() - sent_at < self.interval
+        if recent and not self._stepped(sent, fields):
+            self.pending[language] = fields
+            return None
+        return self._send(fields, language)
+
+    def flush(self):
+        # Det som hållits tillbaka, t.ex. innan jobbets complete-event
+        messages = [
+            self._send(fields, language)
+            for language, fields in list(self.pending.items())
+        ]
+        return [message for message in messages if message]
+
+    def _stepped(self, sent, fields):
+        progress, previous = fields.get("progress"), sent.get("progress")
+        if not isinstance(progress, int) or not isinstance(previous, int):
+            return progress != previous
+        return progress >= 100 or progress - previous >= self.step
+
+    def _send(self, fields, language):
+        self.pending.pop(language, None)
+        sent = self.sent.get(language, (None, {}))[1]
+        changed = {
+            name: value for name, value in fields.items() if sent.get(name) != value
+        }
+        if not changed:
+            return None
+        self.sent[language] = (time.monotonic(), dict(sent, **fields))
+        event = {"language": language} if language is not None else {}
+        event.update(changed)
+        return json.dumps(event) + "\n\n"
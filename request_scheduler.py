@@ -0,0 +1,334 @@
+# request_scheduler.py
+
+import logging
+import os
+import re
+import time
+from collections import defaultdict, deque
+from itertools import count
+from threading import Condition, Lock
+
+from openai import RateLimitError
+
+import fair_share
+import metrics
+
+INITIAL_CONCURRENCY = int(os.getenv('SCHEDULER_INITIAL_CONCURRENCY', '4'))
+MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '64'))
+MAX_RATE_LIMIT_RETRIES = int(os.getenv('SCHEDULER_MAX_RATE_LIMIT_RETRIES', '8'))
+# Sänk samtidigheten när latensen per token blir så här många gånger sämre än den bästa
+# bland de senaste LATENCY_WINDOW lyckade anropen
+LATENCY_BACKOFF_FACTOR = 2.0
+LATENCY_WINDOW = int(os.getenv('SCHEDULER_LATENCY_WINDOW', '100'))
+DEFAULT_COMPLETION_TOKENS = 256
+
+_schedulers = {}
+_schedulers_lock = Lock()
+
+
+def parse_reset(value):
+    # OpenAI skickar t.ex. "1s", "6m0s", "20ms" eller bara sekunder ("retry-after: 2")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds or None
+
+
+def estimate_tokens(messages, max_tokens=None):
+    # Grov uppskattning (4 tecken per token) räcker för att fördela budgeten
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    # Kapacitet per minut; None betyder att gränsen ännu inte är känd
+    def __init__(self, per_minute=None):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity is None:
+            return
+        refill = (now - self.updated) * self.capacity / 60.0
+        self.level = min(self.capacity, self.level + refill)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        # Sekunder tills amount finns tillgängligt (0 = direkt)
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def take(self, amount, now):
+        if self.capacity is not None:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def sync(self, limit, remaining, now):
+        # Servern vet bäst: justera kapacitet och nivå efter svarshuvudena
+        if limit:
+            if self.capacity is None:
+                self.level = limit
+            self.capacity = limit
+        if remaining is not None and self.capacity is not None:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+class RequestScheduler:
+    # Delad schemaläggare per modell: token-buckets för förfrågningar och tokens per
+    # minut (från x-ratelimit-huvudena) och AIMD-styrd samtidighet efter 429:or och
+    # latens. Lediga platser fördelas mellan jobben efter prioritet och viktad rättvis
+    # andel (fair_share).
+    def __init__(self, name, initial_concurrency=INITIAL_CONCURRENCY,
+                 max_concurrency=MAX_CONCURRENCY):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.latency_ewma = None
+        # Senaste värdena av latency_ewma; baslinjen är det lägsta av dem, så att en
+        # tidig ovanligt snabb period inte håller nere samtidigheten för alltid
+        self.recent_latency = deque(maxlen=LATENCY_WINDOW)
+        self.cond = Condition()
+        # Rättvis kö: systemets virtuella tid och väntande anrop [andel, ankomsttid,
+        # löpnummer]
+        self.virtual_clock = 0.0
+        self.waiting = []
+        self.arrivals = count()
+        self.user_in_flight = defaultdict(int)
+
+    def _start_tag(self, waiter):
+        share, arrival_clock, _ = waiter
+        return max(share.finish.get(self.name, 0.0), arrival_clock)
+
+    def _next_waiter(self):
+        # Högst prioritet först, sedan lägst virtuell starttid; användare som nått sitt
+        # tak hoppas över så att andra kan använda kvoten under tiden
+        eligible = [
+            waiter for waiter in self.waiting
+            if waiter[0].max_in_flight <= 0
+            or self.user_in_flight[waiter[0].user] < waiter[0].max_in_flight
+        ]
+        if not eligible:
+            return None
+        return min(
+            eligible,
+            key=lambda waiter: (-waiter[0].rank, self._start_tag(waiter), waiter[2])
+        )
+
+    def _acquire(self, estimated_tokens, share):
+        started = time.monotonic()
+        with self.cond:
+            waiter = [share, self.virtual_clock, next(self.arrivals)]
+            self.waiting.append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = max(
+                        self.blocked_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(estimated_tokens, now),
+                    )
+                    if self._next_waiter() is not waiter:
+                        self.cond.wait()
+                        continue
+                    if self.in_flight < max(1, int(self.concurrency)) and wait <= 0:
+                        self.in_flight += 1
+                        self.user_in_flight[share.user] += 1
+                        self.requests.take(1, now)
+                        self.tokens.take(estimated_tokens, now)
+
+                        start_tag = self._start_tag(waiter)
+                        self.virtual_clock = max(self.virtual_clock, start_tag)
+                        share.finish[self.name] = (
+                            start_tag + max(estimated_tokens, 1) / share.weight
+                        )
+                        share.requests += 1
+                        share.tokens += estimated_tokens
+                        if now > started:
+                            metrics.inc(
+                                'translator_sleep_seconds_total', now - started,
+                                reason='scheduler'
+                            )
+                        return
+                    self.cond.wait(timeout=wait if wait > 0 else None)
+            finally:
+                self.waiting.remove(waiter)
+                # Nästa i kön kan ha blivit först
+                self.cond.notify_all()
+
+    def _release(self, share):
+        with self.cond:
+            self.in_flight -= 1
+            self.user_in_flight[share.user] -= 1
+            self.cond.notify_all()
+
+    def _on_success(self, headers, latency, tokens=0):
+        now = time.monotonic()
+        with self.cond:
+            self.requests.sync(
+                _int_header(headers, 'x-ratelimit-limit-requests'),
+                _int_header(headers, 'x-ratelimit-remaining-requests'),
+                now
+            )
+            self.tokens.sync(
+                _int_header(headers, 'x-ratelimit-limit-tokens'),
+                _int_header(headers, 'x-ratelimit-remaining-tokens'),
+                now
+            )
+
+            # Per token, så att korta anrop (en omskickad rad) och långa (en batch, en
+            # lång beskrivning) går att jämföra
+            per_token = latency / max(tokens, 1)
+            if self.latency_ewma is None:
+                self.latency_ewma = per_token
+            else:
+                self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * per_token
+            self.recent_latency.append(self.latency_ewma)
+            best_latency = min(self.recent_latency)
+
+            if self.latency_ewma > LATENCY_BACKOFF_FACTOR * best_latency:
+                self.concurrency = max(1.0, self.concurrency * 0.9)
+            else:
+                # Additiv ökning: ungefär +1 per fullt "fönster" av lyckade anrop
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1.0 / self.concurrency
+                )
+            self.cond.notify_all()
+
+    def _on_rate_limited(self, headers):
+        now = time.monotonic()
+        pause = (
+            parse_reset(headers.get('retry-after'))
+            or max(
+                parse_reset(headers.get('x-ratelimit-reset-requests')) or 0.0,
+                parse_reset(headers.get('x-ratelimit-reset-tokens')) or 0.0,
+            )
+            or 1.0
+        )
+        metrics.inc('translator_api_rate_limited_total', model=self.name)
+        with self.cond:
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.blocked_until = max(self.blocked_until, now + pause)
+            self.cond.notify_all()
+        logging.warning(
+            f"Rate limited on {self.name}, pausing {pause:.1f}s and lowering "
+            f"concurrency to {int(self.concurrency)}"
+        )
+
+    def call(self, request, estimated_tokens=0, consume=None):
+        # request ska returnera ett with_raw_response-svar så att huvudena kan läsas.
+        # consume (för strömmande svar) läser svaret medan platsen fortfarande är
+        # upptagen.
+        share = fair_share.current()
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            self._acquire(estimated_tokens, share)
+            start = time.monotonic()
+            try:
+                raw = request()
+            except RateLimitError as e:
+                self._release(share)
+                self._on_rate_limited(
+                    e.response.headers if e.response is not None else {}
+                )
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                metrics.inc(
+                    'translator_api_retries_total', model=self.name, reason='rate_limit'
+                )
+                continue
+            except Exception:
+                self._release(share)
+                raise
+
+            try:
+                response = raw.parse()
+                if consume is not None:
+                    response = consume(response)
+            except Exception:
+                self._release(share)
+                raise
+
+            latency = time.monotonic() - start
+            usage = getattr(response, 'usage', None)
+            tokens = usage.total_tokens if usage is not None else 0
+            tokens = tokens or estimated_tokens
+            self._on_success(raw.headers, latency, tokens)
+            self._release(share)
+            metrics.observe_latency(latency, model=self.name)
+            _record_usage(self.name, getattr(response, 'usage', None))
+            return response
+
+
+def _record_usage(model, usage):
+    if usage is not None:
+        metrics.inc(
+            'translator_api_tokens_total', usage.prompt_tokens or 0,
+            model=model, type='prompt'
+        )
+        metrics.inc(
+            'translator_api_tokens_total', usage.completion_tokens or 0,
+            model=model, type='completion'
+        )
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def get_scheduler(model):
+    with _schedulers_lock:
+        if model not in _schedulers:
+            _schedulers[model] = RequestScheduler(model)
+        return _schedulers[model]
+
+
+def create_chat_completion(client, **kwargs):
+    # Ersätter client.chat.completions.create för alla anrop i pipelinerna
+    return get_scheduler(kwargs["model"]).call(
+        lambda: client.chat.completions.with_raw_response.create(**kwargs),
+        estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+    )
+
+
+def stream_chat_completion(client, on_text, **kwargs):
+    # Som create_chat_completion men med stream=True. on_text anropas med hela texten
+    # hittills efter varje del; den färdiga texten returneras.
+    model = kwargs["model"]
+
+    def consume(stream):
+        text = ""
+        for chunk in stream:
+            if chunk.usage is not None:
+                _record_usage(model, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                on_text(text)
+        return text
+
+    return get_scheduler(model).call(
+        lambda: client.chat.completions.with_raw_response.create(
+            stream=True, stream_options={"include_usage": True}, **kwargs
+        ),
+        estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens")),
+        consume
+    )
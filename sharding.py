@@ -0,0 +1,557 @@
+# sharding.py
+#
+# Stora jobb delas i shards (radintervall) som körs i en processpool, eller av
+# arbetsvärdar som delar filsystemet och hämtar shards ur samma lease-databas:
+#
+#   python sharding.py worker
+#
+# Varje shard körs med den vanliga pipelinen i en egen mapp; resultaten slås sedan
+# ihop till samma utfiler som en vanlig körning ger.
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from csv_stream import count_rows, iter_chunks
+from journal import file_digest
+from progress import ProgressTicker
+
+SHARD_STORE_FILE = os.getenv('SHARD_STORE_PATH', 'shards.sqlite3')
+# Antal lokala processer för ett shardat jobb (0 eller 1 = ingen sharding)
+SHARD_PROCESSES = int(
+    os.getenv('SHARD_PROCESSES', str(min(4, os.cpu_count() or 1)))
+)
+SHARD_ROWS = int(os.getenv('SHARD_ROWS', '5000'))
+# Bara jobb med fler rader än så här delas upp
+SHARD_MIN_ROWS = int(os.getenv('SHARD_MIN_ROWS', '20000'))
+# En shard vars ägare inte hörts av på så här länge får tas över av någon annan
+LEASE_SECONDS = int(os.getenv('SHARD_LEASE_SECONDS', '120'))
+# Ett shardat jobb som inte är klart inom så här många sekunder avbryts
+JOB_TIMEOUT_SECONDS = int(os.getenv('SHARD_JOB_TIMEOUT_SECONDS', str(6 * 3600)))
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 0.5
+SHARD_FOLDER = 'shards'
+
+OUTPUT_PREFIXES = {
+    'translate_display_names': 'translated_display_names_',
+    'rewrite_descriptions_two_steps': 'rewritten_descriptions_',
+}
+
+
+class ShardStore:
+    def __init__(self, path=SHARD_STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                job_key TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL DEFAULT '{}',
+                PRIMARY KEY (job_key, shard)
+            )
+        """)
+
+    def add(self, job_key, shard, kind, params, rows):
+        # Finns shardens rad redan (omstartat jobb) behålls den och dess status
+        self.conn.execute(
+            "INSERT OR IGNORE INTO shards (job_key, shard, kind, params, rows, status) "
+            "VALUES (?, ?, ?, ?, ?, 'pending')",
+            (job_key, shard, kind, json.dumps(params), rows)
+        )
+
+    def retry_failed(self, job_key):
+        # Ett nytt försök med samma jobb ger shards som gett upp nya försök
+        self.conn.execute(
+            "UPDATE shards SET status = 'pending', attempts = 0 "
+            "WHERE job_key = ? AND status = 'failed'", (job_key,)
+        )
+
+    def claim(self, owner, job_key=None):
+        # Tar atomiskt en ledig shard, eller en vars lease har gått ut
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            query = (
+                "SELECT job_key, shard, kind, params FROM shards "
+                "WHERE (status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?))"
+            )
+            args = [now]
+            if job_key is not None:
+                query += " AND job_key = ?"
+                args.append(job_key)
+            row = self.conn.execute(
+                query + " ORDER BY job_key, shard LIMIT 1", args
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE job_key = ? AND shard = ?",
+                (owner, now + LEASE_SECONDS, row[0], row[1])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def heartbeat(self, job_key, shard, owner, state):
+        # Förlänger leasen och sparar shardens progress; False om någon annan tagit
+        # över
+        cursor = self.conn.execute(
+            "UPDATE shards SET lease_expires = ?, state = ? "
+            "WHERE job_key = ? AND shard = ? AND owner = ? AND status = 'leased'",
+            (time.time() + LEASE_SECONDS, json.dumps(state), job_key, shard, owner)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_key, shard, owner, state, succeeded):
+        if succeeded:
+            status = 'done'
+        else:
+            attempts = self.conn.execute(
+                "SELECT attempts FROM shards WHERE job_key = ? AND shard = ?",
+                (job_key, shard)
+            ).fetchone()[0]
+            status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+        self.conn.execute(
+            "UPDATE shards SET status = ?, owner = NULL, lease_expires = NULL, "
+            "state = ? WHERE job_key = ? AND shard = ? AND owner = ?",
+            (status, json.dumps(state), job_key, shard, owner)
+        )
+
+    def unfinished(self, job_key):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM shards "
+            "WHERE job_key = ? AND status NOT IN ('done', 'failed')", (job_key,)
+        ).fetchone()[0]
+
+    def fail_unfinished(self, job_key):
+        # Avbrutet jobb: ingen ska ta fler shards, och pågående förlorar leasen vid
+        # nästa heartbeat
+        self.conn.execute(
+            "UPDATE shards SET status = 'failed', owner = NULL, lease_expires = NULL "
+            "WHERE job_key = ? AND status NOT IN ('done', 'failed')", (job_key,)
+        )
+
+    def shards(self, job_key):
+        rows = self.conn.execute(
+            "SELECT shard, rows, status, state FROM shards "
+            "WHERE job_key = ? ORDER BY shard", (job_key,)
+        ).fetchall()
+        return [
+            {"shard": shard, "rows": rows, "status": status, "state": json.loads(state)}
+            for shard, rows, status, state in rows
+        ]
+
+    def remove(self, job_key):
+        self.conn.execute("DELETE FROM shards WHERE job_key = ?", (job_key,))
+
+
+def should_shard(kind, params):
+    if SHARD_PROCESSES <= 1 or kind not in OUTPUT_PREFIXES:
+        return False
+    input_csv = os.path.join(params['upload_folder'], params['input_file'])
+    return count_rows(input_csv) > SHARD_MIN_ROWS
+
+
+def _job_key(kind, params, input_csv):
+    described = dict(params, input_digest=file_digest(input_csv))
+    key = f"{kind}\x00{json.dumps(described, sort_keys=True)}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def _split_input(input_csv, folder, shard_rows):
+    # Skriver varje radintervall till en egen CSV; texten behålls exakt (allt läses
+    # som str)
+    sizes = []
+    chunks = iter_chunks(input_csv, shard_rows, dtype=str, keep_default_na=False)
+    for shard, chunk in enumerate(chunks):
+        shard_folder = os.path.join(folder, f"{shard:04d}")
+        os.makedirs(shard_folder, exist_ok=True)
+        path = os.path.join(shard_folder, 'input.csv')
+        if not os.path.exists(path):
+            temp_path = f"{path}.tmp"
+            chunk.to_csv(temp_path, index=False)
+            os.replace(temp_path, path)
+        sizes.append(len(chunk))
+    return sizes
+
+
+def _shard_params(kind, params, shard_folder):
+    # Deltaläget följer med: shardarna letar efter förra körningens resultat i
+    # jobbets mapp, där koordinatorn sparar den sammanslagna utfilen
+    shard_params = dict(
+        params, upload_folder=shard_folder, input_file='input.csv',
+        previous_folder=os.path.abspath(params['upload_folder'])
+    )
+    if kind == 'translate_display_names':
+        shard_params['examples_file'] = os.path.abspath(
+            os.path.join(params['upload_folder'], params['examples_file'])
+        )
+    else:
+        # Delresultat visas inte för shardade jobb
+        shard_params['stream_output'] = False
+    return shard_params
+
+
+def run_shard(store, job_key, shard, kind, params, owner):
+    # Kör pipelinen för en shard och sparar progress, fel och slutresultat i
+    # lease-databasen
+    from jobs import pipeline
+
+    state = {"progress": {}, "errors": [], "completions": [], "complete": None}
+    job_metrics = metrics.JobMetrics()
+    token = metrics.current_job.set(job_metrics)
+    # Leasen förnyas från en egen tråd, så att en lång batch eller en paus efter 429
+    # (då pipelinen inte ger några events) inte låter någon annan ta över shardens
+    # arbete
+    lock = threading.Lock()
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def heartbeat():
+        store_for_thread = ShardStore(store.path)
+        while not stop.wait(POLL_SECONDS * 4):
+            with lock:
+                snapshot = json.loads(
+                    json.dumps(dict(state, summary=job_metrics.summary()))
+                )
+            if not store_for_thread.heartbeat(job_key, shard, owner, snapshot):
+                lost.set()
+                return
+
+    beat = threading.Thread(
+        target=heartbeat, name=f'shard-{shard}-heartbeat', daemon=True
+    )
+    beat.start()
+    try:
+        for message in pipeline(kind)(**params):
+            event = json.loads(message)
+            if "partial" in event:
+                continue
+            with lock:
+                if event.get("error"):
+                    state["errors"] = (state["errors"] + [event])[-20:]
+                elif event.get("complete"):
+                    state["complete"] = event
+                elif event.get("status") == "complete":
+                    state["completions"].append(event)
+                elif any(field in event for field in ("progress", "step_1", "step_2")):
+                    # Progress kommer som tick med bara ändrade fält
+                    language = event.get("language", "")
+                    state["progress"].setdefault(language, {}).update(event)
+
+            if lost.is_set():
+                logging.warning(f"Lost lease on shard {shard} of {job_key}, stopping")
+                return
+    except Exception as e:
+        state["errors"].append({"error": f"Shard {shard} failed: {str(e)}"})
+    finally:
+        stop.set()
+        beat.join()
+        metrics.current_job.reset(token)
+
+    if lost.is_set():
+        logging.warning(
+            f"Lost lease on shard {shard} of {job_key}, not recording its result"
+        )
+        return
+    state["summary"] = job_metrics.summary()
+    store.finish(job_key, shard, owner, state, state["complete"] is not None)
+
+
+def work(store_path=SHARD_STORE_FILE, job_key=None, idle_exit=True):
+    # Arbetsloop: en lokal process (job_key satt) eller en fristående arbetsvärd
+    store = ShardStore(store_path)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    while True:
+        claimed = store.claim(owner, job_key)
+        if claimed is None:
+            # En lokal process stannar tills jobbets alla shards är klara: en shard
+            # vars ägare dött (t.ex. före en omstart) kan tas över först när dess
+            # lease har gått ut
+            if idle_exit and (job_key is None or not store.unfinished(job_key)):
+                return
+            time.sleep(POLL_SECONDS * 4)
+            continue
+        claimed_key, shard, kind, params = claimed
+        logging.info(f"{owner} running shard {shard} of {kind} job {claimed_key}")
+        run_shard(store, claimed_key, shard, kind, params, owner)
+
+
+def _merge_outputs(kind, shard_folders, upload_folder):
+    # Slår ihop shardernas utfiler i radordning. Samma rubrik överallt ger en ren
+    # textsammanfogning; annars (t.ex. ett språk som föll bort i en shard) unionen av
+    # kolumnerna.
+    prefix = OUTPUT_PREFIXES[kind]
+    names = sorted(
+        name for name in os.listdir(shard_folders[0])
+        if name.startswith(prefix) and name.endswith('.csv')
+    )
+    for name in names:
+        parts = [os.path.join(folder, name) for folder in shard_folders]
+        headers = []
+        for part in parts:
+            with open(part, newline='', encoding='utf-8') as f:
+                headers.append(next(csv.reader(f), []))
+        columns = list(headers[0])
+        for header in headers[1:]:
+            columns += [column for column in header if column not in columns]
+
+        output_path = os.path.join(upload_folder, name)
+        with metrics.timed('translator_csv_seconds_total', op='write'), \
+                open(output_path, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output)
+            writer.writerow(columns)
+            for part, header in zip(parts, headers, strict=True):
+                with open(part, newline='', encoding='utf-8') as f:
+                    if header == columns:
+                        next(f)
+                        shutil.copyfileobj(f, output)
+                    else:
+                        reader = csv.DictReader(f)
+                        for row in reader:
+                            writer.writerow([row.get(column, '') for column in columns])
+    return names
+
+
+def _start_workers(context, workers, store_path, job_key):
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return pool, [pool.submit(work, store_path, job_key) for _ in range(workers)]
+
+
+def _progress_events(kind, shards, total_rows):
+    # Viktat medelvärde av shardernas senaste progress, per språk eller för
+    # beskrivningarna
+    if kind == 'translate_display_names':
+        fields = ("progress",)
+    else:
+        fields = ("progress", "step_1", "step_2")
+
+    def latest(shard, key):
+        return shard["state"].get("progress", {}).get(key, {})
+
+    events = {}
+    for key in {key for shard in shards for key in shard["state"].get("progress", {})}:
+        event = {"language": key} if key else {}
+        if any(latest(shard, key).get("progress") == "no_examples" for shard in shards):
+            events[key] = dict(event, progress="no_examples")
+            continue
+        for field in fields:
+            done = 0.0
+            for shard in shards:
+                if shard["status"] == 'done':
+                    done += shard["rows"]
+                    continue
+                value = latest(shard, key).get(field)
+                if isinstance(value, (int, float)):
+                    done += shard["rows"] * value / 100
+            percent = int(done / total_rows * 100) if total_rows else 99
+            event[field] = min(percent, 99)
+        events[key] = event
+    return events
+
+
+def run_sharded(kind, params, processes=SHARD_PROCESSES, shard_rows=SHARD_ROWS,
+                store_path=SHARD_STORE_FILE):
+    # Körs i stället för pipelinen och ger samma slags events: aggregerad progress,
+    # shardernas fel och till sist samma complete-events som en vanlig körning
+    upload_folder = params['upload_folder']
+    input_csv = os.path.join(upload_folder, params['input_file'])
+    job_key = _job_key(kind, params, input_csv)
+    folder = os.path.join(upload_folder, SHARD_FOLDER, job_key)
+    store = ShardStore(store_path)
+    store.retry_failed(job_key)
+
+    sizes = _split_input(input_csv, folder, shard_rows)
+    shard_folders = [
+        os.path.join(folder, f"{shard:04d}") for shard in range(len(sizes))
+    ]
+    shard_sizes = zip(sizes, shard_folders, strict=True)
+    for shard, (size, shard_folder) in enumerate(shard_sizes):
+        store.add(job_key, shard, kind, _shard_params(kind, params, shard_folder), size)
+    total_rows = sum(sizes)
+    logging.info(
+        f"Split {kind} job into {len(sizes)} shards of up to {shard_rows} rows "
+        f"({job_key})"
+    )
+    yield json.dumps({"shards": len(sizes), "processes": processes}) + "\n\n"
+
+    context = multiprocessing.get_context('spawn')
+    workers = min(processes, len(sizes))
+    pool, futures = _start_workers(context, workers, store_path, job_key)
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    try:
+        ticker = ProgressTicker()
+        sent_errors = set()
+        while True:
+            shards = store.shards(job_key)
+            for shard in shards:
+                for error in shard["state"].get("errors", []):
+                    if (shard["shard"], json.dumps(error)) not in sent_errors:
+                        sent_errors.add((shard["shard"], json.dumps(error)))
+                        yield json.dumps(error) + "\n\n"
+            for key, event in _progress_events(kind, shards, total_rows).items():
+                event.pop("language", None)
+                message = ticker.tick(event, key or None)
+                if message:
+                    yield message
+
+            if all(shard["status"] in ('done', 'failed') for shard in shards):
+                break
+            if time.monotonic() > deadline:
+                store.fail_unfinished(job_key)
+                yield json.dumps({
+                    "error": f"Sharded job did not finish within "
+                             f"{JOB_TIMEOUT_SECONDS} seconds"
+                }) + "\n\n"
+                return
+            if all(future.done() for future in futures):
+                # Arbetsprocesserna har dött (eller poolen gått sönder) medan shards
+                # återstår: starta nya som tar över shards vars lease går ut
+                broken = any(
+                    isinstance(future.exception(), BrokenProcessPool)
+                    for future in futures
+                )
+                logging.warning(
+                    f"Restarting shard workers for {job_key}"
+                    + (" (pool broken)" if broken else "")
+                )
+                if broken:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool, futures = _start_workers(
+                        context, workers, store_path, job_key
+                    )
+                else:
+                    futures = [
+                        pool.submit(work, store_path, job_key) for _ in range(workers)
+                    ]
+            time.sleep(POLL_SECONDS)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    failed = [shard["shard"] for shard in shards if shard["status"] == 'failed']
+    if failed:
+        # Shardernas mappar och journaler behålls så att ett nytt försök fortsätter där
+        # de slutade
+        yield json.dumps({
+            "error": f"Shards {failed} failed after {MAX_ATTEMPTS} attempts"
+        }) + "\n\n"
+        return
+
+    names = _merge_outputs(kind, shard_folders, upload_folder)
+
+    # Shardernas räknare läggs ihop; mätvärdena från arbetsprocesserna förs över till
+    # jobbet
+    for shard in shards:
+        summary = shard["state"].get("summary", {})
+        metrics.inc('translator_rows_processed_total', shard["rows"], pipeline=kind)
+        metrics.inc('translator_api_requests_total', summary.get("api_requests", 0),
+                    model='shards')
+        metrics.inc('translator_api_tokens_total', summary.get("prompt_tokens", 0),
+                    model='shards', type='prompt')
+        metrics.inc('translator_api_tokens_total', summary.get("completion_tokens", 0),
+                    model='shards', type='completion')
+        metrics.inc('translator_api_retries_total', summary.get("retries", 0),
+                    model='shards', reason='shard')
+        metrics.inc('translator_api_rate_limited_total', summary.get("rate_limited", 0),
+                    model='shards')
+
+    def summed(events, field):
+        return sum(
+            event.get(field, 0) for event in events
+            if isinstance(event.get(field, 0), (int, float))
+        )
+
+    completions = {}
+    for shard in shards:
+        for event in shard["state"].get("completions", []):
+            completions.setdefault(event["language"], []).append(event)
+    completed_files = []
+    for language, events in completions.items():
+        if len(events) != len(shards) or events[0]["file"] not in names:
+            continue
+        completed_files.append({"language": language, "file": events[0]["file"]})
+        yield json.dumps({
+            "language": language,
+            "progress": 100,
+            "status": "complete",
+            "file": events[0]["file"],
+            "cache_hits": summed(events, "cache_hits"),
+            "glossary_hits": summed(events, "glossary_hits"),
+            "api_requests": summed(events, "api_requests"),
+            "retried": summed(events, "retried"),
+            "flagged": summed(events, "flagged")
+        }) + "\n\n"
+
+    finals = [shard["state"]["complete"] for shard in shards]
+    final = dict(finals[0], **{
+        field: summed(finals, field)
+        for field in ("cache_hits", "reused", "retried", "flagged")
+        if field in finals[0]
+    })
+    if completed_files:
+        final["completed_files"] = completed_files
+        final["completed_languages"] = [entry["language"] for entry in completed_files]
+
+    # Samma snapshot som en vanlig körning sparar, så att nästa deltakörning hittar
+    # resultatet
+    from delta import save_snapshot
+    save_snapshot(
+        upload_folder, _snapshot_kind(kind, params),
+        os.path.join(upload_folder, final["file"])
+    )
+
+    shutil.rmtree(folder, ignore_errors=True)
+    store.remove(job_key)
+    yield json.dumps(final) + "\n\n"
+
+
+def _snapshot_kind(kind, params):
+    if kind == 'rewrite_descriptions_two_steps':
+        from translate_descriptions import snapshot_kind
+        return snapshot_kind(
+            params['system_prompt_1'], params['user_prompt_1'],
+            params['system_prompt_2'], params['user_prompt_2']
+        )
+    return 'display_names'
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(
+        description="Run translation shards from the shared lease store"
+    )
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('--store', default=SHARD_STORE_FILE)
+    args = parser.parse_args()
+    work(args.store, idle_exit=False)
@@ -106,6 +106,19 @@ function startSSE(url) {
         try {
             var data = JSON.parse(event.data);
 
+            if (data.job_status) {
+                // Jobbet är klart på servern och alla events har skickats
+                localStorage.removeItem('displayNameJobId');
+                eventSource.close();
+            }
+
+            if (data.summary) {
+                console.info('Job summary:', data.summary);
+                $('#job-summary').remove();
+                $('#progress-bars').append(`<p id="job-summary" class="text-muted small">${formatSummary(data.summary)}</p>`);
+                return;
+            }
+
             if (data.error) {
                 console.error('Translation error:', data.error);
                 showToast('Error: ' + data.error);
@@ -155,9 +168,10 @@ function startSSE(url) {
                                .text('No Examples');
                     completedLanguages.add(data.language);
                 } else if (data.status === "complete" && data.file) {
+                    // Rader som inte klarade valideringen visas på stapeln och har en flagga i filen
                     progressBar.css('width', '100%')
-                               .addClass('bg-success')
-                               .text('Complete');
+                               .addClass(data.flagged ? 'bg-warning' : 'bg-success')
+                               .text(data.flagged ? `Complete (${data.flagged} flagged)` : 'Complete');
 
                     // Add to download list and mark as completed
                     addToDownloadList(data.language, data.file);
@@ -169,8 +183,12 @@ function startSSE(url) {
             }
 
             if (data.complete && data.file) {
+                localStorage.removeItem('displayNameJobId');
                 // Show final success message with all download links
                 let message = 'All translations complete!';
+                if (data.flagged) {
+                    message += `<br>${data.flagged} rows did not pass validation; see the Quality columns.`;
+                }
                 message += `<br><a href="/download/${data.file}" download>Download combined translations</a>`;
                 showToast(message, true);
 
@@ -195,6 +213,17 @@ function startSSE(url) {
     };
 }
 
+function formatSummary(summary) {
+    // Sammanfattning från servern när jobbet är klart
+    const parts = [`${summary.rows} rows in ${summary.seconds}s`];
+    if (summary.rows_per_second !== null) parts.push(`${summary.rows_per_second} rows/s`);
+    parts.push(`${summary.api_requests} API calls`);
+    if (summary.latency_p50 !== null) parts.push(`p50 ${summary.latency_p50}s / p95 ${summary.latency_p95}s`);
+    parts.push(`${summary.prompt_tokens + summary.completion_tokens} tokens`);
+    if (summary.rate_limited) parts.push(`${summary.rate_limited} rate limited`);
+    return parts.join(' · ');
+}
+
 function sanitizeLanguage(lang) {
     return lang.replace(/\s+/g, '_').toLowerCase();
 }
@@ -221,6 +250,20 @@ $(document).ready(function() {
     // Reset completed languages on page load
     completedLanguages.clear();
 
+    // Koppla på igen om ett jobb fortfarande körs på servern
+    const runningJobId = localStorage.getItem('displayNameJobId');
+    if (runningJobId) {
+        $.getJSON('/jobs/' + runningJobId, function(job) {
+            if (job.status === 'queued' || job.status === 'running') {
+                startSSE('/jobs/' + runningJobId + '/events');
+            } else {
+                localStorage.removeItem('displayNameJobId');
+            }
+        }).fail(function() {
+            localStorage.removeItem('displayNameJobId');
+        });
+    }
+
     $('input[name="input_file"]').change(function() {
         updateButtonStates();
         if (this.files[0]) {
@@ -292,6 +335,9 @@ $(document).ready(function() {
             success: function(response) {
                 hideLoading();
                 if (response.redirect) {
+                    if (response.job_id) {
+                        localStorage.setItem('displayNameJobId', response.job_id);
+                    }
                     startSSE(response.redirect);
                 } else if (response.error) {
                     showToast('Error: ' + response.error);
@@ -55,22 +55,43 @@ function previewFile(file, previewElementId) {
     reader.readAsText(file);
 }
 
-function initializeEventSource() {
+function initializeEventSource(url) {
     $('#progress-container').show();
 
-    const eventSource = new EventSource('/rewrite_descriptions_two_steps');
+    // Jobbet körs på servern; EventSource återansluter själv med Last-Event-ID
+    const eventSource = new EventSource(url || '/rewrite_descriptions_two_steps');
 
     eventSource.onmessage = function(event) {
         try {
             var data = JSON.parse(event.data);
 
+            if (data.job_status) {
+                // Jobbet är klart på servern och alla events har skickats
+                localStorage.removeItem('rewriteJobId');
+                eventSource.close();
+            }
+
+            if (data.partial) {
+                // Texten för raden som skrivs just nu, medan den genereras
+                showLiveOutput(data.partial);
+                return;
+            }
+
+            if (data.summary) {
+                console.info('Job summary:', data.summary);
+                $('#job-summary').remove();
+                $('#progress-bars').append(`<p id="job-summary" class="text-muted small">${formatSummary(data.summary)}</p>`);
+                return;
+            }
+
             if (data.error) {
                 console.error('Error:', data.error);
                 showToast('Error: ' + data.error);
                 return;
             }
 
-            if (data.progress !== undefined) {
+            // Progress kommer som tick med bara de fält som ändrats sedan förra ticket
+            if (data.progress !== undefined || data.step_1 !== undefined || data.step_2 !== undefined) {
                 let progressBar = $('#progress-bar-english');
                 if (!progressBar.length) {
                     $('#progress-bars').html(`
@@ -80,16 +101,45 @@ function initializeEventSource() {
                                 <div id="progress-bar-english" class="progress-bar" role="progressbar" style="width: 0%;" aria-valuenow="0" aria-valuemin="0" aria-valuemax="100">0%</div>
                             </div>
                         </div>
+                        <div class="progress-group">
+                            <label>Step 1</label>
+                            <div class="progress">
+                                <div id="progress-bar-step-1" class="progress-bar" role="progressbar" style="width: 0%;" aria-valuenow="0" aria-valuemin="0" aria-valuemax="100">0%</div>
+                            </div>
+                        </div>
+                        <div class="progress-group">
+                            <label>Step 2</label>
+                            <div class="progress">
+                                <div id="progress-bar-step-2" class="progress-bar" role="progressbar" style="width: 0%;" aria-valuenow="0" aria-valuemin="0" aria-valuemax="100">0%</div>
+                            </div>
+                        </div>
                     `);
                     progressBar = $('#progress-bar-english');
                 }
-                progressBar.css('width', data.progress + '%')
-                           .attr('aria-valuenow', data.progress)
-                           .text(data.progress + '%');
+                if (data.progress !== undefined) {
+                    progressBar.css('width', data.progress + '%')
+                               .attr('aria-valuenow', data.progress)
+                               .text(data.progress + '%');
+                }
+
+                // Stegen körs parallellt, så båda visas separat
+                [['step_1', '#progress-bar-step-1'], ['step_2', '#progress-bar-step-2']].forEach(function([key, id]) {
+                    if (data[key] !== undefined) {
+                        $(id).css('width', data[key] + '%')
+                             .attr('aria-valuenow', data[key])
+                             .text(data[key] + '%');
+                    }
+                });
             }
 
             if (data.complete && data.file) {
-                showToast('All rewriting complete!<br><a href="/download/' + data.file + '" download>Download rewritten descriptions</a>', true);
+                localStorage.removeItem('rewriteJobId');
+                $('#live-output').remove();
+                let message = 'All rewriting complete!';
+                if (data.flagged) {
+                    message += `<br>${data.flagged} rows did not pass validation; see the Quality column.`;
+                }
+                showToast(message + '<br><a href="/download/' + data.file + '" download>Download rewritten descriptions</a>', true);
                 window.location.href = '/download/' + data.file;
                 eventSource.close();
             }
@@ -100,12 +150,45 @@ function initializeEventSource() {
 
     eventSource.onerror = function(err) {
         console.error('SSE error:', err);
-        eventSource.close();
-        showToast('Connection lost. Please try again.');
+        if (eventSource.readyState === EventSource.CLOSED) {
+            showToast('Connection lost. Reload the page to reattach to the running job.');
+        }
     };
 }
 
+function showLiveOutput(partial) {
+    let live = $('#live-output');
+    if (!live.length) {
+        $('#progress-bars').append(`
+            <div id="live-output" class="progress-group">
+                <label id="live-output-label"></label>
+                <pre id="live-output-text" style="white-space: pre-wrap;"></pre>
+            </div>
+        `);
+    }
+    $('#live-output-label').text(`Row ${partial.row + 1} · step ${partial.step}`);
+    $('#live-output-text').text(partial.text);
+}
+
+function resumeRunningJob() {
+    const jobId = localStorage.getItem('rewriteJobId');
+    if (!jobId) {
+        return;
+    }
+    $.getJSON('/jobs/' + jobId, function(job) {
+        if (job.status === 'queued' || job.status === 'running') {
+            initializeEventSource('/jobs/' + jobId + '/events');
+        } else {
+            localStorage.removeItem('rewriteJobId');
+        }
+    }).fail(function() {
+        localStorage.removeItem('rewriteJobId');
+    });
+}
+
 $(document).ready(function() {
+    resumeRunningJob();
+
     $('input[name="input_file"]').change(function() {
         updateButtonStates();
         if (this.files[0]) {
@@ -140,7 +223,10 @@ $(document).ready(function() {
             success: function(response) {
                 hideLoading();
                 if (response.redirect) {
-                    initializeEventSource();
+                    if (response.job_id) {
+                        localStorage.setItem('rewriteJobId', response.job_id);
+                    }
+                    initializeEventSource(response.redirect);
                 } else if (response.error) {
                     showToast('Error: ' + response.error);
                 }
@@ -156,3 +242,14 @@ $(document).ready(function() {
         hideToast();
     });
 });
+
+function formatSummary(summary) {
+    // Sammanfattning från servern när jobbet är klart
+    const parts = [`${summary.rows} rows in ${summary.seconds}s`];
+    if (summary.rows_per_second !== null) parts.push(`${summary.rows_per_second} rows/s`);
+    parts.push(`${summary.api_requests} API calls`);
+    if (summary.latency_p50 !== null) parts.push(`p50 ${summary.latency_p50}s / p95 ${summary.latency_p95}s`);
+    parts.push(`${summary.prompt_tokens + summary.completion_tokens} tokens`);
+    if (summary.rate_limited) parts.push(`${summary.rate_limited} rate limited`);
+    return parts.join(' · ');
+}
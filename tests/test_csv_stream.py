@@ -0,0 +1,31 @@
+import pandas as pd
+
+from csv_stream import ChunkedCsvWriter, count_rows, iter_chunks, needs_work
+
+
+def test_chunks_keep_running_index(tmp_path):
+    path = tmp_path / 'in.csv'
+    pd.DataFrame({"SKU": [f"A{i}" for i in range(5)]}).to_csv(path, index=False)
+    assert count_rows(str(path)) == 5
+    chunks = list(iter_chunks(str(path), 2))
+    assert [chunk.index.tolist() for chunk in chunks] == [[0, 1], [2, 3], [4]]
+
+
+def test_writer_appends_chunks_with_one_header(tmp_path):
+    path = tmp_path / 'out.csv'
+    with ChunkedCsvWriter([(str(path), ['SKU', 'sv'])]) as writer:
+        writer.write(pd.DataFrame({"SKU": ["A1"], "sv": ["Röd"], "de": ["Rot"]}))
+        writer.write(pd.DataFrame({"SKU": ["B2"], "sv": ["Blå"], "de": ["Blau"]}))
+    assert path.read_text().splitlines() == ['SKU,sv', 'A1,Röd', 'B2,Blå']
+
+
+def test_writer_without_chunks_still_writes_header(tmp_path):
+    path = tmp_path / 'out.csv'
+    with ChunkedCsvWriter([(str(path), ['SKU', 'sv'])]):
+        pass
+    assert path.read_text().splitlines() == ['SKU,sv']
+
+
+def test_needs_work_flags_missing_and_blank_cells():
+    series = pd.Series(["Röd", None, "  ", ""])
+    assert needs_work(series).tolist() == [False, True, True, True]
@@ -0,0 +1,75 @@
+import pandas as pd
+
+from delta import PreviousResults, load_previous_results, row_keys
+
+
+def test_row_keys_use_sku_and_text():
+    frame = pd.DataFrame({
+        "SKU": ["A1", "A1", "B2"], "Display Name": ["Red tie", "Blue tie", "Red tie"]
+    })
+    keys = row_keys(frame, "Display Name")
+    assert keys.str.startswith("A1\t").tolist() == [True, True, False]
+    assert len(set(keys)) == 3
+
+
+def test_row_keys_ignore_surrounding_whitespace_and_missing_text():
+    frame = pd.DataFrame({
+        "SKU": ["A1", "A1", "B2", "B2"],
+        "Display Name": ["Red tie", "  Red tie ", None, ""],
+    })
+    keys = row_keys(frame, "Display Name")
+    assert keys[0] == keys[1]
+    assert keys[2] == keys[3]
+
+
+def test_row_keys_fall_back_to_product_id_then_text_only():
+    by_product = pd.DataFrame({"Product ID": [7], "Display Name": ["Red tie"]})
+    assert row_keys(by_product, "Display Name")[0].startswith("7\t")
+    text_only = pd.DataFrame({"Display Name": ["Red tie"]})
+    assert row_keys(text_only, "Display Name")[0].startswith("\t")
+
+
+def test_row_keys_keep_frame_index():
+    frame = pd.DataFrame(
+        {"SKU": ["A1", "B2"], "Display Name": ["Red tie", "Blue tie"]}, index=[10, 20]
+    )
+    assert row_keys(frame, "Display Name").index.tolist() == [10, 20]
+
+
+def test_previous_results_fill_only_unchanged_rows():
+    previous = pd.DataFrame({
+        "SKU": ["A1", "B2", "C3"],
+        "Display Name": ["Red tie", "Blue tie", "Green tie"],
+        "Display name - sv": ["Röd slips", "Blå slips", ""],
+    })
+    results = PreviousResults(
+        "previous.csv", previous, "Display Name", ["Display name - sv"]
+    )
+    frame = pd.DataFrame({
+        "SKU": ["B2", "A1", "C3", "D4"],
+        "Display Name": ["Blue tie", "Red bow tie", "Green tie", "Red tie"],
+        "Display name - sv": ["", "", "", ""],
+    })
+    assert results.apply(frame) == 1
+    assert frame["Display name - sv"].tolist() == ["Blå slips", "", "", ""]
+
+
+def test_load_previous_results_keeps_only_rows_in_input(tmp_path):
+    (tmp_path / 'catalogs').mkdir()
+    pd.DataFrame({
+        "SKU": ["A1", "B2", "C3", "E5", "F6"],
+        "Display Name": ["Red tie", "Blue tie", "Green tie", "Pink tie", "Gray tie"],
+        "Notes": ["x", "y", "z", "w", "v"],
+        "Display name - sv": ["Röd slips", "Blå slips", "Grön slips", "Rosa", "Grå"],
+    }).to_csv(tmp_path / 'catalogs' / 'display_names-1.csv', index=False)
+    pd.DataFrame({
+        "SKU": ["B2", "A1", "C3"],
+        "Display Name": ["Blue tie", "Red bow tie", "Green tie"],
+    }).to_csv(tmp_path / 'input.csv', index=False)
+
+    results = load_previous_results(
+        str(tmp_path), 'display_names', str(tmp_path / 'input.csv'), "Display Name",
+        ["Display name - sv"]
+    )
+    assert results.path.endswith('display_names-1.csv')
+    assert sorted(results.columns["Display name - sv"]) == ["Blå slips", "Grön slips"]
@@ -0,0 +1,40 @@
+import pandas as pd
+
+from example_index import ExampleIndex
+
+PAIRS = [
+    ("Red silk tie", "Röd sidenslips"),
+    ("Blue silk tie", "Blå sidenslips"),
+    ("Red wool scarf", "Röd ullhalsduk"),
+    ("Pocket square", "Bröstnäsduk"),
+]
+
+
+def test_most_similar_examples_come_first():
+    index = ExampleIndex(PAIRS)
+    assert index.top_k(["Red silk bow tie"], 2) == [0, 1]
+
+
+def test_batch_cap_grows_with_batch_size():
+    index = ExampleIndex(PAIRS)
+    queries = ["Red silk tie", "Red wool scarf", "Pocket square"]
+    assert len(index.top_k(queries, 1, max_examples=2)) == 1
+    assert len(index.top_k(queries * 4, 1, max_examples=2)) == 2
+
+
+def test_unmatched_queries_fall_back_to_first_examples():
+    index = ExampleIndex(PAIRS)
+    assert index.top_k(["zzz"], 2) == [0, 1]
+    assert index.select(["zzz"], 1) == (
+        "Original: Red silk tie -> Translated: Röd sidenslips"
+    )
+
+
+def test_from_dataframe_skips_rows_without_translation():
+    frame = pd.DataFrame({
+        "Display Name": ["Red silk tie", "Blue silk tie"],
+        "Display name - sv": ["Röd sidenslips", None],
+    })
+    index = ExampleIndex.from_dataframe(frame, "Display name - sv")
+    assert index.pairs == [("Red silk tie", "Röd sidenslips")]
+    assert index.fingerprint != ExampleIndex(PAIRS).fingerprint
@@ -0,0 +1,48 @@
+from glossary import Glossary, _read_glossary_file
+
+ENTRIES = [
+    ("silk tie", "sidenslips"), ("tie", "slips"), ("bow tie", "fluga"),
+    ("pure silk", "rent silke"),
+]
+
+
+def test_whole_name_covered_by_one_phrase():
+    glossary = Glossary(ENTRIES)
+    assert glossary.translate("Silk tie") == "Sidenslips"
+    assert glossary.translate("bow tie") == "fluga"
+
+
+def test_passthrough_tokens_are_kept_in_place():
+    glossary = Glossary(ENTRIES)
+    assert glossary.translate("Silk tie 150x8") == "Sidenslips 150x8"
+    assert glossary.translate("2 bow tie") == "2 fluga"
+
+
+def test_names_needing_several_phrases_go_to_the_model():
+    glossary = Glossary(ENTRIES)
+    assert glossary.translate("pure silk bow tie") is None
+    assert glossary.translate("Silk tie tie") is None
+
+
+def test_unknown_words_and_bare_codes_go_to_the_model():
+    glossary = Glossary(ENTRIES)
+    assert glossary.translate("Handmade silk tie") is None
+    assert glossary.translate("150x8") is None
+    assert glossary.translate("") is None
+
+
+def test_extra_entries_match_but_are_not_validation_terms():
+    glossary = Glossary(ENTRIES, [("Handmade silk tie", "Handgjord sidenslips")])
+    assert glossary.translate("handmade silk tie") == "Handgjord sidenslips"
+    assert ("Handmade silk tie", "Handgjord sidenslips") not in glossary.terms
+
+
+def test_short_rows_in_glossary_file_skip_missing_languages(tmp_path):
+    path = tmp_path / 'glossary.csv'
+    path.write_text(
+        "English,sv,de\nsilk tie,sidenslips,Seidenkrawatte\nbow tie,fluga\n"
+    )
+    assert _read_glossary_file(str(path)) == {
+        "sv": [("silk tie", "sidenslips"), ("bow tie", "fluga")],
+        "de": [("silk tie", "Seidenkrawatte")],
+    }
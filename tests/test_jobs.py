@@ -0,0 +1,73 @@
+import pytest
+
+import jobs
+from jobs import JobRunner, JobStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite3')
+
+
+def orphan(store, params=None):
+    # Ett jobb som en död process lämnade som running utan ägare
+    job_id = store.create('translate_display_names', params or {})
+    store.conn.execute(
+        "UPDATE jobs SET status = 'running', owner = NULL WHERE id = ?", (job_id,)
+    )
+    store.conn.commit()
+    return job_id
+
+
+def test_only_one_process_claims_an_orphaned_job(path):
+    first, second = JobStore(path), JobStore(path)
+    job_id = orphan(first)
+    assert [job[0] for job in second.unfinished()] == [job_id]
+    assert first.claim(job_id, 'a')
+    assert not second.claim(job_id, 'b')
+    assert second.unfinished() == []
+
+
+def test_expired_lease_can_be_claimed(path, monkeypatch):
+    store = JobStore(path)
+    job_id = store.create('translate_display_names', {}, owner='a')
+    assert not store.claim(job_id, 'b')
+    now = jobs.time.time()
+    monkeypatch.setattr(jobs.time, 'time', lambda: now + jobs.JOB_LEASE_SECONDS + 1)
+    assert store.claim(job_id, 'b')
+
+
+def test_renewed_lease_is_kept(path, monkeypatch):
+    store = JobStore(path)
+    job_id = store.create('translate_display_names', {}, owner='a')
+    now = jobs.time.time()
+    monkeypatch.setattr(jobs.time, 'time', lambda: now + jobs.JOB_LEASE_SECONDS - 1)
+    store.renew([job_id], 'a')
+    monkeypatch.setattr(jobs.time, 'time', lambda: now + jobs.JOB_LEASE_SECONDS + 1)
+    assert not store.claim(job_id, 'b')
+
+
+def test_finished_jobs_are_not_claimed(path):
+    store = JobStore(path)
+    job_id = orphan(store)
+    store.set_status(job_id, 'completed')
+    assert not store.claim(job_id, 'a')
+
+
+def test_job_without_input_is_marked_interrupted(path, tmp_path):
+    store = JobStore(path)
+    job_id = orphan(store, {"upload_folder": str(tmp_path), "input_file": 'gone.csv'})
+    runner = JobRunner(store, workers=1)
+    runner.resume_unfinished()
+    assert store.get(job_id)["status"] == 'interrupted'
+    assert runner.active == set()
+
+
+def test_input_files_of_unfinished_jobs(path):
+    store = JobStore(path)
+    store.create('translate_display_names', {
+        "input_file": 'store/a.csv', "examples_file": 'store/b.csv'
+    })
+    done = store.create('rewrite_descriptions_two_steps', {"input_file": 'store/c.csv'})
+    store.set_status(done, 'completed')
+    assert store.input_files() == {'store/a.csv', 'store/b.csv'}
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from journal import ResultJournal, write_outputs
+
+
+def test_journal_replays_appended_cells(tmp_path):
+    journal = ResultJournal(str(tmp_path / 'journal.jsonl'))
+    assert journal.replay() == {}
+    with journal:
+        journal.append(0, 'Display name - sv', 'Röd slips')
+        journal.append(3, 'Display name - sv', 'Blå slips')
+    assert ResultJournal(journal.path).replay() == {
+        (0, 'Display name - sv'): 'Röd slips', (3, 'Display name - sv'): 'Blå slips'
+    }
+
+
+def test_journal_skips_half_written_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    path.write_text('{"row": 0, "column": "a", "value": "x"}\n{"row": 1, "col')
+    with ResultJournal(str(path)) as journal:
+        journal.append(2, 'a', 'z')
+    assert journal.replay() == {(0, 'a'): 'x', (2, 'a'): 'z'}
+    journal.remove()
+    assert not path.exists()
+
+
+def test_write_outputs_writes_each_file_in_one_pass(tmp_path):
+    frame = pd.DataFrame({
+        "SKU": ["A1", "B2"], "sv": ["Röd", None], "de": ["Rot", "Blau"]
+    })
+    write_outputs(frame, [
+        (str(tmp_path / 'sv.csv'), ['SKU', 'sv']),
+        (str(tmp_path / 'all.csv'), ['SKU', 'sv', 'de']),
+    ])
+    assert (tmp_path / 'sv.csv').read_text().splitlines() == ['SKU,sv', 'A1,Röd', 'B2,']
+    assert pd.read_csv(tmp_path / 'all.csv').columns.tolist() == ['SKU', 'sv', 'de']
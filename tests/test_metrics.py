@@ -0,0 +1,14 @@
+from metrics import Registry
+
+
+def test_render_counters_and_cumulative_histogram():
+    registry = Registry()
+    registry.inc('translator_api_retries_total', 2, {"reason": "error"})
+    registry.observe('translator_api_request_duration_seconds', 0.3, {})
+    registry.observe('translator_api_request_duration_seconds', 100.0, {})
+    lines = registry.render().splitlines()
+    assert 'translator_api_retries_total{reason="error"} 2' in lines
+    assert 'translator_api_request_duration_seconds_bucket{le="0.25"} 0' in lines
+    assert 'translator_api_request_duration_seconds_bucket{le="0.5"} 1' in lines
+    assert 'translator_api_request_duration_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'translator_api_request_duration_seconds_count 2' in lines
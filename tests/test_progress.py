@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import progress
+from progress import ProgressTicker
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(progress.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def decoded(message):
+    return json.loads(message) if message else None
+
+
+def test_first_tick_is_sent_in_full():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    assert decoded(ticker.tick({"progress": 1, "cache_hits": 0}, 'Swedish')) == {
+        "language": 'Swedish', "progress": 1, "cache_hits": 0
+    }
+
+
+def test_ticks_within_interval_are_held_back(clock):
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 1}, 'Swedish')
+    clock[0] += 0.1
+    assert ticker.tick({"progress": 3}, 'Swedish') is None
+    clock[0] += 0.5
+    assert decoded(ticker.tick({"progress": 4}, 'Swedish')) == {
+        "language": 'Swedish', "progress": 4
+    }
+
+
+def test_step_and_completion_bypass_interval():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 1}, 'Swedish')
+    assert decoded(ticker.tick({"progress": 6}, 'Swedish')) == {
+        "language": 'Swedish', "progress": 6
+    }
+    assert decoded(ticker.tick({"progress": 100}, 'Swedish')) == {
+        "language": 'Swedish', "progress": 100
+    }
+
+
+def test_only_changed_fields_are_sent(clock):
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 10, "cache_hits": 4, "api_requests": 1}, 'German')
+    clock[0] += 1
+    fields = {"progress": 12, "cache_hits": 4, "api_requests": 2}
+    assert decoded(ticker.tick(fields, 'German')) == {
+        "language": 'German', "progress": 12, "api_requests": 2
+    }
+    clock[0] += 1
+    assert ticker.tick(fields, 'German') is None
+
+
+def test_languages_are_throttled_separately():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 1}, 'Swedish')
+    assert decoded(ticker.tick({"progress": 1}, 'German')) == {
+        "language": 'German', "progress": 1
+    }
+
+
+def test_events_without_language_have_no_language_field():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    assert decoded(ticker.tick({"progress": 2, "step_1": 3, "step_2": 1})) == {
+        "progress": 2, "step_1": 3, "step_2": 1
+    }
+
+
+def test_non_numeric_progress_is_sent_when_it_changes():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 40}, 'French')
+    assert decoded(ticker.tick({"progress": "no_examples"}, 'French')) == {
+        "language": 'French', "progress": "no_examples"
+    }
+
+
+def test_flush_sends_held_back_ticks():
+    ticker = ProgressTicker(interval=0.5, step=5)
+    ticker.tick({"progress": 1}, 'Swedish')
+    ticker.tick({"progress": 1}, 'German')
+    ticker.tick({"progress": 2}, 'Swedish')
+    ticker.tick({"progress": 3}, 'German')
+    assert [decoded(message) for message in ticker.flush()] == [
+        {"language": 'Swedish', "progress": 2}, {"language": 'German', "progress": 3}
+    ]
+    assert ticker.flush() == []
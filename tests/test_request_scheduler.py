@@ -0,0 +1,98 @@
+import pytest
+
+from request_scheduler import RequestScheduler, TokenBucket, parse_reset
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("2", 2.0),
+    ("0.5", 0.5),
+    ("1s", 1.0),
+    ("20ms", 0.02),
+    ("6m0s", 360.0),
+    ("1h2m3s", 3723.0),
+    ("", None),
+    (None, None),
+    ("soon", None),
+])
+def test_parse_reset(value, seconds):
+    if seconds is None:
+        assert parse_reset(value) is None
+    else:
+        assert parse_reset(value) == pytest.approx(seconds)
+
+
+def test_unknown_limit_never_waits():
+    bucket = TokenBucket()
+    bucket.take(10_000, 0.0)
+    assert bucket.wait_time(10_000, 0.0) == 0.0
+
+
+def test_bucket_waits_until_refilled():
+    bucket = TokenBucket(60)
+    bucket.updated = 0.0
+    bucket.take(60, 0.0)
+    # 60 per minut = 1 per sekund
+    assert bucket.wait_time(1, 0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, 1.0) == 0.0
+    assert bucket.wait_time(30, 10.0) == pytest.approx(20.0)
+
+
+def test_bucket_refill_is_capped_at_capacity():
+    bucket = TokenBucket(60)
+    bucket.updated = 0.0
+    bucket.take(30, 0.0)
+    bucket.wait_time(1, 600.0)
+    assert bucket.level == 60
+
+
+def test_requests_larger_than_capacity_wait_for_a_full_bucket():
+    bucket = TokenBucket(60)
+    bucket.updated = 0.0
+    assert bucket.wait_time(1000, 0.0) == 0.0
+
+
+def test_sync_learns_limit_and_trusts_lower_remaining():
+    bucket = TokenBucket()
+    bucket.updated = 0.0
+    bucket.sync(1000, 200, 0.0)
+    assert bucket.capacity == 1000
+    assert bucket.level == 200
+    bucket.sync(None, 500, 0.0)
+    assert bucket.level == 200
+
+
+def successes(scheduler, count, latency, tokens):
+    for _ in range(count):
+        scheduler._on_success({}, latency, tokens)
+
+
+def test_concurrency_grows_while_latency_is_steady():
+    scheduler = RequestScheduler('test', initial_concurrency=4, max_concurrency=64)
+    successes(scheduler, 100, 0.5, 500)
+    assert scheduler.concurrency > 10
+
+
+def test_short_requests_do_not_collapse_concurrency():
+    # Latensen jämförs per token: en kort omskickad rad följd av stora batcher är
+    # ingen försämring
+    scheduler = RequestScheduler('test', initial_concurrency=16, max_concurrency=64)
+    successes(scheduler, 20, 0.4, 100)
+    successes(scheduler, 200, 2.0, 500)
+    assert scheduler.concurrency >= 16
+
+
+def test_concurrency_recovers_after_a_lasting_slowdown():
+    scheduler = RequestScheduler('test', initial_concurrency=17, max_concurrency=64)
+    successes(scheduler, 20, 0.4, 500)
+    successes(scheduler, 30, 2.0, 500)
+    lowest = scheduler.concurrency
+    assert lowest < 17
+    successes(scheduler, 300, 2.0, 500)
+    assert scheduler.concurrency > max(lowest, 17)
+
+
+def test_rate_limit_halves_concurrency_and_blocks():
+    scheduler = RequestScheduler('test', initial_concurrency=8)
+    scheduler._on_rate_limited({'retry-after': '2'})
+    assert scheduler.concurrency == 4
+    assert scheduler.blocked_until > 0
@@ -0,0 +1,113 @@
+import pytest
+
+import sharding
+from sharding import MAX_ATTEMPTS, ShardStore
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sharding.time, 'time', lambda: now[0])
+    monkeypatch.setattr(sharding, 'LEASE_SECONDS', 60)
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ShardStore(str(tmp_path / 'shards.sqlite3'))
+    for shard in range(2):
+        store.add('job', shard, 'translate_display_names', {"shard": shard}, 10)
+    return store
+
+
+def statuses(store, job_key='job'):
+    return [shard["status"] for shard in store.shards(job_key)]
+
+
+def test_claim_takes_pending_shards_in_order(store):
+    assert store.claim('a') == ('job', 0, 'translate_display_names', {"shard": 0})
+    assert store.claim('b') == ('job', 1, 'translate_display_names', {"shard": 1})
+    assert store.claim('c') is None
+    assert statuses(store) == ['leased', 'leased']
+
+
+def test_claim_is_limited_to_job(store):
+    store.add('other', 0, 'translate_display_names', {}, 5)
+    assert store.claim('a', 'other')[:2] == ('other', 0)
+    assert store.claim('a', 'other') is None
+
+
+def test_add_keeps_existing_shard(store):
+    store.claim('a')
+    store.add('job', 0, 'translate_display_names', {"shard": 0}, 10)
+    assert statuses(store) == ['leased', 'pending']
+
+
+def test_expired_lease_is_taken_over(store, clock):
+    store.claim('dead')
+    store.claim('dead')
+    clock[0] += 30
+    assert store.claim('new') is None
+    clock[0] += 31
+    assert store.claim('new')[:2] == ('job', 0)
+    # Den gamla ägaren har förlorat leasen och kan varken förlänga eller avsluta
+    # shardens körning
+    assert not store.heartbeat('job', 0, 'dead', {})
+    store.finish('job', 0, 'dead', {}, True)
+    assert statuses(store) == ['leased', 'leased']
+
+
+def test_heartbeat_extends_lease(store, clock):
+    store.claim('a')
+    clock[0] += 50
+    assert store.heartbeat('job', 0, 'a', {"progress": {"": {"progress": 40}}})
+    clock[0] += 50
+    assert store.claim('b')[:2] == ('job', 1)
+    assert store.claim('b') is None
+    assert store.shards('job')[0]["state"] == {"progress": {"": {"progress": 40}}}
+
+
+def test_failed_shard_is_retried_until_max_attempts(store):
+    for _ in range(MAX_ATTEMPTS):
+        job_key, shard, _, _ = store.claim('a', 'job')
+        assert shard == 0
+        store.finish(job_key, shard, 'a', {}, False)
+    assert statuses(store) == ['failed', 'pending']
+    store.retry_failed('job')
+    assert statuses(store) == ['pending', 'pending']
+    assert store.claim('a')[:2] == ('job', 0)
+
+
+def test_unfinished_counts_until_done(store):
+    assert store.unfinished('job') == 2
+    for _ in range(2):
+        job_key, shard, _, _ = store.claim('a')
+        store.finish(job_key, shard, 'a', {}, True)
+    assert store.unfinished('job') == 0
+    assert statuses(store) == ['done', 'done']
+
+
+def test_fail_unfinished_stops_running_shards(store):
+    store.claim('a')
+    store.fail_unfinished('job')
+    assert statuses(store) == ['failed', 'failed']
+    assert store.unfinished('job') == 0
+    assert not store.heartbeat('job', 0, 'a', {})
+    assert store.claim('b') is None
+
+
+def test_progress_events_weight_shards_by_rows():
+    shards = [
+        {
+            "shard": 0, "rows": 30, "status": 'done',
+            "state": {"progress": {"Swedish": {"progress": 100}}}
+        },
+        {
+            "shard": 1, "rows": 10, "status": 'leased',
+            "state": {"progress": {"Swedish": {"progress": 50}}}
+        },
+        {"shard": 2, "rows": 60, "status": 'pending', "state": {}},
+    ]
+    assert sharding._progress_events('translate_display_names', shards, 100) == {
+        "Swedish": {"language": "Swedish", "progress": 35}
+    }
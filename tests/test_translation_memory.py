@@ -0,0 +1,39 @@
+import translation_memory
+from translation_memory import TranslationMemory
+
+
+def last_used(memory, text):
+    key = memory.make_key(text, 'sv', 'model', 'prompt')
+    return memory.conn.execute(
+        "SELECT last_used FROM translations WHERE key = ?", (key,)
+    ).fetchone()[0]
+
+
+def test_hits_are_touched_in_one_batch(tmp_path, monkeypatch):
+    memory = TranslationMemory(str(tmp_path / 'memory.sqlite3'))
+    clock = [1000.0]
+    monkeypatch.setattr(translation_memory.time, 'time', lambda: clock[0])
+    memory.put('Red tie', 'sv', 'model', 'prompt', 'Röd slips')
+    clock[0] += 60
+    assert memory.get('Red  tie', 'sv', 'model', 'prompt') == 'Röd slips'
+    assert memory.get('Blue tie', 'sv', 'model', 'prompt') is None
+    # Träffen skrivs inte förrän flush
+    assert last_used(memory, 'Red tie') == 1000.0
+    memory.flush()
+    assert last_used(memory, 'Red tie') == 1060.0
+    assert memory.touched == {}
+
+
+def test_eviction_sees_pending_hits(tmp_path, monkeypatch):
+    memory = TranslationMemory(str(tmp_path / 'memory.sqlite3'), max_entries=1)
+    clock = [1000.0]
+    monkeypatch.setattr(translation_memory.time, 'time', lambda: clock[0])
+    memory.put('Red tie', 'sv', 'model', 'prompt', 'Röd slips')
+    clock[0] += 1
+    memory.put('Blue tie', 'sv', 'model', 'prompt', 'Blå slips')
+    clock[0] += 1
+    memory.get('Red tie', 'sv', 'model', 'prompt')
+    with memory.lock:
+        memory._evict(clock[0])
+    assert memory.get('Red tie', 'sv', 'model', 'prompt') == 'Röd slips'
+    assert memory.get('Blue tie', 'sv', 'model', 'prompt') is None
@@ -0,0 +1,33 @@
+import os
+
+import upload_store
+
+
+def stored(tmp_path, digest, age):
+    folder = tmp_path / upload_store.STORE_FOLDER
+    folder.mkdir(exist_ok=True)
+    used = upload_store.time.time() - age
+    for name in (f"{digest}.csv", f"{digest}-0123456789abcdef.pkl"):
+        (folder / name).write_text('SKU\nA1\n')
+        os.utime(folder / name, (used, used))
+    return os.path.join(upload_store.STORE_FOLDER, f"{digest}.csv")
+
+
+def test_evict_removes_old_uploads_with_their_caches(tmp_path):
+    stored(tmp_path, 'old', upload_store.MAX_AGE_SECONDS + 1)
+    recent = stored(tmp_path, 'recent', 60)
+    upload_store.evict(str(tmp_path))
+    assert sorted(os.listdir(tmp_path / upload_store.STORE_FOLDER)) == [
+        'recent-0123456789abcdef.pkl', 'recent.csv'
+    ]
+    assert os.path.exists(tmp_path / recent)
+
+
+def test_evict_keeps_inputs_of_unfinished_jobs(tmp_path):
+    # Ett långt jobb har inte rört sin indatafil sedan det startade
+    pinned = stored(tmp_path, 'running', upload_store.EVICTION_GRACE_SECONDS * 6)
+    stored(tmp_path, 'idle', upload_store.EVICTION_GRACE_SECONDS * 6)
+    upload_store.evict(str(tmp_path), max_bytes=0, pinned={pinned})
+    assert sorted(os.listdir(tmp_path / upload_store.STORE_FOLDER)) == [
+        'running-0123456789abcdef.pkl', 'running.csv'
+    ]
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from validation import QUALITY_OK, QUALITY_RETRIED, _glossary_rule, check, validate
+
+
+def flags(source, output, **kwargs):
+    return check(pd.Series(source), pd.Series(output), 20, **kwargs).tolist()
+
+
+def test_check_passes_translated_rows():
+    assert flags(["Red tie", "Blue scarf"], ["Röd slips", "Blå halsduk"]) == ['', '']
+
+
+def test_check_flags_empty_and_no_examples():
+    result = flags(["Red tie", "Red tie", ""], ["", "No examples available", ""])
+    assert result == ['empty', 'no_examples', '']
+
+
+def test_check_flags_untranslated_text():
+    result = flags(
+        ["Red tie", "Tie with dots", "XL"], ["red tie", "Slips with prickar", "XL"]
+    )
+    # Oförändrad text räknas bara när den innehåller ord (storlekar och koder får stå
+    # kvar)
+    assert result == ['untranslated', 'untranslated', '']
+
+
+def test_check_skips_untranslated_rule_for_rewrites():
+    assert flags(["The red tie"], ["The red tie"], translated=False) == ['']
+
+
+def test_check_flags_too_long_output():
+    assert flags(["Tie"], ["Slips " * 10]) == ['too_long']
+
+
+def test_check_combines_rules():
+    assert flags(["Tie"], ["The " * 10]) == ['too_long,untranslated']
+
+
+def test_glossary_rule_matches_longest_term_first_and_ignores_spacing():
+    pattern, targets = _glossary_rule(
+        (("silk tie", "sidenslips"), ("tie", "slips"), ("scarf", ""))
+    )
+    assert targets == {"silk tie": "sidenslips", "tie": "slips"}
+    assert pattern.findall("Silk  Tie and tie") == ["Silk  Tie", "tie"]
+
+
+def test_glossary_rule_without_terms():
+    assert _glossary_rule(()) == (None, {})
+
+
+def test_check_flags_missing_glossary_term():
+    terms = (("silk tie", "sidenslips"),)
+    result = flags(
+        ["Red silk tie", "Red silk tie", "Red tie"],
+        ["Röd sidenslips", "Röd slips", "Röd slips"],
+        glossary_terms=terms
+    )
+    assert result == ['', 'glossary', '']
+
+
+def test_validate_rerequests_only_failing_rows():
+    frame = pd.DataFrame({
+        "source": ["Red tie", "Blue tie", "Green tie"],
+        "output": ["Röd slips", "", "Green tie"],
+    })
+    requested = []
+
+    def rerequest(index):
+        requested.append(index)
+        return {"output": "Blå slips" if index == 1 else "Green tie"}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = validate(frame, "source", "output", "quality", rerequest, executor, 20)
+
+    assert sorted(requested) == [1, 2]
+    assert frame["output"].tolist() == ["Röd slips", "Blå slips", "Green tie"]
+    assert frame["quality"].tolist() == [QUALITY_OK, QUALITY_RETRIED, "untranslated"]
+    assert result == {"retried": 2, "flagged": 1}
+
+
+def test_validate_keeps_flag_when_rerequest_fails():
+    frame = pd.DataFrame({"source": ["Red tie"], "output": [""]})
+
+    def rerequest(_index):
+        raise RuntimeError("API down")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        result = validate(frame, "source", "output", "quality", rerequest, executor, 20)
+
+    assert frame["quality"].tolist() == ["empty"]
+    assert result == {"retried": 1, "flagged": 1}
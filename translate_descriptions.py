@@ -1,28 +1,81 @@
 # translate_descriptions.py
 
-import pandas as pd
-import os
+import csv
 import json
-import sys
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
-from time import sleep
+import os
 import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from threading import Lock
+
 import openai
+import pandas as pd
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
-# Sätt client till openai för att använda ny anropsmetod
-client = openai
-client.api_key = os.getenv('OPENAI_API_KEY')
+from csv_stream import (
+    CHUNK_SIZE,
+    ChunkedCsvWriter,
+    count_rows,
+    iter_chunks,
+    needs_work,
+    should_stream,
+)
+from delta import DELTA_MODE, load_previous_results, save_snapshot
+from journal import ResultJournal, file_digest, journal_path, write_outputs
+from metrics import ContextThreadPoolExecutor, inc, record_retry, timed
+from openai_client import get_openai_client
+from progress import ProgressTicker
+from request_scheduler import create_chat_completion, stream_chat_completion
+from translation_memory import get_translation_memory, prompt_hash
+from upload_store import load_frame
+from validation import VALIDATION_MODE, check, validate
+
+# Delad klient med anslutningspool för båda pipelinerna
+client = get_openai_client()
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
                     stream=sys.stdout)
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def rewrite_single_description(text, system_prompt, user_prompt):
+MODEL = "gpt-4"
+TARGET_LANGUAGE = "English"
+
+# Övre gräns för samtidiga API-anrop per steg; schemaläggaren anpassar den faktiska
+# samtidigheten
+MAX_CONCURRENT_REQUESTS = int(os.getenv('DESCRIPTION_CONCURRENCY', '16'))
+# Strömma texten medan den genereras och skicka den som partial-events
+STREAM_OUTPUT = os.getenv('DESCRIPTION_STREAM_OUTPUT', '1') != '0'
+# Högst så här ofta (sekunder) skickas ny deltext
+PARTIAL_INTERVAL = 0.25
+# En omskriven beskrivning får vara så många tecken längre än valideringens längdkvot
+# tillåter
+LENGTH_SLACK = 200
+
+def cached_rewrite(text, system_prompt, user_prompt):
+    # Returnerar None om texten inte finns i översättningsminnet
+    if pd.isna(text) or not text.strip():
+        return None
+    return get_translation_memory().get(
+        text, TARGET_LANGUAGE, MODEL, prompt_hash(system_prompt, user_prompt)
+    )
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+       retry=retry_if_not_exception_type(openai.RateLimitError),
+       before_sleep=record_retry)
+def rewrite_single_description(text, system_prompt, user_prompt, on_partial=None):
     if pd.isna(text) or not text.strip():
         return ""
 
+    instruction = (
+        "Rewrite this English product description according to the system and user "
+        "instructions above. The final output should be in English."
+    )
     combined_prompt = f"""
 System prompt:
 {system_prompt}
@@ -33,20 +86,24 @@ User prompt:
 Original text:
 {text}
 
-Rewrite this English product description according to the system and user instructions above. The final output should be in English.
+{instruction}
 """
 
-    # Anropa den nya metoden
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are an expert product copywriter."},
-            {"role": "user", "content": combined_prompt}
-        ],
-        temperature=0.1
-    )
-
-    rewritten_text = response.choices[0].message.content.strip()
+    messages = [
+        {"role": "system", "content": "You are an expert product copywriter."},
+        {"role": "user", "content": combined_prompt}
+    ]
+    if on_partial is not None:
+        # Strömmande svar: on_partial får texten medan den skrivs
+        rewritten_text = stream_chat_completion(
+            client, on_partial, model=MODEL, messages=messages, temperature=0.1
+        ).strip()
+    else:
+        # Anropa den nya metoden
+        response = create_chat_completion(
+            client, model=MODEL, messages=messages, temperature=0.1
+        )
+        rewritten_text = response.choices[0].message.content.strip()
 
     # Korrigera versalisering i början av meningar
     rewritten_text = re.sub(
@@ -55,53 +112,350 @@ Rewrite this English product description according to the system and user instru
         rewritten_text
     )
 
+    if rewritten_text:
+        get_translation_memory().put(
+            text, TARGET_LANGUAGE, MODEL, prompt_hash(system_prompt, user_prompt),
+            rewritten_text
+        )
+
     return rewritten_text
 
-def rewrite_descriptions_two_steps_function(upload_folder, input_file, system_prompt_1, user_prompt_1, system_prompt_2, user_prompt_2):
-    try:
-        input_csv = os.path.join(upload_folder, input_file)
-        input_df = pd.read_csv(input_csv, sep=None, engine='python', dtype={'SKU': str})
-        total_rows = len(input_df)
+def _rewrite_step(text, system_prompt, user_prompt, on_partial=None):
+    # Körs i en arbetstråd; returnerar (text, kom_från_minnet)
+    cached = cached_rewrite(text, system_prompt, user_prompt)
+    if cached is not None:
+        return cached, True
+    rewritten = rewrite_single_description(text, system_prompt, user_prompt, on_partial)
+    return rewritten, False
 
-        if 'Description (Rewrite Step 1)' not in input_df.columns:
-            input_df['Description (Rewrite Step 1)'] = ''
+class LiveText:
+    # Deltext per (steg, rad) från arbetstrådarna. En rad i taget följs tills den är
+    # klar (helst i steg 2), så att förhandsvisningen inte hoppar mellan rader.
+    def __init__(self):
+        self.lock = Lock()
+        self.texts = {}
+        self.focus = None
+        self.sent = None
 
-        # Steg 1
-        for i in range(total_rows):
-            text = input_df.iloc[i]['Description']
-            try:
-                rewritten = rewrite_single_description(text, system_prompt_1, user_prompt_1)
-                input_df.loc[i, 'Description (Rewrite Step 1)'] = rewritten
-                progress = int(((i + 1) / (2 * total_rows)) * 100)
-                yield json.dumps({"progress": progress}) + "\n\n"
-                sleep(0.3)
-            except Exception as e:
-                error_msg = f"Error at step 1, index {i}: {str(e)}"
-                logging.error(error_msg)
-                yield json.dumps({"error": error_msg}) + "\n\n"
+    def update(self, step, index, text):
+        with self.lock:
+            self.texts[(step, index)] = text
+
+    def finish(self, step, index):
+        with self.lock:
+            self.texts.pop((step, index), None)
+            if self.focus == (step, index):
+                self.focus = None
+
+    def take(self):
+        # Senaste texten för raden som följs, eller None om inget nytt finns
+        with self.lock:
+            if self.focus not in self.texts:
+                if not self.texts:
+                    return None
+                self.focus = max(self.texts, key=lambda key: key[0])
+            text = self.texts[self.focus]
+            if self.sent == (self.focus, text):
+                return None
+            self.sent = (self.focus, text)
+            return self.focus + (text,)
+
+def _rewrite_chunk(chunk, pools, prompts, journal, replayed, state, on_row_done=None,
+                   previous=None, live=None):
+    # Kör båda stegen för raderna i chunk (hela filen i vanligt läge). Varje rad går
+    # vidare till steg 2 så fort dess steg 1 är klart. state delas mellan chunkar för
+    # progress. previous (deltaläge) ger texter från förra körningen för rader som inte
+    # ändrats.
+    # live (strömmande svar) samlar deltext som skickas som partial-events.
+    step_columns = state["step_columns"]
+    total_rows = state["total_rows"]
+
+    def progress_event():
+        # Ett tick (bara ändrade fält) eller None om det inte är dags än
+        def percent(done):
+            value = int(done / total_rows * 100) if total_rows else 100
+            # I strömmande läge är totalen en uppskattning
+            return value if state["exact_total"] else min(value, 99)
+        return state["ticker"].tick({
+            "progress": percent((state["done"][1] + state["done"][2]) / 2),
+            "step_1": percent(state["done"][1]),
+            "step_2": percent(state["done"][2]),
+            "cache_hits": state["cache_hits"]
+        })
 
-        if 'Description (Rewritten)' not in input_df.columns:
-            input_df['Description (Rewritten)'] = ''
+    def submit(step, index, text):
+        system_prompt, user_prompt = prompts[step]
+        on_partial = None
+        if live is not None:
+            def on_partial(partial):
+                live.update(step, index, partial)
+        future = pools[step].submit(
+            _rewrite_step, text, system_prompt, user_prompt, on_partial
+        )
+        futures[future] = (step, index)
 
-        # Steg 2
-        for j in range(total_rows):
-            text_step_1 = input_df.iloc[j]['Description (Rewrite Step 1)']
+    def partial_event():
+        latest = live.take() if live is not None else None
+        if latest is None:
+            return None
+        step, index, text = latest
+        return json.dumps({
+            "partial": {"row": int(index), "step": step, "text": text}
+        }) + "\n\n"
+
+    # Tomma beskrivningar behöver inga anrop; hittas vektoriserat i stället för cell
+    # för cell
+    empty = needs_work(chunk['Description'])
+    previous_cells = previous.cells(chunk) if previous is not None else {}
+    futures = {}
+    resumed = 0
+    reused = 0
+    rows = zip(chunk.index, chunk['Description'], empty, strict=True)
+    for index, text, is_empty in rows:
+        step_1_text = replayed.get((index, step_columns[1]))
+        step_2_text = replayed.get((index, step_columns[2]))
+        if is_empty:
+            step_1_text = step_1_text if step_1_text is not None else ""
+            step_2_text = step_2_text if step_2_text is not None else ""
+        elif step_1_text is not None or step_2_text is not None:
+            resumed += 1
+        elif ((index, step_columns[1]) in previous_cells
+              or (index, step_columns[2]) in previous_cells):
+            step_1_text = previous_cells.get((index, step_columns[1]))
+            step_2_text = previous_cells.get((index, step_columns[2]))
+            reused += 1
+
+        if step_1_text is not None:
+            chunk.at[index, step_columns[1]] = step_1_text
+            state["done"][1] += 1
+        if step_2_text is not None:
+            chunk.at[index, step_columns[2]] = step_2_text
+            state["done"][2] += 1
+            if on_row_done:
+                on_row_done(index)
+        elif step_1_text is not None:
+            submit(2, index, step_1_text)
+        else:
+            submit(1, index, text)
+
+    if resumed:
+        logging.info(f"Resumed {resumed} rows from {journal.path}")
+        yield json.dumps({"resumed": resumed}) + "\n\n"
+    if reused:
+        state["reused"] += reused
+        yield json.dumps({"reused": state["reused"]}) + "\n\n"
+
+    while futures:
+        done, _ = wait(
+            futures, timeout=PARTIAL_INTERVAL if live is not None else None,
+            return_when=FIRST_COMPLETED
+        )
+        partial = partial_event()
+        if partial:
+            yield partial
+        for future in done:
+            step, index = futures.pop(future)
+            if live is not None:
+                live.finish(step, index)
             try:
-                rewritten_step_2 = rewrite_single_description(text_step_1, system_prompt_2, user_prompt_2)
-                input_df.loc[j, 'Description (Rewritten)'] = rewritten_step_2
-                progress = int(((total_rows + j + 1) / (2 * total_rows)) * 100)
-                yield json.dumps({"progress": progress}) + "\n\n"
-                sleep(0.3)
+                rewritten, cached = future.result()
+                state["cache_hits"] += cached
+                journal.append(index, step_columns[step], rewritten)
             except Exception as e:
-                error_msg = f"Error at step 2, index {j}: {str(e)}"
+                rewritten = None
+                error_msg = f"Error at step {step}, index {index}: {str(e)}"
                 logging.error(error_msg)
                 yield json.dumps({"error": error_msg}) + "\n\n"
 
-        # Spara slutlig fil
+            state["done"][step] += 1
+            if rewritten is None:
+                # Misslyckade steg journalförs inte och steg 2 körs inte på en tom
+                # text: raden lämnas tom, valideringen skickar om den och ett
+                # återupptaget jobb gör om den
+                if step == 1:
+                    state["done"][2] += 1
+                if on_row_done:
+                    on_row_done(index)
+            else:
+                chunk.at[index, step_columns[step]] = rewritten
+                if step == 1:
+                    submit(2, index, rewritten)
+                elif on_row_done:
+                    on_row_done(index)
+
+            message = progress_event()
+            if message:
+                yield message
+
+    # Träffarna i översättningsminnet får sin last_used i en commit per chunk
+    get_translation_memory().flush()
+
+def snapshot_kind(system_prompt_1, user_prompt_1, system_prompt_2, user_prompt_2):
+    # Nya promptar ger andra texter, så de ingår i deltalägets nyckel
+    digest = prompt_hash(system_prompt_1, user_prompt_1, system_prompt_2, user_prompt_2)
+    return 'descriptions-' + digest[:16]
+
+
+def rewrite_descriptions_two_steps_function(
+    upload_folder, input_file, system_prompt_1, user_prompt_1, system_prompt_2,
+    user_prompt_2, max_workers=MAX_CONCURRENT_REQUESTS, streaming=None,
+    chunk_size=CHUNK_SIZE, delta=DELTA_MODE, stream_output=STREAM_OUTPUT,
+    validate_output=VALIDATION_MODE, previous_folder=None
+):
+    try:
+        input_csv = os.path.join(upload_folder, input_file)
+        if streaming is None:
+            streaming = should_stream(input_csv)
+
         output_filename = "rewritten_descriptions_all.csv"
-        selected_columns = ['Product ID', 'SKU', 'Description', 'Description (Rewrite Step 1)', 'Description (Rewritten)']
-        input_df[selected_columns].to_csv(os.path.join(upload_folder, output_filename), index=False)
-        yield json.dumps({"complete": True, "file": output_filename}) + "\n\n"
+        output_path = os.path.join(upload_folder, output_filename)
+        step_columns = {1: 'Description (Rewrite Step 1)', 2: 'Description (Rewritten)'}
+        selected_columns = (
+            ['Product ID', 'SKU', 'Description'] + list(step_columns.values())
+        )
+        prompts = {
+            1: (system_prompt_1, user_prompt_1),
+            2: (system_prompt_2, user_prompt_2)
+        }
+        quality_column = 'Quality'
+        if validate_output:
+            selected_columns.append(quality_column)
+
+        def add_columns(frame):
+            quality = [quality_column] if validate_output else []
+            for column in list(step_columns.values()) + quality:
+                if column not in frame.columns:
+                    frame[column] = ''
+
+        def validate_rows(frame):
+            # Underkända beskrivningar skrivs om igen; steg 1 görs om bara om även det
+            # är underkänt
+            def rerequest(index):
+                text = frame.at[index, 'Description']
+                step_1_text = frame.at[index, step_columns[1]]
+                values = {}
+                problems = check(
+                    pd.Series([text]), pd.Series([step_1_text]), LENGTH_SLACK,
+                    translated=False
+                )
+                if problems.iat[0]:
+                    step_1_text = rewrite_single_description(text, *prompts[1])
+                    values[step_columns[1]] = step_1_text
+                values[step_columns[2]] = rewrite_single_description(
+                    step_1_text, *prompts[2]
+                )
+                return values
+
+            result = validate(
+                frame, 'Description', step_columns[2], quality_column, rerequest,
+                pools[1], LENGTH_SLACK, translated=False, journal=journal
+            )
+            state["retried"] += result["retried"]
+            state["flagged"] += result["flagged"]
+
+        # Resultat från ett avbrutet försök med samma fil och promptar återanvänds
+        journal = ResultJournal(journal_path(
+            upload_folder, 'descriptions', file_digest(input_csv),
+            system_prompt_1, user_prompt_1, system_prompt_2, user_prompt_2
+        ))
+        replayed = journal.replay()
+        state = {
+            "step_columns": step_columns, "done": {1: 0, 2: 0}, "cache_hits": 0,
+            "reused": 0, "retried": 0, "flagged": 0, "ticker": ProgressTicker()
+        }
+
+        # Deltaläge: oförändrade rader (samma SKU/Product ID och källtext) tar texterna
+        # från förra körningen av samma katalog. previous_folder: var tidigare körningar
+        # finns (shards)
+        kind = snapshot_kind(
+            system_prompt_1, user_prompt_1, system_prompt_2, user_prompt_2
+        )
+        previous = load_previous_results(
+            previous_folder or upload_folder, kind, input_csv, 'Description',
+            list(step_columns.values())
+        ) if delta else None
+        if previous is not None:
+            yield json.dumps({"delta": os.path.basename(previous.path)}) + "\n\n"
+
+        live = LiveText() if stream_output else None
+
+        # Båda stegen har egna pooler så att steg 2 aldrig blir stående bakom en lång kö
+        # av steg 1
+        pools = {
+            1: ContextThreadPoolExecutor(max_workers=max_workers),
+            2: ContextThreadPoolExecutor(max_workers=max_workers)
+        }
+        with journal:
+            try:
+                if streaming:
+                    # Strömmande läge: varje chunk skrivs till utfilen när alla dess
+                    # rader är klara
+                    state["total_rows"] = count_rows(input_csv)
+                    state["exact_total"] = False
+                    logging.info(
+                        f"Streaming {input_file} (~{state['total_rows']} rows) "
+                        f"in chunks of {chunk_size}"
+                    )
+                    with ChunkedCsvWriter([(output_path, selected_columns)]) as writer:
+                        chunks = iter_chunks(input_csv, chunk_size, dtype={'SKU': str})
+                        for chunk in chunks:
+                            add_columns(chunk)
+                            yield from _rewrite_chunk(
+                                chunk, pools, prompts, journal, replayed, state,
+                                previous=previous, live=live
+                            )
+                            if validate_output:
+                                validate_rows(chunk)
+                            writer.write(chunk)
+                            inc('translator_rows_processed_total', len(chunk),
+                                pipeline='descriptions')
+                else:
+                    input_df = load_frame(input_csv, dtype={'SKU': str})
+                    state["total_rows"] = len(input_df)
+                    state["exact_total"] = True
+                    add_columns(input_df)
+
+                    with open(output_path, 'w', newline='', encoding='utf-8') as output:
+                        # Färdiga rader skrivs direkt i den ordning de blir klara
+                        writer = csv.writer(output)
+                        writer.writerow(selected_columns)
+
+                        def write_row(index):
+                            with timed('translator_csv_seconds_total', op='write'):
+                                row = input_df.loc[index, selected_columns]
+                                writer.writerow(row.tolist())
+                                output.flush()
+                            inc('translator_rows_processed_total',
+                                pipeline='descriptions')
+
+                        yield from _rewrite_chunk(
+                            input_df, pools, prompts, journal, replayed, state,
+                            write_row, previous, live
+                        )
+
+                    if validate_output:
+                        validate_rows(input_df)
+
+                    # Spara slutlig fil i samma radordning som indata
+                    write_outputs(input_df, [(output_path, selected_columns)])
+            finally:
+                # Avbryt köade anrop om klienten kopplar ner mitt i jobbet
+                pools[1].shutdown(wait=False, cancel_futures=True)
+                pools[2].shutdown(wait=False, cancel_futures=True)
+
+        journal.remove()
+        save_snapshot(upload_folder, kind, output_path)
+        # Sista progressen innan complete, så att staplarna inte stannar strax under
+        # slutet
+        yield from state["ticker"].flush()
+        yield json.dumps({
+            "complete": True,
+            "file": output_filename,
+            "cache_hits": state["cache_hits"],
+            "reused": state["reused"],
+            "retried": state["retried"],
+            "flagged": state["flagged"]
+        }) + "\n\n"
 
     except Exception as e:
         error_msg = f"Fatal error in rewriting process: {str(e)}"
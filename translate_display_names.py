@@ -1,14 +1,40 @@
 # translate_display_names.py
 
-from language_config import get_language_mapping, get_reverse_mapping, get_language_code
-import pandas as pd
-from openai import OpenAI
-import os
 import json
-import sys
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
-from time import sleep
+import os
+import sys
+from concurrent.futures import as_completed
+
+import pandas as pd
+from openai import RateLimitError
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+from csv_stream import (
+    CHUNK_SIZE,
+    ChunkedCsvWriter,
+    count_rows,
+    iter_chunks,
+    needs_work,
+    should_stream,
+)
+from delta import DELTA_MODE, load_previous_results, save_snapshot
+from example_index import ExampleIndex
+from glossary import get_glossary
+from journal import ResultJournal, file_digest, journal_path, write_outputs
+from language_config import QUALITY_COLUMN, get_language_code, get_language_column
+from metrics import ContextThreadPoolExecutor, inc, record_retry
+from openai_client import get_openai_client
+from progress import ProgressTicker
+from request_scheduler import create_chat_completion
+from translation_memory import get_translation_memory, prompt_hash
+from upload_store import load_frame
+from validation import VALIDATION_MODE, validate
 
 # Configure logging
 logging.basicConfig(
@@ -17,43 +43,76 @@ logging.basicConfig(
     stream=sys.stdout
 )
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Delad klient med anslutningspool för båda pipelinerna
+client = get_openai_client()
 
-def load_translation_examples(examples_df, target_language):
-    target_code = get_language_code(target_language)
-    target_column = f'Display name - {target_code}'
+MODEL = "gpt-4o-mini-2024-07-18"
 
+# Övre gräns för samtidiga API-anrop över alla rader och språk; schemaläggaren
+# anpassar den faktiska samtidigheten efter kontots gränser
+MAX_CONCURRENT_REQUESTS = int(os.getenv('TRANSLATION_CONCURRENCY', '32'))
+# Antal display names per API-anrop (1 = en rad per anrop)
+BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', '50'))
+# Antal mest liknande exempel per display name, och tak för en hel batch (under det
+# gamla fasta blocket på 21 exempel, så att även stora batcher får kortare prompter)
+EXAMPLES_TOP_K = int(os.getenv('TRANSLATION_EXAMPLES_TOP_K', '8'))
+MAX_BATCH_EXAMPLES = int(os.getenv('TRANSLATION_MAX_BATCH_EXAMPLES', '12'))
+# 'per_language' = ett anrop per språk, 'multi_language' = alla valda språk
+# i samma anrop
+TRANSLATION_MODE = os.getenv('TRANSLATION_MODE', 'per_language')
+# Ett översatt namn får vara så många tecken längre än valideringens längdkvot tillåter
+LENGTH_SLACK = 20
+
+# Svaret på en batchprompt matchade inte den begärda JSON-arrayen
+class BatchFormatError(ValueError):
+    pass
+
+def load_example_index(examples_df, target_language):
+    target_column = get_language_column(target_language)
     if target_column in examples_df.columns:
-        examples = examples_df[['Display Name', target_column]].dropna().head(21)
-        if not examples.empty:
-            example_text = "\n".join([
-                f"Original: {row['Display Name']} -> Translated: {row[target_column]}"
-                for _, row in examples.iterrows()
-            ])
-            return example_text, True
-    return "", False
-
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def translate_display_name(text, target_language, examples, has_language_examples):
+        return ExampleIndex.from_dataframe(examples_df, target_column)
+    return None
+
+def system_prompt(target_language):
+    return (
+        "You are a translator for an e-commerce store specializing in men's "
+        "accessories like ties. Use the examples to translate the display names "
+        f"correctly to {target_language}."
+    )
+
+def translation_prompt_hash(target_language, examples):
+    # Ingår i cachenyckeln så att nya exempel eller prompter ger nya översättningar.
+    # Pipelinen skickar hela exempelpoolens fingeravtryck så att valet av exempel
+    # per batch inte påverkar nyckeln.
+    return prompt_hash(system_prompt(target_language), examples)
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+       retry=retry_if_not_exception_type(RateLimitError),
+       before_sleep=record_retry)
+def translate_display_name(text, target_language, examples, has_language_examples,
+                           examples_hash=None):
     if pd.isna(text) or not text.strip():
         return ""
 
     if has_language_examples:
         prompt = (
-            f"Here are examples of how display names have been translated to {target_language}:\n{examples}\n\n"
-            f"Original display name: '{text}'. Translate the display name to {target_language} according to the examples above. "
+            f"Here are examples of how display names have been translated to "
+            f"{target_language}:\n{examples}\n\n"
+            f"Original display name: '{text}'. Translate the display name to "
+            f"{target_language} according to the examples above. "
             f"Only the translation, without extra information."
         )
     else:
         return "No examples available"
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
+        response = create_chat_completion(
+            client,
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": f"You are a translator for an e-commerce store specializing in men's accessories like ties. Use the examples to translate the display names correctly to {target_language}."
+                    "content": system_prompt(target_language)
                 },
                 {
                     "role": "user",
@@ -64,125 +123,707 @@ def translate_display_name(text, target_language, examples, has_language_example
             timeout=1200
         )
 
-        translated_text = response.choices[0].message.content.strip().strip('"').strip("'")
+        translated_text = clean_translation(response.choices[0].message.content)
+        if translated_text:
+            get_translation_memory().put(
+                text, target_language, MODEL,
+                examples_hash or translation_prompt_hash(target_language, examples),
+                translated_text
+            )
         return translated_text
     except Exception as e:
         logging.error(f"Error during translation of '{text}' to {target_language}: {e}")
         raise
 
-def translate_display_names_function(upload_folder, input_file, examples_file, selected_languages):
-    BATCH_SIZE = 50
+def clean_translation(text):
+    return text.strip().strip('"').strip("'")
+
+def text_positions(texts):
+    # Index för texter som faktiskt ska översättas (inte tomma eller NaN)
+    return [i for i, text in enumerate(texts) if not pd.isna(text) and text.strip()]
+
+def batch_payload(texts):
+    return json.dumps(
+        [{"id": i, "text": text} for i, text in enumerate(texts)], ensure_ascii=False
+    )
+
+def _parse_batch_reply(content, expected_count):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").split("\n", 1)[-1]
+    try:
+        items = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise BatchFormatError(f"Reply is not valid JSON: {e}") from e
+
+    if not isinstance(items, list) or len(items) != expected_count:
+        raise BatchFormatError(f"Expected a JSON array with {expected_count} items")
+
+    translations = []
+    for position, item in enumerate(items):
+        if (not isinstance(item, dict) or item.get("id") != position
+                or not isinstance(item.get("translation"), str)):
+            raise BatchFormatError(f"Item {position} is missing or out of order")
+        translations.append(clean_translation(item["translation"]))
+    return translations
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+       retry=retry_if_not_exception_type((BatchFormatError, RateLimitError)),
+       before_sleep=record_retry)
+def _request_display_name_batch(texts, target_language, examples):
+    prompt = (
+        f"Here are examples of how display names have been translated to "
+        f"{target_language}:\n{examples}\n\n"
+        f"Translate each of the following display names to {target_language} "
+        f"according to the examples above:\n"
+        f"{batch_payload(texts)}\n\n"
+        f"Reply with only a JSON array containing exactly {len(texts)} objects in the "
+        f"same order, each of the form "
+        f"{{\"id\": <id>, \"translation\": \"<translated display name>\"}}."
+    )
+
+    response = create_chat_completion(
+        client,
+        model=MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": system_prompt(target_language)
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.2,
+        timeout=1200
+    )
+    return _parse_batch_reply(response.choices[0].message.content, len(texts))
+
+# Översätter flera display names i ett anrop och returnerar en översättning per text,
+# i samma ordning. Ett felformaterat svar delas upp i två mindre batchar, ner till
+# en rad.
+def translate_display_names_batch(texts, target_language, examples,
+                                  has_language_examples, examples_hash=None):
+    if not has_language_examples:
+        return ["No examples available"] * len(texts)
+
+    results = [""] * len(texts)
+    positions = text_positions(texts)
+    if not positions:
+        return results
+
+    if len(positions) == 1:
+        results[positions[0]] = translate_display_name(
+            texts[positions[0]], target_language, examples, True, examples_hash
+        )
+        return results
+
+    batch_texts = [texts[i] for i in positions]
+    try:
+        translations = _request_display_name_batch(
+            batch_texts, target_language, examples
+        )
+    except BatchFormatError as e:
+        logging.warning(
+            f"Malformed batch reply for {len(batch_texts)} names to {target_language} "
+            f"({e}), splitting batch"
+        )
+        middle = len(batch_texts) // 2
+        translations = [
+            translated
+            for half in (batch_texts[:middle], batch_texts[middle:])
+            for translated in translate_display_names_batch(
+                half, target_language, examples, True, examples_hash
+            )
+        ]
+    else:
+        memory = get_translation_memory()
+        examples_hash = examples_hash or translation_prompt_hash(
+            target_language, examples
+        )
+        for text, translated in zip(batch_texts, translations, strict=True):
+            if translated:
+                memory.put(text, target_language, MODEL, examples_hash, translated)
+
+    for i, translated in zip(positions, translations, strict=True):
+        results[i] = translated
+    return results
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+       retry=retry_if_not_exception_type((BatchFormatError, RateLimitError)),
+       before_sleep=record_retry)
+def _request_multi_language_batch(texts, target_languages, examples_by_language):
+    codes = [get_language_code(language) for language in target_languages]
+    example_blocks = "\n\n".join(
+        f"Examples for {language} ({code}):\n{examples_by_language[language]}"
+        for language, code in zip(target_languages, codes, strict=True)
+    )
+    language_list = ", ".join(
+        f"{language} ({code})"
+        for language, code in zip(target_languages, codes, strict=True)
+    )
+    prompt = (
+        f"Here are examples of how display names have been translated:\n"
+        f"{example_blocks}\n\n"
+        f"Translate each of the following display names to {language_list} according "
+        f"to the examples above:\n"
+        f"{batch_payload(texts)}\n\n"
+        f"Reply with a JSON object of the form {{\"items\": [...]}} where items "
+        f"contains exactly {len(texts)} objects in the same order, each of the form "
+        f"{{\"id\": <id>, "
+        f"\"translations\": {{<language code>: \"<translated display name>\"}}}} "
+        f"with one entry for each of these language codes: {', '.join(codes)}."
+    )
+
+    response = create_chat_completion(
+        client,
+        model=MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": system_prompt(", ".join(target_languages))
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.2,
+        timeout=1200
+    )
+
+    try:
+        items = json.loads(response.choices[0].message.content).get("items")
+    except (json.JSONDecodeError, AttributeError) as e:
+        raise BatchFormatError(f"Reply is not a JSON object: {e}") from e
+    if not isinstance(items, list) or len(items) != len(texts):
+        raise BatchFormatError(f"Expected {len(texts)} items")
+
+    results = {language: [] for language in target_languages}
+    for position, item in enumerate(items):
+        if (not isinstance(item, dict) or item.get("id") != position
+                or not isinstance(item.get("translations"), dict)):
+            raise BatchFormatError(f"Item {position} is missing or out of order")
+        translations = item["translations"]
+        for language, code in zip(target_languages, codes, strict=True):
+            if not isinstance(translations.get(code), str):
+                raise BatchFormatError(f"Item {position} has no translation for {code}")
+            results[language].append(clean_translation(translations[code]))
+    return results
+
+# Översätter flera display names till alla angivna språk i ett anrop. Returnerar
+# {språk: [översättning per text]}. Exemplen skickas per språk från exempelfilens
+# kolumner.
+def translate_display_names_multi(texts, target_languages, examples_by_language,
+                                  examples_hashes=None):
+    examples_hashes = examples_hashes or {}
+    results = {language: [""] * len(texts) for language in target_languages}
+    positions = text_positions(texts)
+    if not positions:
+        return results
+
+    batch_texts = [texts[i] for i in positions]
+    try:
+        translations = _request_multi_language_batch(
+            batch_texts, target_languages, examples_by_language
+        )
+    except BatchFormatError as e:
+        if len(batch_texts) == 1:
+            logging.warning(
+                f"Malformed multi-language reply for '{batch_texts[0]}' ({e}), "
+                f"translating per language"
+            )
+            translations = {
+                language: translate_display_names_batch(
+                    batch_texts, language, examples_by_language[language], True,
+                    examples_hashes.get(language)
+                )
+                for language in target_languages
+            }
+        else:
+            logging.warning(
+                f"Malformed multi-language reply for {len(batch_texts)} names ({e}), "
+                f"splitting batch"
+            )
+            middle = len(batch_texts) // 2
+            first = translate_display_names_multi(
+                batch_texts[:middle], target_languages, examples_by_language,
+                examples_hashes
+            )
+            second = translate_display_names_multi(
+                batch_texts[middle:], target_languages, examples_by_language,
+                examples_hashes
+            )
+            translations = {
+                language: first[language] + second[language]
+                for language in target_languages
+            }
+    else:
+        # Samma minnesnyckel som i per_language-läget, så båda lägena delar cache
+        memory = get_translation_memory()
+        for language in target_languages:
+            examples_hash = examples_hashes.get(language) or translation_prompt_hash(
+                language, examples_by_language[language]
+            )
+            pairs = zip(batch_texts, translations[language], strict=True)
+            for text, translated in pairs:
+                if translated:
+                    memory.put(text, language, MODEL, examples_hash, translated)
+
+    for language in target_languages:
+        for i, translated in zip(positions, translations[language], strict=True):
+            results[language][i] = translated
+    return results
+
+def _translate_language_batch(texts, target_language, examples, examples_hash):
+    return {target_language: translate_display_names_batch(
+        texts, target_language, examples, True, examples_hash
+    )}
+
+def _fill_locally(chunk, job, target_language, memory):
+    # Fyller i celler från glossaret och översättningsminnet och returnerar de rader
+    # (radindex) som fortfarande behöver ett API-anrop
+    column_name = job["column_name"]
+    pending = []
+    local = {}  # Samma namn förekommer ofta flera gånger i en export
+    texts = chunk.loc[needs_work(chunk[column_name]), 'Display Name']
+    for index, text in texts.items():
+        if pd.isna(text) or not str(text).strip():
+            pending.append(index)
+            continue
+
+        if text not in local:
+            translated = job["glossary"].translate(text)
+            if translated is not None:
+                local[text] = (translated, "glossary_hits")
+            else:
+                cached = memory.get(text, target_language, MODEL, job["examples_hash"])
+                local[text] = (
+                    (cached, "cache_hits") if cached is not None else (None, None)
+                )
+
+        translated, counter = local[text]
+        if translated is None:
+            pending.append(index)
+        else:
+            chunk.at[index, column_name] = translated
+            job[counter] += 1
+    return pending
+
+def _translate_chunk(executor, chunk, language_jobs, memory, journal, total_rows, mode,
+                     batch_size, ticker, complete_language=None):
+    # Översätter alla språk för raderna i chunk (hela filen i vanligt läge) och
+    # skriver resultaten direkt i chunk. Progress går som tick via ticker under tiden.
+    chunk_rows = len(chunk)
+    for target_language, job in language_jobs.items():
+        job["pending"] = _fill_locally(chunk, job, target_language, memory)
+        job["done"] += chunk_rows - len(job["pending"])
+        logging.info(
+            f"{target_language}: {job['glossary_hits']} rows from glossary, "
+            f"{job['cache_hits']} from translation memory, "
+            f"{len(job['pending'])} sent to the API"
+        )
+    # Alla språks träffar i chunken får sin last_used i en och samma commit
+    memory.flush()
+
+    def completed(target_language):
+        try:
+            return complete_language(target_language)
+        except Exception as e:
+            error_msg = f"Error processing language {target_language}: {str(e)}"
+            logging.error(error_msg)
+            return json.dumps({
+                "error": error_msg,
+                "language": target_language
+            }) + "\n\n"
+
+    def progress(job):
+        percent = int(job["done"] / total_rows * 100) if total_rows else 100
+        # I strömmande läge är totalen en uppskattning; 100 skickas först när
+        # språket är klart
+        return percent if complete_language else min(percent, 99)
+
+    # Varje future ger {språk: översättning per rad i batchen} och mappas till
+    # (batchens rader, {språk: rader som ska fyllas i för språket})
+    futures = {}
+    if mode == 'multi_language':
+        pending_by_row = {}
+        for target_language, job in language_jobs.items():
+            for index in job["pending"]:
+                pending_by_row.setdefault(index, []).append(target_language)
+        rows = sorted(pending_by_row)
+        logging.info(
+            f"Queueing {len(rows)} rows for {len(language_jobs)} languages "
+            f"in batches of {batch_size}"
+        )
+
+        for batch_start in range(0, len(rows), batch_size):
+            indices = rows[batch_start:batch_start + batch_size]
+            batch_languages = [
+                language for language in language_jobs
+                if any(language in pending_by_row[index] for index in indices)
+            ]
+            texts = chunk.loc[indices, 'Display Name'].tolist()
+            future = executor.submit(
+                translate_display_names_multi,
+                texts,
+                batch_languages,
+                {
+                    language: language_jobs[language]["example_index"].select(
+                        texts, EXAMPLES_TOP_K, MAX_BATCH_EXAMPLES
+                    )
+                    for language in batch_languages
+                },
+                {
+                    language: language_jobs[language]["examples_hash"]
+                    for language in batch_languages
+                }
+            )
+            futures[future] = (indices, {
+                language: [
+                    index for index in indices if language in pending_by_row[index]
+                ]
+                for language in batch_languages
+            })
+    else:
+        for target_language, job in language_jobs.items():
+            pending = job["pending"]
+            logging.info(
+                f"Queueing {len(pending)} rows for {target_language} "
+                f"in batches of {batch_size}"
+            )
+            for batch_start in range(0, len(pending), batch_size):
+                indices = pending[batch_start:batch_start + batch_size]
+                texts = chunk.loc[indices, 'Display Name'].tolist()
+                future = executor.submit(
+                    _translate_language_batch,
+                    texts,
+                    target_language,
+                    job["example_index"].select(
+                        texts, EXAMPLES_TOP_K, MAX_BATCH_EXAMPLES
+                    ),
+                    job["examples_hash"]
+                )
+                futures[future] = (indices, {target_language: indices})
+
+    if complete_language:
+        for target_language, job in language_jobs.items():
+            if job["done"] == total_rows:
+                message = completed(target_language)
+                if message:
+                    yield message
+
+    for future in as_completed(futures):
+        try:
+            results = future.result()
+        except Exception as e:
+            results = None
+            error = str(e)
+
+        batch_indices, assignments = futures[future]
+        for target_language, indices in assignments.items():
+            job = language_jobs[target_language]
+            batch = f"{indices[0]}-{indices[-1] + 1}"
+
+            if results is None:
+                error_msg = f"Error in batch {batch}: {error}"
+                logging.error(error_msg)
+                yield json.dumps({
+                    "error": error_msg,
+                    "language": target_language
+                }) + "\n\n"
+            else:
+                # I multi_language-läget kan batchen innehålla rader som redan
+                # var klara för språket
+                translated_by_index = dict(
+                    zip(batch_indices, results[target_language], strict=True)
+                )
+                for index in indices:
+                    translated = translated_by_index[index]
+                    chunk.at[index, job["column_name"]] = translated
+                    journal.append(index, job["column_name"], translated)
+
+            job["done"] += len(indices)
+            job["api_requests"] += 1
+            message = ticker.tick({
+                "progress": progress(job),
+                "cache_hits": job["cache_hits"],
+                "glossary_hits": job["glossary_hits"],
+                "api_requests": job["api_requests"]
+            }, target_language)
+            if message:
+                yield message
+
+            if complete_language and job["done"] == total_rows:
+                message = completed(target_language)
+                if message:
+                    yield message
+
+def translate_display_names_function(upload_folder, input_file, examples_file,
+                                     selected_languages,
+                                     max_workers=MAX_CONCURRENT_REQUESTS,
+                                     batch_size=BATCH_SIZE, mode=TRANSLATION_MODE,
+                                     streaming=None, chunk_size=CHUNK_SIZE,
+                                     delta=DELTA_MODE, validate_output=VALIDATION_MODE,
+                                     previous_folder=None):
     completed_languages = set()
     completed_files = []  # Track completed files for download
 
     try:
-        logging.info(f"Starting translation process for languages: {selected_languages}")
+        logging.info(
+            f"Starting translation process for languages: {selected_languages}"
+        )
         input_csv = os.path.join(upload_folder, input_file)
         examples_csv = os.path.join(upload_folder, examples_file)
 
-        input_df = pd.read_csv(input_csv, sep=',', dtype={'SKU': str})
-        examples_df = pd.read_csv(examples_csv, sep=',', dtype={'Display Name': str})
-        total_rows = len(input_df)
-
-        # Create columns for all selected languages
-        for language in selected_languages:
-            lang_code = get_language_code(language)
-            column_name = f'Display name - {lang_code}'
-            if column_name not in input_df.columns:
-                input_df[column_name] = ''
+        examples_df = load_frame(examples_csv, dtype={'Display Name': str})
+        if streaming is None:
+            streaming = should_stream(input_csv)
 
+        # Förbered varje språk: exempel, kolumn, glossar och minnesnyckel.
+        # Rader som redan finns i översättningsminnet eller som glossaret täcker helt
+        # fylls i direkt utan API-anrop.
+        memory = get_translation_memory()
+        language_jobs = {}
         for target_language in selected_languages:
-            if target_language in completed_languages:
+            if target_language in language_jobs:
                 logging.info(f"Skipping already completed language: {target_language}")
                 continue
 
-            try:
-                logging.info(f"Processing language: {target_language}")
-                examples, has_examples = load_translation_examples(examples_df, target_language)
-
-                if not has_examples:
-                    logging.warning(f"No examples found for language: {target_language}")
-                    yield json.dumps({"language": target_language, "progress": "no_examples"}) + "\n\n"
-                    continue
-
-                lang_code = get_language_code(target_language)
-                column_name = f'Display name - {lang_code}'
-
-                batch_start = 0
-                while batch_start < total_rows:
-                    batch_end = min(batch_start + BATCH_SIZE, total_rows)
-                    logging.info(f"Processing batch {batch_start}-{batch_end} for {target_language}")
-
-                    for index in range(batch_start, batch_end):
-                        try:
-                            if pd.isna(input_df.iloc[index][column_name]) or input_df.iloc[index][column_name] == "":
-                                translated = translate_display_name(
-                                    input_df.iloc[index]['Display Name'],
-                                    target_language,
-                                    examples,
-                                    has_examples
-                                )
-                                input_df.loc[index, column_name] = translated
-
-                            progress = int((index + 1) / total_rows * 100)
-
-                            yield json.dumps({
-                                "language": target_language, 
-                                "progress": progress,
-                                "batch": f"{batch_start}-{batch_end}"
-                            }) + "\n\n"
-
-                            sleep(0.3)
-
-                        except Exception as e:
-                            error_msg = f"Error at index {index}: {str(e)}"
-                            logging.error(error_msg)
-                            yield json.dumps({
-                                "error": error_msg,
-                                "language": target_language
-                            }) + "\n\n"
-                            continue
-
-                    batch_start += BATCH_SIZE
-
-                # Save individual language file
-                lang_filename = f"translated_display_names_{target_language}.csv"
-                lang_output_path = os.path.join(upload_folder, lang_filename)
-                selected_columns = ['Product ID', 'SKU', 'Display Name', column_name]
-                input_df[selected_columns].to_csv(lang_output_path, index=False)
-
-                completed_languages.add(target_language)
-                completed_files.append({
-                    "language": target_language,
-                    "file": lang_filename
-                })
-
+            # Exemplen väljs per batch efter likhet med raderna som ska översättas
+            example_index = load_example_index(examples_df, target_language)
+            if example_index is None or not len(example_index):
+                logging.warning(f"No examples found for language: {target_language}")
                 yield json.dumps({
-                    "language": target_language, 
-                    "progress": 100,
-                    "status": "complete",
-                    "file": lang_filename,
-                    "completed_files": completed_files  # Include list of completed files
+                    "language": target_language,
+                    "progress": "no_examples"
                 }) + "\n\n"
-
-            except Exception as e:
-                error_msg = f"Error processing language {target_language}: {str(e)}"
-                logging.error(error_msg)
-                yield json.dumps({"error": error_msg, "language": target_language}) + "\n\n"
                 continue
 
-        # Save final combined file
+            lang_code = get_language_code(target_language)
+            language_jobs[target_language] = {
+                "column_name": get_language_column(target_language),
+                "quality_column": get_language_column(target_language, QUALITY_COLUMN),
+                "example_index": example_index,
+                "examples_hash": translation_prompt_hash(
+                    target_language, example_index.fingerprint
+                ),
+                "glossary": get_glossary(lang_code, example_index.pairs),
+                "pending": [],
+                "done": 0,
+                "cache_hits": 0,
+                "glossary_hits": 0,
+                "api_requests": 0,
+                "retried": 0,
+                "flagged": 0,
+            }
+
+        base_columns = ['Product ID', 'SKU', 'Display Name']
+        language_columns = [
+            get_language_column(language) for language in selected_languages
+        ]
+
+        def output_columns(target_language):
+            # Språkets översättning och, om svaren valideras, dess kvalitetsflagga
+            job = language_jobs[target_language]
+            quality = [job["quality_column"]] if validate_output else []
+            return [job["column_name"]] + quality
+
+        def add_columns(frame):
+            # Create columns for all selected languages
+            for column_name in language_columns:
+                if column_name not in frame.columns:
+                    frame[column_name] = ''
+
+        def validate_language(frame, target_language):
+            # Underkända svar skickas om en rad i taget; flaggan för varje rad hamnar
+            # i utfilerna
+            job = language_jobs[target_language]
+
+            def rerequest(index):
+                text = frame.at[index, 'Display Name']
+                examples = job["example_index"].select(
+                    [text], EXAMPLES_TOP_K, MAX_BATCH_EXAMPLES
+                )
+                return {job["column_name"]: translate_display_name(
+                    text, target_language, examples, True, job["examples_hash"]
+                )}
+
+            result = validate(
+                frame, 'Display Name', job["column_name"], job["quality_column"],
+                rerequest, executor, LENGTH_SLACK,
+                glossary_terms=job["glossary"].terms, journal=journal
+            )
+            job["retried"] += result["retried"]
+            job["flagged"] += result["flagged"]
+
+        def language_output(target_language):
+            lang_filename = f"translated_display_names_{target_language}.csv"
+            return lang_filename, os.path.join(upload_folder, lang_filename)
+
+        def finish_language(target_language, frame):
+            # Språket är färdigöversatt: validera och skriv språkets fil direkt så att
+            # den kan laddas ner medan övriga språk pågår. Kolumnen i frame är samma
+            # värden som journalen.
+            if validate_output:
+                validate_language(frame, target_language)
+            write_outputs(frame, [(
+                language_output(target_language)[1],
+                base_columns + output_columns(target_language)
+            )])
+            return complete_language(target_language)
+
+        def complete_language(target_language):
+            lang_filename = language_output(target_language)[0]
+            completed_languages.add(target_language)
+            completed_files.append({
+                "language": target_language,
+                "file": lang_filename
+            })
+
+            return json.dumps({
+                "language": target_language,
+                "progress": 100,
+                "status": "complete",
+                "file": lang_filename,
+                "cache_hits": language_jobs[target_language]["cache_hits"],
+                "glossary_hits": language_jobs[target_language]["glossary_hits"],
+                "api_requests": language_jobs[target_language]["api_requests"],
+                "retried": language_jobs[target_language]["retried"],
+                "flagged": language_jobs[target_language]["flagged"]
+            }) + "\n\n"
+
+        # Betalda resultat från ett tidigare, avbrutet försök med samma filer läses
+        # tillbaka från journalen; de cellerna räknas sedan som klara.
+        journal = ResultJournal(journal_path(
+            upload_folder, 'display_names', file_digest(input_csv),
+            file_digest(examples_csv)
+        ))
+        replayed = journal.replay()
+        if replayed:
+            logging.info(
+                f"Resuming {len(replayed)} translated cells from {journal.path}"
+            )
+            yield json.dumps({"resumed": len(replayed)}) + "\n\n"
+
+        def apply_replayed(frame):
+            for (index, column), value in replayed.items():
+                if column in frame.columns and index in frame.index:
+                    frame.at[index, column] = value
+
+        # Deltaläge: rader med samma SKU/Product ID och oförändrad källtext tar
+        # översättningarna från förra körningen av samma katalog. previous_folder: var
+        # tidigare körningar finns, om inte i upload_folder (shards)
+        previous = load_previous_results(
+            previous_folder or upload_folder, 'display_names', input_csv,
+            'Display Name', language_columns
+        ) if delta else None
+        reused = 0
+        if previous is not None:
+            yield json.dumps({"delta": os.path.basename(previous.path)}) + "\n\n"
+
+        def apply_previous(frame):
+            nonlocal reused
+            if previous is None:
+                return None
+            rows = previous.apply(frame)
+            reused += rows
+            return json.dumps({"reused": reused}) + "\n\n" if rows else None
+
         output_filename = "translated_display_names_all.csv"
         output_file = os.path.join(upload_folder, output_filename)
-        selected_columns = ['Product ID', 'SKU', 'Display Name'] + [
-            f'Display name - {get_language_code(lang)}' 
-            for lang in completed_languages
-        ]
 
-        input_df[selected_columns].to_csv(output_file, index=False)
+        # Alla anrop (över rader och språk) delar samma pool så att max_workers
+        # förfrågningar alltid är i luften. Resultaten skrivs bara från den här
+        # tråden, så input_df behöver inget lås.
+        executor = ContextThreadPoolExecutor(max_workers=max_workers)
+        ticker = ProgressTicker()
+        with journal:
+            try:
+                if streaming:
+                    # Strömmande läge: en chunk i taget läses, översätts och läggs
+                    # till i utfilerna, så minnet begränsas av chunkstorleken och inte
+                    # filens storlek
+                    total_rows = count_rows(input_csv)
+                    logging.info(
+                        f"Streaming {input_file} (~{total_rows} rows) "
+                        f"in chunks of {chunk_size}"
+                    )
+                    all_columns = [
+                        column for language in selected_languages
+                        if language in language_jobs
+                        for column in output_columns(language)
+                    ]
+                    outputs = [
+                        (language_output(language)[1],
+                         base_columns + output_columns(language))
+                        for language in language_jobs
+                    ] + [(output_file, base_columns + all_columns)]
+                    with ChunkedCsvWriter(outputs) as writer:
+                        chunks = iter_chunks(input_csv, chunk_size, dtype={'SKU': str})
+                        for chunk in chunks:
+                            add_columns(chunk)
+                            apply_replayed(chunk)
+                            reused_event = apply_previous(chunk)
+                            if reused_event:
+                                yield reused_event
+                            yield from _translate_chunk(
+                                executor, chunk, language_jobs, memory, journal,
+                                total_rows, mode, batch_size, ticker
+                            )
+                            if validate_output:
+                                for target_language in language_jobs:
+                                    validate_language(chunk, target_language)
+                            writer.write(chunk)
+                            inc('translator_rows_processed_total', len(chunk),
+                                pipeline='display_names')
+
+                    for target_language in language_jobs:
+                        yield complete_language(target_language)
+                else:
+                    input_df = load_frame(input_csv, dtype={'SKU': str})
+                    total_rows = len(input_df)
+                    add_columns(input_df)
+                    apply_replayed(input_df)
+                    reused_event = apply_previous(input_df)
+                    if reused_event:
+                        yield reused_event
+                    yield from _translate_chunk(
+                        executor, input_df, language_jobs, memory, journal, total_rows,
+                        mode, batch_size, ticker,
+                        complete_language=lambda language: finish_language(
+                            language, input_df
+                        )
+                    )
+                    inc('translator_rows_processed_total', total_rows,
+                        pipeline='display_names')
+
+                    # Den samlade filen skrivs i ett pass när alla språk är klara
+                    finished = [
+                        language for language in selected_languages
+                        if language in completed_languages
+                    ]
+                    write_outputs(input_df, [
+                        (output_file, base_columns + [
+                            column for language in finished
+                            for column in output_columns(language)
+                        ])
+                    ])
+            finally:
+                # Avbryt köade anrop om klienten kopplar ner mitt i jobbet
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        # Allt finns nu i utfilerna; journalen behövs bara för att återuppta
+        # avbrutna körningar
+        journal.remove()
+        save_snapshot(upload_folder, 'display_names', output_file)
         yield json.dumps({
             "complete": True,
             "file": output_filename,
+            "reused": reused,
+            "flagged": sum(job["flagged"] for job in language_jobs.values()),
             "completed_files": completed_files,  # Include all completed files
             "completed_languages": list(completed_languages)
         }) + "\n\n"
@@ -190,4 +831,4 @@ def translate_display_names_function(upload_folder, input_file, examples_file, s
     except Exception as e:
         error_msg = f"Fatal error in translation process: {str(e)}"
         logging.error(error_msg)
-        yield json.dumps({"error": error_msg}) + "\n\n"
\ No newline at end of file
+        yield json.dumps({"error": error_msg}) + "\n\n"
@@ -0,0 +1,146 @@
+# translation_memory.py
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+MEMORY_FILE = os.getenv('TRANSLATION_MEMORY_PATH', 'translation_memory.sqlite3')
+MAX_ENTRIES = int(os.getenv('TRANSLATION_MEMORY_MAX_ENTRIES', '200000'))
+TTL_SECONDS = int(os.getenv('TRANSLATION_MEMORY_TTL_DAYS', '90')) * 24 * 3600
+EVICT_EVERY = 500  # Kör städning efter så här många nya poster
+# Träffarnas last_used skrivs samlat efter så här många träffar (och vid flush), inte
+# en UPDATE och commit per träff
+TOUCH_EVERY = 500
+
+_memory = None
+_memory_lock = Lock()
+
+
+def normalize_text(text):
+    # Samma namn med olika blanksteg ska ge samma nyckel
+    return " ".join(str(text).split())
+
+
+def prompt_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class TranslationMemory:
+    def __init__(self, path=MEMORY_FILE, max_entries=MAX_ENTRIES,
+                 ttl_seconds=TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = Lock()
+        self.puts_since_evict = 0
+        # Träffar vars last_used ännu inte skrivits: {nyckel: tidpunkt}
+        self.touched = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_used ON translations (last_used)"
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(text, target_language, model, prompt_digest):
+        return prompt_hash(normalize_text(text), target_language, model, prompt_digest)
+
+    def get(self, text, target_language, model, prompt_digest):
+        key = self.make_key(text, target_language, model, prompt_digest)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self.touched.pop(key, None)
+                self.conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.touched[key] = now
+            if len(self.touched) >= TOUCH_EVERY:
+                self._write_touched()
+                self.conn.commit()
+            return value
+
+    def put(self, text, target_language, model, prompt_digest, value):
+        key = self.make_key(text, target_language, model, prompt_digest)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations "
+                "(key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self.conn.commit()
+            self.puts_since_evict += 1
+            if self.puts_since_evict >= EVICT_EVERY:
+                self._evict(now)
+
+    def flush(self):
+        # Skriver väntande last_used i en enda transaktion; anropas efter varje batch
+        # eller chunk med uppslag
+        with self.lock:
+            if self.touched:
+                self._write_touched()
+                self.conn.commit()
+
+    def _write_touched(self):
+        # Anropas med self.lock hållet; anroparen committar
+        self.conn.executemany(
+            "UPDATE translations SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self.touched.items()]
+        )
+        self.touched = {}
+
+    def _evict(self, now):
+        # Anropas med self.lock hållet. Väntande träffar skrivs först så att nyss
+        # använda poster inte rensas som minst nyligen använda.
+        self.puts_since_evict = 0
+        if self.touched:
+            self._write_touched()
+        if self.ttl_seconds:
+            self.conn.execute(
+                "DELETE FROM translations WHERE created_at < ?",
+                (now - self.ttl_seconds,)
+            )
+        count = self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM translations WHERE key IN "
+                "(SELECT key FROM translations ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            )
+            logging.info(
+                f"Translation memory evicted {overflow} least recently used entries"
+            )
+        self.conn.commit()
+
+
+def get_translation_memory():
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory
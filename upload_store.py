@@ -0,0 +1,155 @@
+# upload_store.py
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+import pandas as pd
+
+import metrics
+from csv_stream import read_csv
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # Extrat 'feather' (pyarrow); utan det cachas tabellerna som pickle
+    feather = None
+
+STORE_FOLDER = 'store'
+MAX_STORE_BYTES = int(os.getenv('UPLOAD_STORE_MAX_MB', '2048')) * 1024 * 1024
+MAX_AGE_SECONDS = float(os.getenv('UPLOAD_STORE_MAX_AGE_DAYS', '30')) * 24 * 3600
+# Filer som använts nyligen rensas aldrig: en uppladdning vars jobb ännu inte skapats
+# finns inte bland de pinnade filerna
+EVICTION_GRACE_SECONDS = 3600
+
+
+def _store_folder(upload_folder):
+    folder = os.path.join(upload_folder, STORE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def store_upload(file, upload_folder, pinned=()):
+    # Sparar en uppladdad fil (werkzeug FileStorage) under sin SHA-256. Samma innehåll
+    # lagras bara en gång. Returnerar sökvägen relativt upload_folder.
+    # pinned: filer (relativt upload_folder) som ej avslutade jobb läser
+    folder = _store_folder(upload_folder)
+    digest = hashlib.sha256()
+    temp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}")
+    try:
+        with open(temp_path, 'wb') as f:
+            for block in iter(lambda: file.stream.read(1 << 20), b''):
+                digest.update(block)
+                f.write(block)
+        name = f"{digest.hexdigest()}.csv"
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            logging.info(f"Upload {file.filename} is already stored as {name}")
+        else:
+            os.replace(temp_path, path)
+            logging.info(f"Stored upload {file.filename} as {name}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    touch(path)
+    evict(upload_folder, pinned=pinned)
+    return os.path.join(STORE_FOLDER, name)
+
+
+def touch(path):
+    # Senast använd = mtime på CSV-filen; styr rensningen
+    os.utime(path, None)
+
+
+def _cache_path(path, kwargs):
+    described = json.dumps(kwargs, sort_keys=True, default=str)
+    key = hashlib.sha256(described.encode('utf-8')).hexdigest()[:16]
+    extension = 'feather' if feather is not None else 'pkl'
+    return f"{os.path.splitext(path)[0]}-{key}.{extension}"
+
+
+def is_stored(path):
+    folder, name = os.path.split(path)
+    return os.path.basename(folder) == STORE_FOLDER and name.endswith('.csv')
+
+
+def load_frame(path, **kwargs):
+    # Som read_csv, men filer i förrådet tolkas bara första gången; därefter läses
+    # tabellen från en binär cache (Arrow IPC, minnesmappad, om pyarrow finns).
+    # Filnamnet är innehållets hash, så cachen kan aldrig bli inaktuell.
+    if not is_stored(path) or any(callable(value) for value in kwargs.values()):
+        return read_csv(path, **kwargs)
+
+    touch(path)
+    cache_path = _cache_path(path, kwargs)
+    if os.path.exists(cache_path):
+        try:
+            with metrics.timed('translator_csv_seconds_total', op='cache_read'):
+                if feather is not None:
+                    return feather.read_feather(cache_path, memory_map=True)
+                return pd.read_pickle(cache_path)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable parse cache {cache_path}: {str(e)}")
+
+    frame = read_csv(path, **kwargs)
+    temp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        if feather is not None:
+            feather.write_feather(frame, temp_path)
+        else:
+            frame.to_pickle(temp_path)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        # T.ex. kolumner med blandade typer som Arrow inte kan lagra; då tolkas CSV:n
+        # varje gång
+        logging.warning(f"Could not cache parsed {path}: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return frame
+
+
+def _digest(name):
+    # <sha256>.csv och dess cachar <sha256>-<nyckel>.feather/.pkl
+    return name.split('-', 1)[0].split('.', 1)[0]
+
+
+def evict(upload_folder, max_bytes=MAX_STORE_BYTES, max_age=MAX_AGE_SECONDS,
+          pinned=()):
+    # Tar bort uppladdningar (med sina cachar) som är för gamla, och därefter de minst
+    # nyligen använda tills förrådet ryms inom max_bytes. Pinnade filer (indata till
+    # jobb som inte är klara) behålls alltid.
+    folder = _store_folder(upload_folder)
+    keep = {_digest(os.path.basename(path)) for path in pinned if is_stored(path)}
+    entries = {}
+    for name in os.listdir(folder):
+        if name.startswith('.'):
+            continue
+        digest = _digest(name)
+        if digest in keep:
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entry = entries.setdefault(digest, {"paths": [], "size": 0, "used": 0.0})
+        entry["paths"].append(path)
+        entry["size"] += stat.st_size
+        entry["used"] = max(entry["used"], stat.st_mtime)
+
+    now = time.time()
+    total = sum(entry["size"] for entry in entries.values())
+    for digest, entry in sorted(entries.items(), key=lambda item: item[1]["used"]):
+        if now - entry["used"] < EVICTION_GRACE_SECONDS:
+            break
+        if now - entry["used"] <= max_age and total <= max_bytes:
+            break
+        for path in entry["paths"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        total -= entry["size"]
+        logging.info(f"Evicted stored upload {digest}")
@@ -0,0 +1,139 @@
+# validation.py
+#
+# Kontroll av modellens svar innan de skrivs till utfilerna. Reglerna körs
+# vektoriserat över hela kolumner; bara raderna som inte går igenom skickas om, och
+# varje rad får en kvalitetsflagga (ok, retried eller de regler som fortfarande inte
+# uppfylls).
+
+import logging
+import os
+import re
+from concurrent.futures import as_completed
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+VALIDATION_MODE = os.getenv('OUTPUT_VALIDATION', '1') == '1'
+# Så många gånger skickas en underkänd rad om innan flaggan får stå kvar
+VALIDATION_RETRIES = int(os.getenv('VALIDATION_RETRIES', '1'))
+# Svaret får vara högst så här många gånger längre än källtexten (plus pipelinens
+# marginal)
+MAX_LENGTH_RATIO = float(os.getenv('VALIDATION_MAX_LENGTH_RATIO', '3'))
+
+NO_EXAMPLES = "No examples available"
+QUALITY_OK = 'ok'
+QUALITY_RETRIED = 'retried'
+
+# Engelska småord som inte förekommer i målspråken; finns de kvar är namnet inte
+# översatt
+ENGLISH_MARKERS = re.compile(r"\b(?:the|with|without|your)\b", re.IGNORECASE)
+WORD = re.compile(r"[^\W\d_]{3,}")
+
+
+@lru_cache(maxsize=64)
+def _glossary_rule(terms):
+    # Ett mönster för alla källtermer (längsta först) och {källterm: målterm}
+    targets = {}
+    for source, target in terms:
+        key = " ".join(source.lower().split())
+        if key and target:
+            targets[key] = target.casefold()
+    if not targets:
+        return None, targets
+    alternatives = sorted(targets, key=len, reverse=True)
+    words = (r"\s+".join(map(re.escape, term.split())) for term in alternatives)
+    pattern = re.compile(r"\b(" + "|".join(words) + r")\b", re.IGNORECASE)
+    return pattern, targets
+
+
+def _glossary_missing(source, output, terms):
+    pattern, targets = _glossary_rule(tuple(terms))
+    missing = pd.Series(False, index=source.index)
+    if pattern is None:
+        return missing
+    hits = source.str.findall(pattern)
+    # Bara rader där en glossarterm finns i källan behöver jämföras term för term
+    candidates = hits[(hits.str.len() > 0) & (output != '')]
+    folded = output[candidates.index].str.casefold()
+    for index, found in candidates.items():
+        text = folded[index]
+        missing[index] = any(
+            targets[" ".join(term.lower().split())] not in text for term in found
+        )
+    return missing
+
+
+def check(source, output, length_slack, translated=True, glossary_terms=()):
+    # Ger regelnamnen per rad, kommaseparerade ('' = godkänd)
+    source = source.fillna('').astype(str).str.strip()
+    output = output.fillna('').astype(str).str.strip()
+    has_source = source != ''
+    rules = {
+        "empty": has_source & (output == ''),
+        "no_examples": output.str.casefold() == NO_EXAMPLES.casefold(),
+        "too_long": (
+            output.str.len() > source.str.len() * MAX_LENGTH_RATIO + length_slack
+        ),
+    }
+    if translated:
+        unchanged = (
+            (output.str.casefold() == source.str.casefold())
+            & source.str.contains(WORD)
+        )
+        rules["untranslated"] = has_source & (
+            unchanged | output.str.contains(ENGLISH_MARKERS)
+        )
+    if glossary_terms:
+        rules["glossary"] = _glossary_missing(source, output, glossary_terms)
+
+    flags = pd.Series('', index=source.index)
+    for name, failed in rules.items():
+        flags = flags + np.where(failed, name + ',', '')
+    return flags.str.rstrip(',')
+
+
+def validate(frame, source_column, output_column, quality_column, rerequest, executor,
+             length_slack, translated=True, glossary_terms=(), journal=None):
+    # Kontrollerar output_column, skickar om underkända rader och skriver
+    # quality_column. rerequest(index) körs i executor och ger {kolumn: nytt värde}
+    # för raden.
+    flags = check(
+        frame[source_column], frame[output_column], length_slack, translated,
+        glossary_terms
+    )
+    retried = pd.Series(False, index=frame.index)
+    for _ in range(VALIDATION_RETRIES):
+        failing = flags.index[flags != '']
+        if not len(failing) or rerequest is None:
+            break
+        futures = {executor.submit(rerequest, index): index for index in failing}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                values = future.result()
+            except Exception as e:
+                logging.error(
+                    f"Re-request for row {index} ({flags[index]}) failed: {e}"
+                )
+                continue
+            for column, value in values.items():
+                frame.at[index, column] = value
+                if journal is not None:
+                    journal.append(index, column, value)
+        retried[failing] = True
+        flags[failing] = check(
+            frame.loc[failing, source_column], frame.loc[failing, output_column],
+            length_slack, translated, glossary_terms
+        )
+
+    frame[quality_column] = flags.where(
+        flags != '', np.where(retried, QUALITY_RETRIED, QUALITY_OK)
+    )
+    flagged = int((flags != '').sum())
+    if retried.any() or flagged:
+        logging.info(
+            f"Validated {output_column}: {int(retried.sum())} rows re-requested, "
+            f"{flagged} still flagged"
+        )
+    return {"retried": int(retried.sum()), "flagged": flagged}